@@ -0,0 +1,209 @@
+"""本地假 Telegram Bot API 服务器（压测 / 回放用）
+
+    python benchmarks/fake_telegram.py --port 8081 --latency-ms 40 --jitter-ms 20 --rate-429 0.02
+
+机器人设置 TELEGRAM_API_URL=http://127.0.0.1:8081/bot{0}/{1} 后所有 Bot API 调用都打到这里。
+支持 sendMessage / sendDocument / editMessageText / getChat / getChatMember / getMe / getUpdates，
+其余方法一律返回 true。每个请求先睡 latency + 随机 jitter，发送类方法按 --rate-429 的概率
+返回 429 + retry_after。GET /_stats 返回调用计数和每条消息的到达时间（replay.py 用来算端到端延迟）。
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SEND_METHODS = ("sendMessage", "sendDocument")
+
+
+def _chat(chat_id):
+    if chat_id is not None and chat_id < 0:
+        return {"id": chat_id, "type": "supergroup", "title": f"Group{-chat_id}"}
+    return {"id": chat_id, "type": "private", "first_name": f"User{chat_id}"}
+
+
+def _message(server, chat_id, params, **extra):
+    msg = {"message_id": server.next_message_id(), "date": int(time.time()), "chat": _chat(chat_id)}
+    if "text" in params:
+        msg["text"] = params["text"]
+    msg.update(extra)
+    return msg
+
+
+RESPONDERS = {
+    "sendMessage": lambda server, chat_id, params: _message(server, chat_id, params),
+    "sendDocument": lambda server, chat_id, params: _message(
+        server, chat_id, params, document={"file_id": "fake", "file_unique_id": "fake"}),
+    "editMessageText": lambda server, chat_id, params: _message(server, chat_id, params),
+    "getChat": lambda server, chat_id, params: _chat(chat_id),
+    "getChatMember": lambda server, chat_id, params: {
+        "user": {"id": _int(params.get("user_id")), "is_bot": False, "first_name": f"User{params.get('user_id')}"},
+        "status": "member",
+    },
+    "getMe": lambda server, chat_id, params: {
+        "id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot",
+    },
+}
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    server_version = "FakeTelegram/1.0"
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _params(self, url):
+        """telebot 把参数放在 query string；也兼容表单和 JSON body"""
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return params
+        body = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            params.update(json.loads(body or b"{}"))
+        elif content_type.startswith("application/x-www-form-urlencoded"):
+            params.update({k: v[-1] for k, v in parse_qs(body.decode("utf-8")).items()})
+        # multipart（sendDocument 的文件）只读掉不解析
+        return params
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/_stats":
+            self._reply(200, self.server.stats())
+            return
+        self._api(url)
+
+    def do_POST(self):
+        self._api(urlparse(self.path))
+
+    def _api(self, url):
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+        method = parts[1]
+        params = self._params(url)
+        server = self.server
+
+        if method == "getUpdates":
+            # 没有 update 可发，按长轮询的样子等一会儿
+            time.sleep(min(float(params.get("timeout") or 0), 1.0))
+            self._reply(200, {"ok": True, "result": []})
+            return
+
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+        chat_id = _int(params.get("chat_id"))
+        if method in server.limited_methods and random.random() < server.rate_429:
+            server.record(method, chat_id, limited=True)
+            self._reply(429, {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {server.retry_after}",
+                "parameters": {"retry_after": server.retry_after},
+            })
+            return
+        responder = RESPONDERS.get(method)
+        result = responder(server, chat_id, params) if responder else True
+        server.record(method, chat_id)
+        self._reply(200, {"ok": True, "result": result})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=0.0, jitter_ms=0.0, rate_429=0.0, retry_after=1,
+                 limited_methods=SEND_METHODS):
+        super().__init__(address, FakeTelegramHandler)
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.limited_methods = set(limited_methods)
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self._calls = Counter()
+        self._limited = Counter()
+        self._chats = Counter()
+        self._sends = []   # (到达时间, 方法, chat_id)
+
+    def next_message_id(self):
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def record(self, method, chat_id, limited=False):
+        with self._lock:
+            if limited:
+                self._limited[method] += 1
+                return
+            self._calls[method] += 1
+            if method in SEND_METHODS:
+                self._chats["group" if chat_id is not None and chat_id < 0 else "private"] += 1
+                self._sends.append((time.time(), method, chat_id))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": dict(self._calls),
+                "rate_limited": dict(self._limited),
+                "sends_by_chat_type": dict(self._chats),
+                "sends": list(self._sends),
+            }
+
+
+def make_server(host="127.0.0.1", port=8081, **options):
+    return FakeTelegramServer((host, port), **options)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for api.telegram.org")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="probability of a 429 per send call")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--limited-methods", default=",".join(SEND_METHODS),
+                        help="comma separated methods that may get a 429")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = make_server(
+        args.host, args.port,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        rate_429=args.rate_429, retry_after=args.retry_after,
+        limited_methods=[m.strip() for m in args.limited_methods.split(",") if m.strip()],
+    )
+    print(f"🧪 Fake Bot API on http://{args.host}:{server.server_address[1]}/bot{{0}}/{{1}}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
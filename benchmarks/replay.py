@@ -0,0 +1,405 @@
+"""录制 update 的回放压测：经 webhook 入口喂给真实的 handler，Bot API 打到本地假服务器
+
+    # 线上录制：RECORD_UPDATES_FILE=/data/updates.jsonl python bot.py
+    python benchmarks/replay.py updates.jsonl --speed 10
+    python benchmarks/replay.py --burst 300 --window 60 --speed 0 --latency-ms 50 --rate-429 0.05
+    # 回放给另外启动的 bot.py（WEBHOOK_URL + TELEGRAM_API_URL 指向这里打印的地址）
+    python benchmarks/replay.py updates.jsonl --target http://127.0.0.1:8080/ --secret S --api-port 8081
+
+默认在本进程里启动机器人（数据在临时目录，和正式运行一样启动发送队列、update 分片和持久化线程，
+不启动未打卡提醒），假 Bot API 服务器在单独的子进程里。每条 update 按录制的时间间隔 / --speed
+POST 到 webhook（--speed 0 表示不等待），同一个人的 update 由同一个发送线程按顺序发出。
+报告：webhook 应答延迟、handler 延迟（排队 + 执行，仅本进程模式）、从 POST 到私聊回复到达
+假服务器的端到端延迟、吞吐量、各 Bot API 方法调用 / 429 次数，可用 --output 写成 JSON。
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from bisect import bisect_left
+from collections import defaultdict
+
+from run import percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BURST_BUTTONS = ("🏢 Check In", "🍽 Eat", "↩ Return")
+BURST_FIRST_UID = 8_000_000_000
+
+
+# ===== 输入 =====
+
+def load_recording(path):
+    """[(录制时间, update dict)]，兼容每行直接是 update 的文件"""
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "update" in entry:
+                items.append((float(entry.get("t", 0)), entry["update"]))
+            else:
+                items.append((float(entry.get("message", {}).get("date", 0)), entry))
+    items.sort(key=lambda item: item[0])
+    return items
+
+
+def synthesize_burst(users, window, seed=1):
+    """换班高峰：每个人在 window 秒内 Check In，之后 Eat，再 Return"""
+    rng = random.Random(seed)
+    base = time.time()
+    items = []
+    for i in range(users):
+        uid = BURST_FIRST_UID + i
+        t = base + rng.uniform(0, window)
+        for text in BURST_BUTTONS:
+            items.append((t, {
+                "message": {
+                    "message_id": len(items) + 1,
+                    "from": {"id": uid, "is_bot": False, "first_name": f"Burst{i}"},
+                    "chat": {"id": uid, "type": "private", "first_name": f"Burst{i}"},
+                    "date": int(t),
+                    "text": text,
+                },
+            }))
+            t += rng.uniform(5, window)
+    items.sort(key=lambda item: item[0])
+    for update_id, (_, update) in enumerate(items, start=1):
+        update["update_id"] = update_id
+    return items
+
+
+def sender_uid(update):
+    """update 来自谁；没有发送者的按 0 处理"""
+    for key in ("message", "edited_message", "callback_query", "chat_member"):
+        obj = update.get(key)
+        if obj and obj.get("from"):
+            return obj["from"]["id"]
+    return 0
+
+
+def expects_private_reply(update):
+    """私聊按钮 / 命令：机器人会回一条私聊"""
+    message = update.get("message")
+    return bool(message and message.get("text") and message.get("chat", {}).get("type") == "private")
+
+
+# ===== 假 Bot API 子进程 =====
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def http_json(url, timeout=5):
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+def start_fake_api(args):
+    port = args.api_port or free_port()
+    cmd = [sys.executable, os.path.join(HERE, "fake_telegram.py"), "--port", str(port),
+           "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+           "--rate-429", str(args.rate_429), "--retry-after", str(args.retry_after)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    stats_url = f"http://127.0.0.1:{port}/_stats"
+    for _ in range(100):
+        try:
+            http_json(stats_url, timeout=1)
+            return proc, port
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("❌ Fake Bot API did not start")
+
+
+# ===== 本进程内的机器人 =====
+
+class InProcessBot:
+    """和 bot.py 的 __main__ 一样启动各个组件，只是 update 从本地 webhook 进来"""
+
+    def __init__(self, api_port, secret):
+        os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{api_port}/bot{{0}}/{{1}}"
+        os.environ.setdefault("LATE_BOT_TOKEN", "1:replay-late")
+        os.environ.setdefault("LATE_GROUP_ID", "-1002")
+        os.environ.pop("RECORD_UPDATES_FILE", None)
+        import workload
+        self.bot = bot = workload.bot
+        self._data_dir = tempfile.TemporaryDirectory(prefix="attendance-bench-")
+        self.data_dir = workload.sandbox(self._data_dir.name)
+
+        bot.load_attendance()
+        bot.load_registered_users()
+        bot.load_user_names()
+        bot.load_runtime_state()
+        bot.reorder_handlers()
+        bot.start_persistence_worker()
+        bot.load_activity_timers()
+        bot.OUTBOUND.start()
+        bot.UPDATES.start()
+        threading.Thread(target=bot.activity_timer_loop, daemon=True).start()
+
+        # handler 延迟：从进入分片队列到执行完
+        self.handler_samples = []
+        exec_task = bot.UPDATES.exec_task
+
+        def timed_exec_task(task, *task_args, **kwargs):
+            queued = time.perf_counter()
+
+            def run(*a, **kw):
+                try:
+                    task(*a, **kw)
+                finally:
+                    self.handler_samples.append(time.perf_counter() - queued)
+            exec_task(run, *task_args, **kwargs)
+        bot.bot._exec_task = timed_exec_task
+
+        self.server = bot.make_webhook_server(host="127.0.0.1", port=0, secret=secret)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address[:2]
+        self.url = f"http://{host}:{port}{self.server.webhook_path}"
+
+    def busy(self):
+        return sum(self.bot.UPDATES.depth()) > 0
+
+    def stats(self):
+        bot = self.bot
+        return {
+            "handler": summarize_ms(self.handler_samples),
+            "outbound": dict(bot.OUTBOUND.stats),
+            "outbound_backlog": bot.OUTBOUND.depth(),
+            "webhook": dict(bot.WEBHOOK_STATS),
+        }
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.bot.OUTBOUND.stop()
+        self.bot.UPDATES.stop()
+        self.bot.stop_persistence_worker()
+        self.bot.get_storage().close()
+        self._data_dir.cleanup()
+
+
+# ===== 回放 =====
+
+def summarize_ms(samples):
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+def replay(items, url, secret, speed, senders):
+    """按录制间隔发出所有 update；返回每条的 (uid, update, 发送时间, 应答耗时, HTTP 状态)"""
+    lanes = [queue.Queue() for _ in range(senders)]
+    results = []
+    results_lock = threading.Lock()
+    first_t = items[0][0] if items else 0
+    started = time.monotonic()
+
+    def post(update):
+        req = urllib.request.Request(url, data=json.dumps(update).encode("utf-8"), method="POST", headers={
+            "Content-Type": "application/json",
+            "X-Telegram-Bot-Api-Secret-Token": secret,
+        })
+        try:
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except OSError:
+            return 0
+
+    def worker(lane):
+        while True:
+            item = lane.get()
+            if item is None:
+                return
+            t, update = item
+            if speed > 0:
+                delay = started + (t - first_t) / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            sent_at = time.time()
+            ack_started = time.perf_counter()
+            status = post(update)
+            ack = time.perf_counter() - ack_started
+            with results_lock:
+                results.append((sender_uid(update), update, sent_at, ack, status))
+
+    threads = [threading.Thread(target=worker, args=(lane,), daemon=True) for lane in lanes]
+    for t in threads:
+        t.start()
+    for t, update in items:
+        lanes[sender_uid(update) % senders].put((t, update))
+    for lane in lanes:
+        lane.put(None)
+    for t in threads:
+        t.join()
+    return results
+
+
+def wait_for_replies(api_stats_url, expected, local, settle, timeout):
+    """等所有私聊回复到达（或 settle 秒内没有新的私聊 / 超时）"""
+    deadline = time.monotonic() + timeout
+    last_count, last_change = -1, time.monotonic()
+    while time.monotonic() < deadline:
+        stats = http_json(api_stats_url)
+        private = stats["sends_by_chat_type"].get("private", 0)
+        if private != last_count:
+            last_count, last_change = private, time.monotonic()
+        idle = local is None or not local.busy()
+        if idle and (private >= expected or time.monotonic() - last_change >= settle):
+            return stats
+        time.sleep(0.2)
+    return http_json(api_stats_url)
+
+
+def match_replies(results, sends):
+    """每条私聊 update 对应它发出之后、发给同一个人的第一条消息"""
+    by_chat = defaultdict(list)
+    for at, method, chat_id in sends:
+        if chat_id is not None and chat_id > 0:
+            by_chat[chat_id].append(at)
+    for times in by_chat.values():
+        times.sort()
+    used = defaultdict(int)
+    latencies = []
+    for uid, update, sent_at, _, status in sorted(results, key=lambda r: r[2]):
+        if status != 200 or not expects_private_reply(update):
+            continue
+        times = by_chat.get(uid, [])
+        idx = max(bisect_left(times, sent_at), used[uid])
+        if idx < len(times):
+            latencies.append(times[idx] - sent_at)
+            used[uid] = idx + 1
+    return latencies
+
+
+def build_report(args, items, results, api_stats, local, elapsed):
+    acks = [r[3] for r in results if r[4] == 200]
+    failed = sum(1 for r in results if r[4] != 200)
+    expected = sum(1 for r in results if r[4] == 200 and expects_private_reply(r[1]))
+    replies = match_replies(results, api_stats["sends"])
+    sent_times = [r[2] for r in results]
+    reply_end = max((t for t, _, _ in api_stats["sends"]), default=max(sent_times, default=0))
+    span = max(reply_end - min(sent_times, default=reply_end), 1e-9)
+    report = {
+        "input": args.recording or f"burst:{args.burst}",
+        "updates": len(items),
+        "failed_posts": failed,
+        "speed": args.speed,
+        "send_s": round(elapsed, 2),
+        "ingest_per_s": round(len(results) / max(elapsed, 1e-9), 1),
+        "replied_per_s": round(len(replies) / span, 1),
+        "ack": summarize_ms(acks),
+        "reply": summarize_ms(replies),
+        "replies_matched": f"{len(replies)}/{expected}",
+        "api_calls": api_stats["calls"],
+        "api_rate_limited": api_stats["rate_limited"],
+        "api_sends_by_chat_type": api_stats["sends_by_chat_type"],
+        "fake_api": {"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "rate_429": args.rate_429},
+    }
+    if local is not None:
+        report.update(local.stats())
+    return report
+
+
+def print_report(report):
+    fmt = lambda s: f"p50 {s['p50_ms']:.1f} ms  p99 {s['p99_ms']:.1f} ms  max {s['max_ms']:.1f} ms  (n={s['count']})"
+    print(f"📼 {report['input']}: {report['updates']} updates, {report['failed_posts']} failed posts")
+    print(f"  sent in {report['send_s']} s (speed {report['speed']}x)  "
+          f"ingest {report['ingest_per_s']}/s  replies {report['replied_per_s']}/s")
+    print(f"  webhook ack   {fmt(report['ack'])}")
+    if "handler" in report:
+        print(f"  handler       {fmt(report['handler'])}")
+    print(f"  reply (e2e)   {fmt(report['reply'])}  matched {report['replies_matched']}")
+    print(f"  api calls     {report['api_calls']}  429s {report['api_rate_limited']}")
+    if "outbound" in report:
+        ob = report["outbound"]
+        print(f"  outbound      sent {ob['sent']}  failed {ob['failed']}  retried {ob['retried']}  "
+              f"rate limited {ob['rate_limited']}  backlog {report['outbound_backlog']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded updates against the bot and a fake Bot API")
+    parser.add_argument("recording", nargs="?", help="JSONL written with RECORD_UPDATES_FILE")
+    parser.add_argument("--burst", type=int, help="synthesize a shift-change burst for this many users instead")
+    parser.add_argument("--window", type=float, default=60.0, help="burst spread in recorded seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = original pace, 10 = 10x faster, 0 = no waiting")
+    parser.add_argument("--senders", type=int, default=8, help="concurrent webhook posters")
+    parser.add_argument("--target", help="webhook URL of a separately started bot.py (default: run the bot in-process)")
+    parser.add_argument("--secret", default="", help="webhook secret token")
+    parser.add_argument("--api-port", type=int, default=0, help="fake Bot API port (default: any free port)")
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--settle", type=float, default=3.0, help="stop waiting after this many seconds without a reply")
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args(argv)
+    if not args.recording and not args.burst:
+        parser.error("give a recording file or --burst N")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    items = load_recording(args.recording) if args.recording else synthesize_burst(args.burst, args.window, args.seed)
+    if not items:
+        raise SystemExit("❌ Nothing to replay")
+
+    api_proc, api_port = start_fake_api(args)
+    local = None
+    try:
+        if args.target:
+            url, secret = args.target, args.secret
+            print(f"🧪 Fake Bot API: TELEGRAM_API_URL=http://127.0.0.1:{api_port}/bot{{0}}/{{1}}")
+        else:
+            secret = args.secret or "replay"
+            local = InProcessBot(api_port, secret)
+            url = local.url
+
+        started = time.monotonic()
+        results = replay(items, url, secret, args.speed, max(1, args.senders))
+        elapsed = time.monotonic() - started
+        expected = sum(1 for r in results if r[4] == 200 and expects_private_reply(r[1]))
+        api_stats = wait_for_replies(f"http://127.0.0.1:{api_port}/_stats", expected, local,
+                                     args.settle, args.drain_timeout)
+        report = build_report(args, items, results, api_stats, local, elapsed)
+    finally:
+        if local is not None:
+            local.stop()
+        api_proc.terminate()
+        api_proc.wait(timeout=5)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ Report written to {args.output}")
+    return 0 if report["failed_posts"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
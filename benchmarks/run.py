@@ -0,0 +1,319 @@
+"""考勤热路径基准测试
+
+    python benchmarks/run.py --users 300 --months 12 --backend json --output bench.json
+    python benchmarks/run.py --cases check_in,check_out --compare old.json
+
+每个 case 在单独的子进程里跑（这样峰值 RSS 只算这个 case），流程都一样：
+生成 N 个用户 × M 个月的合成历史 → 按 backend 写盘 → load_attendance() → 计时。
+结果（每个 case 的 p50 / p99 / 峰值 RSS）写成 JSON；--compare 和旧结果对比，
+p50 或 p99 变慢超过 --threshold 时退出码为 1。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time as time_mod
+from datetime import datetime, timedelta, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+FLUSH_EDITS = 50        # 每次 flush 前修改的天数
+FLUSHES_PER_ROUND = 10
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位是 KB，macOS 是字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def timed(fn, *args):
+    started = time_mod.perf_counter()
+    fn(*args)
+    return time_mod.perf_counter() - started
+
+
+def percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return 0.0
+    idx = min(len(sorted_samples) - 1, max(0, int(round(pct / 100 * len(sorted_samples) + 0.5)) - 1))
+    return sorted_samples[idx]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    ms = lambda s: round(s * 1000, 4)
+    return {
+        "samples": len(ordered),
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        "max_ms": ms(ordered[-1]) if ordered else 0.0,
+    }
+
+
+# ===== cases =====
+# 每个 case 接收 ctx，返回每次调用的耗时（秒）
+
+def bench_load_attendance(ctx):
+    bot = ctx.bot
+    samples = []
+    for _ in range(ctx.repeat):
+        bot.get_storage().close()
+        bot.ATTENDANCE.clear()
+        bot.STORAGE = bot.make_storage(ctx.backend)
+        samples.append(timed(bot.load_attendance))
+    return samples
+
+
+def bench_save_attendance(ctx):
+    return [timed(ctx.bot.save_attendance) for _ in range(ctx.repeat)]
+
+
+def bench_flush_dirty(ctx):
+    bot = ctx.bot
+    month_key = ctx.today.strftime("%Y-%m")
+    date_keys = [(ctx.today - timedelta(days=d)).strftime("%Y-%m-%d") for d in range(ctx.today.day)]
+    samples = []
+    for _ in range(ctx.repeat * FLUSHES_PER_ROUND):
+        for _ in range(FLUSH_EDITS):
+            uid = ctx.rng.choice(ctx.uids)
+            with bot.edit_day(uid, month_key, ctx.rng.choice(date_keys)) as rec:
+                rec.late_minutes = ctx.rng.randint(0, 30)
+        samples.append(timed(bot.flush_dirty))
+    return samples
+
+
+def bench_get_attendance_summary(ctx):
+    bot = ctx.bot
+    bot.now = lambda: ctx.now
+    return [timed(bot.get_attendance_summary, uid) for _ in range(ctx.repeat) for uid in ctx.uids]
+
+
+def _shift_times(ctx, uid, day):
+    """某人某天的 (上班时间, 下班时间)，FINDING 按早班"""
+    shift_key = ctx.roles[uid] if ctx.roles[uid] != "FINDING" else "FINDING_M"
+    start, end, end_offset = ctx.workload.SHIFT_TIMES[shift_key]
+    tz = ctx.bot.LOCAL_TZ
+    checkin = datetime.combine(day, start, tzinfo=tz) + timedelta(minutes=ctx.rng.uniform(-10, 15))
+    checkout = datetime.combine(day + timedelta(days=end_offset), end, tzinfo=tz) + timedelta(minutes=ctx.rng.uniform(-3, 20))
+    return checkin, checkout
+
+
+def _check_in_out_rounds(ctx, measure):
+    """每一轮所有人在一个新的日期上班再下班；measure 是 "check_in" 或 "check_out" """
+    bot = ctx.bot
+    samples = []
+    for r in range(ctx.repeat):
+        day = ctx.today + timedelta(days=1 + r)
+        times = {uid: _shift_times(ctx, uid, day) for uid in ctx.uids}
+        for phase, fn in (("check_in", bot.check_in), ("check_out", bot.check_out)):
+            for uid in ctx.uids:
+                ctx.workload.freeze_clock(times[uid][0 if phase == "check_in" else 1])
+                elapsed = timed(fn, uid, f"User{uid % 100000}")
+                if phase == measure:
+                    samples.append(elapsed)
+    return samples
+
+
+def bench_check_in(ctx):
+    return _check_in_out_rounds(ctx, "check_in")
+
+
+def bench_check_out(ctx):
+    return _check_in_out_rounds(ctx, "check_out")
+
+
+def bench_missed_checkin_tick(ctx):
+    """今天所有截止时间都已过：每次都重建当天的堆并处理所有批次"""
+    bot = ctx.bot
+    tick_at = datetime.combine(ctx.today, time(20, 40), tzinfo=bot.LOCAL_TZ)
+    ctx.workload.freeze_clock(tick_at)
+    bot.MISSED_CHECK_GRACE = 86400
+    samples = []
+    for _ in range(ctx.repeat):
+        with bot._deadline_lock:
+            bot._deadline_day = None
+        bot.MISSED_CHECK_SENT.clear()
+        samples.append(timed(bot.missed_checkin_tick, tick_at))
+    return samples
+
+
+CASES = {
+    "load_attendance": bench_load_attendance,
+    "save_attendance": bench_save_attendance,
+    "flush_dirty": bench_flush_dirty,
+    "get_attendance_summary": bench_get_attendance_summary,
+    "check_in": bench_check_in,
+    "check_out": bench_check_out,
+    "missed_checkin_tick": bench_missed_checkin_tick,
+}
+
+
+class Context:
+    pass
+
+
+def run_case(name, args):
+    """子进程里执行一个 case，返回结果 dict；数据目录用完即删"""
+    with tempfile.TemporaryDirectory(prefix="attendance-bench-") as directory:
+        return _run_case(name, args, directory)
+
+
+def _run_case(name, args, directory):
+    import workload
+    bot = workload.bot
+
+    workload.sandbox(directory)
+    workload.install_stub()
+    started = time_mod.perf_counter()
+    info = workload.generate(args.users, args.months, seed=args.seed)
+    generate_s = time_mod.perf_counter() - started
+
+    bot.STORAGE = bot.make_storage(args.backend)
+    workload.write_initial_snapshot(args.backend)
+    # 和正式启动一样从磁盘加载（monthly / binary 第一次会在这里完成转换）
+    bot.ATTENDANCE.clear()
+    bot.load_attendance()
+    workload.hold_persistence()
+
+    ctx = Context()
+    ctx.bot, ctx.workload, ctx.backend, ctx.repeat = bot, workload, args.backend, args.repeat
+    ctx.rng = random.Random(args.seed + 1)
+    ctx.roles = info["roles"]
+    ctx.uids = sorted(info["roles"])
+    ctx.today = info["today"]
+    ctx.now = datetime.combine(ctx.today, time(12, 0), tzinfo=bot.LOCAL_TZ)
+
+    rss_before = peak_rss_mb()
+    samples = CASES[name](ctx)
+    result = summarize(samples)
+    result["rss_before_mb"] = round(rss_before, 1)
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    result["days"] = info["days"]
+    result["generate_s"] = round(generate_s, 2)
+    result["api_calls"] = dict(bot.bot.calls)
+    bot.stop_persistence_worker()
+    bot.get_storage().close()
+    return result
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def case_args(args):
+    return ["--users", str(args.users), "--months", str(args.months), "--backend", args.backend,
+            "--repeat", str(args.repeat), "--seed", str(args.seed)]
+
+
+def run_all(args):
+    names = [n.strip() for n in args.cases.split(",") if n.strip()] if args.cases else list(CASES)
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        sys.exit(f"unknown case(s): {', '.join(unknown)}; available: {', '.join(CASES)}")
+
+    results = {}
+    for name in names:
+        fd, result_file = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        cmd = [sys.executable, os.path.abspath(__file__), "--case", name, "--result-file", result_file] + case_args(args)
+        proc = subprocess.run(cmd, stdout=None if args.verbose else subprocess.DEVNULL)
+        try:
+            if proc.returncode != 0:
+                print(f"❌ {name}: exit {proc.returncode}")
+                continue
+            with open(result_file, "r", encoding="utf-8") as f:
+                results[name] = json.load(f)
+        finally:
+            os.unlink(result_file)
+        r = results[name]
+        print(f"{name:<24} n={r['samples']:<6} p50 {r['p50_ms']:>10.3f} ms  p99 {r['p99_ms']:>10.3f} ms  "
+              f"peak RSS {r['peak_rss_mb']:.0f} MB")
+
+    report = {
+        "meta": {
+            "users": args.users,
+            "months": args.months,
+            "backend": args.backend,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+        },
+        "cases": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Results written to {args.output}")
+
+    if args.compare:
+        return compare(report, args.compare, args.threshold)
+    return 0 if len(results) == len(names) else 1
+
+
+def compare(report, baseline_path, threshold):
+    """和旧结果对比 p50 / p99，返回退出码"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("meta", {}).get("users") != report["meta"]["users"] or \
+            baseline.get("meta", {}).get("months") != report["meta"]["months"]:
+        print("⚠️ Baseline was run with a different users/months size")
+    regressions = 0
+    print(f"\nvs {baseline_path} ({baseline.get('meta', {}).get('revision')})")
+    for name, new in report["cases"].items():
+        old = baseline.get("cases", {}).get(name)
+        if not old:
+            continue
+        cols = []
+        for key in ("p50_ms", "p99_ms"):
+            ratio = new[key] / old[key] if old[key] else 1.0
+            flag = " ⚠️" if ratio > 1 + threshold else ""
+            regressions += bool(flag)
+            cols.append(f"{key[:3]} {old[key]:.3f} → {new[key]:.3f} ({ratio:.2f}x){flag}")
+        print(f"{name:<24} " + "  ".join(cols))
+    return 1 if regressions else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Attendance bot hot-path benchmarks")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--backend", default="json", choices=("json", "sqlite", "monthly", "binary"))
+    parser.add_argument("--repeat", type=int, default=5, help="rounds per case")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cases", help=f"comma separated subset of: {', '.join(CASES)}")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before flagging (0.2 = 20%%)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="show the bot's own output")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.case:
+        result = run_case(args.case, args)
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return 0
+    return run_all(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""合成考勤负载：N 个用户 × M 个月的 HR / FINDING / PROMO 历史，以及不联网的 Bot API 替身
+
+只供 benchmarks/ 使用。导入前会补齐 BOT_TOKEN 等环境变量；sandbox() 把 bot.py 的数据文件
+全部改到临时目录，install_stub() 把 Telegram 调用全部换成 StubTelegram。
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time as time_mod
+from collections import Counter
+from datetime import datetime, timedelta, time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("GROUP_CHAT_ID", "-1001")
+
+import bot  # noqa: E402
+
+FIRST_UID = 7_000_000_000
+LATE_GROUP_ID = -1002
+
+# 角色占比（剩下的都是 PROMO 夜班）
+ROLE_MIX = (("HR", 0.3), ("FINDING", 0.3))
+ABSENCE_RATE = 0.1        # 当天没来
+EARLY_LEAVE_RATE = 0.05   # 提前下班
+HR_SECOND_SLOT_RATE = 0.05
+FINDING_DOUBLE_RATE = 0.3  # 早班和晚班都上
+
+# 每个角色的上班 / 下班时间，下班第二天的加 1 天；抖动单位为分钟
+SHIFT_TIMES = {
+    "HR": (time(9, 0), time(19, 0), 0),
+    "FINDING_M": (time(7, 0), time(12, 0), 0),
+    "FINDING_N": (time(19, 0), time(2, 0), 1),
+    "PROMO": (time(20, 30), time(9, 30), 1),
+}
+
+
+class StubTelegram:
+    """代替 telebot.TeleBot：不联网，只按方法计数"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._message_id = 0
+
+    def _count(self, method):
+        with self._lock:
+            self.calls[method] += 1
+            self._message_id += 1
+            return self._message_id
+
+    def send_message(self, chat_id, text, **kwargs):
+        return SimpleNamespace(message_id=self._count("sendMessage"), chat=SimpleNamespace(id=chat_id))
+
+    def reply_to(self, message, text, **kwargs):
+        return self.send_message(message.chat.id, text, **kwargs)
+
+    def send_document(self, chat_id, document, **kwargs):
+        return SimpleNamespace(message_id=self._count("sendDocument"), chat=SimpleNamespace(id=chat_id))
+
+    def get_chat(self, chat_id):
+        self._count("getChat")
+        return SimpleNamespace(id=chat_id, first_name=f"User{chat_id % 100000}")
+
+    def get_chat_member(self, chat_id, user_id):
+        self._count("getChatMember")
+        return SimpleNamespace(status="member", user=SimpleNamespace(id=user_id))
+
+
+def sandbox(directory=None):
+    """把所有数据文件放到临时目录；返回目录"""
+    directory = directory or tempfile.mkdtemp(prefix="attendance-bench-")
+    bot.DATA_FILE = os.path.join(directory, "attendance.json")
+    bot.REGISTER_FILE = os.path.join(directory, "registered_users.json")
+    bot.USER_NAMES_FILE = os.path.join(directory, "user_names.json")
+    bot.JOURNAL_FILE = os.path.join(directory, "attendance.journal.jsonl")
+    bot.ACTIVITY_TIMERS_FILE = os.path.join(directory, "activity_timers.json")
+    bot.RUNTIME_STATE_FILE = os.path.join(directory, "runtime_state.json")
+    bot.SQLITE_FILE = os.path.join(directory, "attendance.db")
+    bot.MONTHS_DIR = os.path.join(directory, "attendance_months")
+    bot.BINARY_SNAPSHOT_FILE = os.path.join(directory, "attendance.snapshot")
+    return directory
+
+
+def install_stub():
+    """Bot API 全部换成 StubTelegram；返回 stub"""
+    stub = StubTelegram()
+    bot.bot = stub
+    bot.late_bot = stub
+    bot.LATE_GROUP_ID = LATE_GROUP_ID
+    bot.GROUP_CHAT_ID = int(os.environ["GROUP_CHAT_ID"])
+    return stub
+
+
+def freeze_clock(dt):
+    """bot.now() 固定返回 dt（带时区）"""
+    bot.now = lambda: dt
+
+
+def hold_persistence():
+    """启动后台持久化线程但不让它自己落盘：handler 只标记 dirty，由调用方显式 flush_dirty()"""
+    bot.PERSIST_INTERVAL = 1e9
+    bot._last_flush = time_mod.monotonic()
+    bot.start_persistence_worker()
+
+
+def assign_roles(users, rng):
+    """uid -> 角色，并写进 HR_USERS / FINDING_USERS"""
+    roles = {}
+    for i in range(users):
+        uid = FIRST_UID + i
+        roll = rng.random()
+        role = "PROMO"
+        for name, share in ROLE_MIX:
+            if roll < share:
+                role = name
+                break
+            roll -= share
+        roles[uid] = role
+    bot.HR_USERS.update(uid for uid, role in roles.items() if role == "HR")
+    bot.FINDING_USERS.update(uid for uid, role in roles.items() if role == "FINDING")
+    return roles
+
+
+def _punch(day, shift_key, rng):
+    """(上班 epoch, 下班 epoch, 迟到分钟, 早退分钟)"""
+    start, end, end_offset = SHIFT_TIMES[shift_key]
+    start_dt = datetime.combine(day, start, tzinfo=bot.LOCAL_TZ)
+    end_dt = datetime.combine(day + timedelta(days=end_offset), end, tzinfo=bot.LOCAL_TZ)
+    checkin = start_dt + timedelta(minutes=rng.triangular(-15, 25, -3))
+    if rng.random() < EARLY_LEAVE_RATE:
+        checkout = end_dt - timedelta(minutes=rng.randint(10, 120))
+    else:
+        checkout = end_dt + timedelta(minutes=rng.triangular(-4, 30, 2))
+    late = max(0, int((checkin - start_dt).total_seconds() // 60))
+    early = max(0, int((end_dt - checkout).total_seconds() // 60))
+    return int(checkin.timestamp()), int(checkout.timestamp()), late, early if early > 5 else 0
+
+
+def day_record(role, day, rng):
+    """某角色某天的一条考勤；缺勤返回 None"""
+    if rng.random() < ABSENCE_RATE:
+        return None
+    rec = bot.DayRecord()
+    punches = []
+    if role == "HR":
+        checkin, checkout, late, early = _punch(day, "HR", rng)
+        rec.hr.append(bot.ShiftPunch(checkin, checkout))
+        if rng.random() < HR_SECOND_SLOT_RATE:
+            # 下班后又被叫回来一次
+            extra = checkout + rng.randint(1800, 7200)
+            rec.hr.append(bot.ShiftPunch(extra, extra + rng.randint(1800, 3 * 3600)))
+        punches.append((late, early))
+    elif role == "FINDING":
+        shifts = ["FINDING_M", "FINDING_N"] if rng.random() < FINDING_DOUBLE_RATE else [rng.choice(("FINDING_M", "FINDING_N"))]
+        for shift_key in shifts:
+            checkin, checkout, late, early = _punch(day, shift_key, rng)
+            punch = bot.ShiftPunch(checkin, checkout)
+            if shift_key == "FINDING_M":
+                rec.morning = punch
+            else:
+                rec.night = punch
+            punches.append((late, early))
+    else:
+        checkin, checkout, late, early = _punch(day, "PROMO", rng)
+        rec.night = bot.ShiftPunch(checkin, checkout)
+        punches.append((late, early))
+    rec.late_minutes = max(late for late, _ in punches)
+    rec.early_leave_minutes = max(early for _, early in punches)
+    return rec
+
+
+def month_range(months, today):
+    """截至 today 所在月份的最近 months 个月的第一天"""
+    first = today.replace(day=1)
+    for _ in range(months - 1):
+        first = (first - timedelta(days=1)).replace(day=1)
+    return first
+
+
+def generate(users, months, seed=1, today=None):
+    """生成历史并装进 bot 的内存状态；返回 {"roles", "days", "today"}"""
+    rng = random.Random(seed)
+    today = today or bot.now().date()
+    roles = assign_roles(users, rng)
+
+    bot.ATTENDANCE.clear()
+    bot.MONTH_STATS.clear()
+    total = 0
+    day = month_range(months, today)
+    while day <= today:
+        month_key = day.strftime("%Y-%m")
+        date_key = day.strftime("%Y-%m-%d")
+        for uid, role in roles.items():
+            rec = day_record(role, day, rng)
+            if rec is not None:
+                bot.ATTENDANCE[uid][month_key][date_key] = rec
+                total += 1
+        day += timedelta(days=1)
+
+    now_ts = time_mod.time()
+    for uid in roles:
+        bot.REGISTERED_USERS.add(uid)
+        bot.USER_NAMES[uid] = {"name": f"User{uid % 100000}", "ts": now_ts}
+    bot.rebuild_month_stats()
+    return {"roles": roles, "days": total, "today": today}
+
+
+def write_initial_snapshot(backend):
+    """把内存里的历史按 backend 写到磁盘，作为 load 的输入"""
+    bot._json_save_attendance()
+    if backend == "sqlite":
+        storage = bot.make_storage("sqlite")
+        storage.save_attendance()
+        storage.close()
@@ -1,1073 +1,4202 @@
-import json
-import os
-import threading
-from datetime import datetime, timedelta, time
-from zoneinfo import ZoneInfo
-import telebot
-from telebot.types import ReplyKeyboardMarkup
-from collections import defaultdict
-
-DATA_FILE = "attendance.json"
-REGISTER_FILE = "registered_users.json"
-
-ATTENDANCE = defaultdict(lambda: defaultdict(dict))
-REGISTERED_USERS = set()
-
-def load_attendance():
-    global ATTENDANCE
-    if not os.path.exists(DATA_FILE):
-        print("📂 attendance.json not found, starting fresh")
-        return
-
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            raw = json.load(f)
-
-        for uid, months in raw.items():
-            uid = int(uid)
-            for month, days in months.items():
-                for day, rec in days.items():
-                    ATTENDANCE[uid][month][day] = {}
-
-                    # ===== 上下班时间 =====
-                    if rec.get("checkin"):
-                        ATTENDANCE[uid][month][day]["checkin"] = datetime.fromisoformat(rec["checkin"])
-
-                    if rec.get("checkout"):
-                        ATTENDANCE[uid][month][day]["checkout"] = datetime.fromisoformat(rec["checkout"])
-
-                    # ===== 早班/晚班上班时间 =====
-                    if rec.get("morning_checkin"):
-                        ATTENDANCE[uid][month][day]["morning_checkin"] = datetime.fromisoformat(rec["morning_checkin"])
-
-                    if rec.get("morning_checkout"):
-                        ATTENDANCE[uid][month][day]["morning_checkout"] = datetime.fromisoformat(rec["morning_checkout"])
-
-                    if rec.get("night_checkin"):
-                        ATTENDANCE[uid][month][day]["night_checkin"] = datetime.fromisoformat(rec["night_checkin"])
-
-                    if rec.get("night_checkout"):
-                        ATTENDANCE[uid][month][day]["night_checkout"] = datetime.fromisoformat(rec["night_checkout"])
-
-                    # ===== 迟到 / 早退 =====
-                    ATTENDANCE[uid][month][day]["late_minutes"] = rec.get("late_minutes", 0)
-                    ATTENDANCE[uid][month][day]["early_leave_minutes"] = rec.get("early_leave_minutes", 0)
-
-                    # ===== HR 多 slot 打卡 (checkin_2/checkout_2, checkin_3/checkout_3...) =====
-                    slot = 2
-                    while True:
-                        ck = f"checkin_{slot}"
-                        co = f"checkout_{slot}"
-                        if not rec.get(ck) and not rec.get(co):
-                            break
-                        if rec.get(ck):
-                            ATTENDANCE[uid][month][day][ck] = datetime.fromisoformat(rec[ck])
-                        if rec.get(co):
-                            ATTENDANCE[uid][month][day][co] = datetime.fromisoformat(rec[co])
-                        slot += 1
-
-        print("✅ Attendance loaded from JSON")
-
-    except Exception as e:
-        print("❌ Failed to load attendance.json:", e)
-
-def load_registered_users():
-    global REGISTERED_USERS
-    if not os.path.exists(REGISTER_FILE):
-        print("📂 registered_users.json not found, starting fresh")
-        return
-
-    try:
-        with open(REGISTER_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            REGISTERED_USERS = set(map(int, data))
-        print("✅ Registered users loaded")
-    except Exception as e:
-        print("❌ Failed to load registered users:", e)
-
-
-def save_registered_users():
-    try:
-        with open(REGISTER_FILE, "w", encoding="utf-8") as f:
-            json.dump(list(REGISTERED_USERS), f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print("❌ Failed to save registered users:", e)
-
-def save_attendance():
-    data = {}
-
-    for uid, months in ATTENDANCE.items():
-        data[str(uid)] = {}
-        for month, days in months.items():
-            data[str(uid)][month] = {}
-            for day, rec in days.items():
-                day_data = {
-                    "checkin": rec.get("checkin").isoformat() if rec.get("checkin") else None,
-                    "checkout": rec.get("checkout").isoformat() if rec.get("checkout") else None,
-
-                    "morning_checkin": rec.get("morning_checkin").isoformat() if rec.get("morning_checkin") else None,
-                    "morning_checkout": rec.get("morning_checkout").isoformat() if rec.get("morning_checkout") else None,
-                    "night_checkin": rec.get("night_checkin").isoformat() if rec.get("night_checkin") else None,
-                    "night_checkout": rec.get("night_checkout").isoformat() if rec.get("night_checkout") else None,
-
-                    "late_minutes": rec.get("late_minutes", 0),
-                    "early_leave_minutes": rec.get("early_leave_minutes", 0),
-                }
-                # 保存 HR 多 slot 打卡
-                slot = 2
-                while True:
-                    ck_key = f"checkin_{slot}"
-                    co_key = f"checkout_{slot}"
-                    if not rec.get(ck_key) and not rec.get(co_key):
-                        break
-                    if rec.get(ck_key):
-                        day_data[ck_key] = rec[ck_key].isoformat()
-                    if rec.get(co_key):
-                        day_data[co_key] = rec[co_key].isoformat()
-                    slot += 1
-                data[str(uid)][month][day] = day_data
-
-    try:
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print("❌ Failed to save attendance.json:", e)
-
-# ===== Timezone =====
-LOCAL_TZ = ZoneInfo("Asia/Yangon")  # 缅甸
-
-def now():
-    return datetime.now(LOCAL_TZ)
-
-# ===== Load env =====
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-GROUP_CHAT_ID = int(os.getenv("GROUP_CHAT_ID")) if os.getenv("GROUP_CHAT_ID") else None
-admin_ids_str = os.getenv("ADMIN_IDS", "6062973135,8530505686")
-ADMIN_IDS = set(int(x.strip()) for x in admin_ids_str.split(",") if x.strip())
-LATE_BOT_TOKEN = os.getenv("LATE_BOT_TOKEN")
-LATE_GROUP_ID = int(os.getenv("LATE_GROUP_ID")) if os.getenv("LATE_GROUP_ID") else None
-
-late_bot = None
-if LATE_BOT_TOKEN and LATE_GROUP_ID:
-    late_bot = telebot.TeleBot(LATE_BOT_TOKEN)
-
-if not BOT_TOKEN:
-    raise Exception("❌ BOT_TOKEN is not set")
-
-bot = telebot.TeleBot(BOT_TOKEN)
-
-# ===== Config =====
-ACTIVITY_TIMES = {
-    "Eating": 30,
-    "ToiletLarge": 15,
-    "ToiletSmall": 10,
-    "Smoking": 10,
-    "Other": 15,
-}
-
-MAX_TIMES = {
-    "Eating": 3,
-    "ToiletLarge": 1,
-    "ToiletSmall": 4,
-    "Smoking": 4,
-    "Other": 2,
-}
-
-ACTIVITY_LABELS = {
-    "Eating": "Eat",
-    "ToiletLarge": "Toilet",
-    "ToiletSmall": "Pee",
-    "Smoking": "Smoking",
-    "Other": "Other",
-}
-
-def ordinal(n):
-    if 10 <= n % 100 <= 20:
-        return f"{n}th"
-    return f"{n}{ {1:'st', 2:'nd', 3:'rd'}.get(n % 10, 'th') }"
-
-# ===== 用户配置 =====
-HR_USERS = {6917597442,6972481220,5439661091,8784682846}
-FINDING_USERS = {6438074082,8260711537,6343462420}
-CUSTOM_NIGHT_USERS = {6863315227,2018656742,6635424294,8057771099}
-
-# ===== Memory =====
-user_activity = {}
-user_sessions = {}
-CHECK_IN_STATUS = {}
-user_logs = {}
-activity_timeout = {}
-
-# ===== Keyboard =====
-def main_keyboard(uid=None):
-    kb = ReplyKeyboardMarkup(resize_keyboard=True)
-    kb.row("🏢 Check In", "🏠 Check Out")
-    kb.row("🍽 Eat", "🚬 Smoking")
-    kb.row("💧 Pee", "🚽 Toilet")
-    kb.row("📝 Other", "↩ Return")
-    if uid is not None and uid in ADMIN_IDS:
-        kb.row("/set_month_shifts", "/batch_set_month_shifts")
-    return kb
-
-# ===== Stats =====
-def stats_text(uid):
-    user_sessions.setdefault(uid, {"Eating": 0, "ToiletLarge": 0, "ToiletSmall": 0, "Smoking": 0, "Other": 0})
-    s = user_sessions[uid]
-    return (
-        f"👤 User ID: {uid}\n\n"
-        f"🍽 Eat: {s['Eating']} / {MAX_TIMES['Eating']} TIME\n"
-        f"💧 Pee: {s['ToiletSmall']} / {MAX_TIMES['ToiletSmall']} TIME\n"
-        f"🚽 Toilet: {s['ToiletLarge']} / {MAX_TIMES['ToiletLarge']} TIME\n"
-        f"🚬 Smoking: {s['Smoking']} / {MAX_TIMES['Smoking']} TIME\n"
-        f"📝 Other: {s['Other']} / {MAX_TIMES['Other']} TIME"
-    )
-
-def get_attendance_summary(uid):
-    if uid not in ATTENDANCE:
-        return 0, 0
-    now_dt = now()
-    current_month = now_dt.strftime("%Y-%m")
-    total_days = set()
-    month_shifts = 0
-
-    for month, days in ATTENDANCE[uid].items():
-        # 不是当月则跳过，实现每月1号自动清零
-        if month != current_month:
-            continue
-        for day, rec in days.items():
-            full_date = f"{month}-{day[-2:]}"
-
-            # 统一统计：遍历所有可能的打卡字段，不区分用户类型
-            # 1. HR 多 slot: checkin, checkin_2, checkin_3...
-            slot = 1
-            while True:
-                key = "checkin" if slot == 1 else f"checkin_{slot}"
-                if rec.get(key):
-                    total_days.add(full_date)
-                    month_shifts += 1
-                    slot += 1
-                else:
-                    break
-
-            # 2. FINDING/PROMO: morning_checkin 和 night_checkin
-            if rec.get("morning_checkin"):
-                total_days.add(full_date)
-                month_shifts += 1
-            if rec.get("night_checkin"):
-                total_days.add(full_date)
-                month_shifts += 1
-
-    return month_shifts, len(total_days)
-
-def get_shift_standard(dt, uid):
-    t = dt.time()
-    if uid in HR_USERS:
-        return {"role": "HR", "shift": "DAY", "start": time(9, 0), "end": time(19, 0)}
-    if uid in FINDING_USERS:
-        if time(7, 0) <= t <= time(12, 0):
-            return {"role": "FINDING", "shift": "MORNING", "start": time(7, 0), "end": time(12, 0)}
-        if t >= time(19, 0) or t < time(2, 0):
-            return {"role": "FINDING", "shift": "NIGHT", "start": time(19, 0), "end": time(2, 0), "cross_day": True}
-        return {"role": "FINDING", "shift": "MORNING", "start": time(7, 0), "end": time(12, 0)}
-    return {"role": "PROMO", "shift": "NIGHT", "start": time(20, 30), "end": time(9, 30), "cross_day": True}
-
-def get_attribution_date(checkin_logical_date, checkout_dt, uid, shift_info):
-    """根据 checkout 时间决定这个班次最终归属哪一天（缅甸时间）"""
-    checkout_date = checkout_dt.date()
-    checkout_time = checkout_dt.time()
-
-    # 同一天 checkout → 直接归 checkin 那天
-    if checkout_date == checkin_logical_date:
-        return checkin_logical_date
-
-    # 跨天了 → 按截止时间判定
-    if uid in HR_USERS:
-        # HR: checkout 超过凌晨 0:00 → 归 checkout 当天
-        return checkout_date
-
-    elif uid in FINDING_USERS:
-        if shift_info.get("shift") == "NIGHT":
-            # 晚班: checkout 在凌晨 2:00 内 → 归 checkin 那天（前一天）
-            if checkout_time < time(2, 0):
-                return checkin_logical_date
-            return checkout_date
-        else:
-            # 早班: checkout 在下午 5:00 内 → 归 checkin 那天
-            if checkout_time < time(17, 0):
-                return checkin_logical_date
-            return checkout_date
-
-    else:
-        # CHATTING/PROMO: checkout 在中午 12:00 前 → 归 checkin 那天（前一天）
-        if checkout_time < time(12, 0):
-            return checkin_logical_date
-        return checkout_date
-
-# ===== Send functions =====
-def send_group(msg, parse_mode=None):
-    if not GROUP_CHAT_ID:
-        return
-    try:
-        bot.send_message(GROUP_CHAT_ID, msg, parse_mode=parse_mode)
-    except Exception as e:
-        print("❌ send_group failed:", e)
-
-def send_late_notice(msg, parse_mode=None):
-    if late_bot and LATE_GROUP_ID:
-        try:
-            late_bot.send_message(LATE_GROUP_ID, msg, parse_mode=parse_mode)
-        except Exception as e:
-            print("❌ send_late_notice failed:", e)
-
-# ===== 未打卡提醒 =====
-MISSED_CHECK_SENT = set()
-
-def check_missing_checkins():
-    while True:
-        try:
-            now_dt = now()
-            today = now_dt.date()
-            all_staff = REGISTERED_USERS
-
-            for uid in all_staff:
-                month_key = today.strftime("%Y-%m")
-                date_key = today.strftime("%Y-%m-%d")
-                rec = ATTENDANCE.get(uid, {}).get(month_key, {}).get(date_key, {})
-
-                if uid in HR_USERS:
-                    limit_dt = datetime.combine(today, time(9, 4), tzinfo=LOCAL_TZ)
-                    key = (uid, "HR_DAY", today)
-                    if limit_dt <= now_dt < limit_dt + timedelta(seconds=60) and key not in MISSED_CHECK_SENT:
-                        if not rec.get("checkin"):
-                            send_late_notice_by_id(uid, "HR")
-                            MISSED_CHECK_SENT.add(key)
-                    continue
-
-                if uid in FINDING_USERS:
-                    m_limit = datetime.combine(today, time(7, 4), tzinfo=LOCAL_TZ)
-                    key_m = (uid, "FINDING_M", today)
-                    if m_limit <= now_dt < m_limit + timedelta(seconds=60) and key_m not in MISSED_CHECK_SENT:
-                        if not rec.get("morning_checkin"):
-                            send_late_notice_by_id(uid, "FINDING 早班")
-                            MISSED_CHECK_SENT.add(key_m)
-                    
-                    n_limit = datetime.combine(today, time(19, 4), tzinfo=LOCAL_TZ)
-                    key_n = (uid, "FINDING_N", today)
-                    if n_limit <= now_dt < n_limit + timedelta(seconds=60) and key_n not in MISSED_CHECK_SENT:
-                        if not rec.get("night_checkin"):
-                            send_late_notice_by_id(uid, "FINDING 晚班")
-                            MISSED_CHECK_SENT.add(key_n)
-                    continue
-
-                p_limit = datetime.combine(today, time(20, 34), tzinfo=LOCAL_TZ)
-                key_p = (uid, "PROMO_NIGHT_NEW", today)
-                if p_limit <= now_dt < p_limit + timedelta(seconds=60) and key_p not in MISSED_CHECK_SENT:
-                    if not rec.get("checkin") and not rec.get("night_checkin"):
-                        send_late_notice_by_id(uid, "推广/夜班(20:30)")
-                        MISSED_CHECK_SENT.add(key_p)
-
-        except Exception as e:
-            print("❌ missing checkin loop error:", e)
-
-        threading.Event().wait(30)
-
-def send_late_notice_by_id(uid, role_name):
-    try:
-        chat = bot.get_chat(uid)
-        name = chat.first_name or "User"
-        # 🟢【未打卡】两群同步发送 HTML @通知
-        notice = f"👤 <a href=\"tg://user?id={uid}\">{name}</a>💸+{uid} {role_name} 未打卡 ⚠️"
-        send_late_notice(notice, parse_mode="HTML")
-        send_group(notice, parse_mode="HTML") 
-    except Exception as e:
-        print(f"Notice error for {uid}: {e}")
-
-# ===== Commands =====
-@bot.message_handler(commands=["start"])
-def start(message):
-    if message.from_user.is_bot:
-        return
-    uid = message.from_user.id
-
-    if uid not in REGISTERED_USERS:
-        REGISTERED_USERS.add(uid)
-        save_registered_users()
-
-    if uid in CHECK_IN_STATUS:
-        status_line = f"🟢 已上班：{CHECK_IN_STATUS[uid]['time'].strftime('%H:%M:%S')}"
-    else:
-        status_line = "🔴 未上班"
-
-    panel_msg = (
-        f"✅ 已注册\n"
-        f"{status_line}\n\n"
-        f"{stats_text(uid)}"
-    )
-    bot.send_message(message.chat.id, panel_msg, reply_markup=main_keyboard(uid))
-
-@bot.message_handler(commands=["attendance"])
-def attendance_report(message):
-    bot.reply_to(message, "📊 考勤统计功能已关闭")
-
-# ===== 管理员命令：修改员工考勤 =====
-@bot.message_handler(commands=["modify_attendance"])
-def modify_attendance(message):
-    uid = message.from_user.id
-    if uid not in ADMIN_IDS:
-        bot.reply_to(message, "❌ 仅管理员可操作")
-        return
-    
-    args = message.text.split()
-    if len(args) < 5:
-        bot.reply_to(message, "用法: /modify_attendance <用户ID> <年月日> <checkin/checkout> <时间>\n例: /modify_attendance 6917597442 2024-06-02 checkin 09:00:00")
-        return
-    
-    try:
-        target_uid = int(args[1])
-        date_str = args[2]
-        action = args[3]
-        time_str = args[4]
-        
-        # 解析日期时间
-        dt_str = f"{date_str} {time_str}"
-        new_dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S").replace(tzinfo=LOCAL_TZ)
-        
-        # 确定月份和日期
-        month_key = new_dt.strftime("%Y-%m")
-        date_key = new_dt.strftime("%Y-%m-%d")
-        
-        # 确保数据结构存在
-        ATTENDANCE[target_uid].setdefault(month_key, {})
-        ATTENDANCE[target_uid][month_key].setdefault(date_key, {})
-        day_rec = ATTENDANCE[target_uid][month_key][date_key]
-        
-        # 根据用户类型确定要修改的字段
-        if target_uid in HR_USERS:
-            # HR: 修改或添加 checkin 记录
-            if action == "checkin":
-                # 找到下一个可用 slot
-                slot = 1
-                while day_rec.get(f"checkin_{slot}" if slot > 1 else "checkin"):
-                    slot += 1
-                key = "checkin" if slot == 1 else f"checkin_{slot}"
-                day_rec[key] = new_dt
-            elif action == "checkout":
-                # 找到对应的 checkin slot
-                slot = 1
-                while day_rec.get(f"checkin_{slot}" if slot > 1 else "checkin"):
-                    slot += 1
-                # 如果找到 checkin 记录，使用对应 slot
-                if slot > 1:
-                    key = "checkout" if slot-1 == 1 else f"checkout_{slot-1}"
-                else:
-                    key = "checkout"
-                day_rec[key] = new_dt
-        elif target_uid in FINDING_USERS:
-            # FINDING: 根据时间判断早班/晚班
-            t = new_dt.time()
-            if time(7, 0) <= t <= time(12, 0):
-                # 早班
-                if action == "checkin":
-                    day_rec["morning_checkin"] = new_dt
-                elif action == "checkout":
-                    day_rec["morning_checkout"] = new_dt
-            else:
-                # 晚班
-                if action == "checkin":
-                    day_rec["night_checkin"] = new_dt
-                elif action == "checkout":
-                    day_rec["night_checkout"] = new_dt
-        else:
-            # CHATTING/PROMO: 夜班
-            if action == "checkin":
-                day_rec["night_checkin"] = new_dt
-            elif action == "checkout":
-                day_rec["night_checkout"] = new_dt
-        
-        save_attendance()
-        bot.reply_to(message, f"✅ 已修改 {target_uid} 的考勤记录\n日期: {date_str}\n操作: {action}\n时间: {time_str}")
-        
-    except Exception as e:
-        bot.reply_to(message, f"❌ 修改失败: {str(e)}")
-
-# ===== 管理员命令：查看员工考勤 =====
-@bot.message_handler(commands=["view_attendance"])
-def view_attendance(message):
-    uid = message.from_user.id
-    if uid not in ADMIN_IDS:
-        bot.reply_to(message, "❌ 仅管理员可操作")
-        return
-    
-    args = message.text.split()
-    if len(args) < 2:
-        bot.reply_to(message, "用法: /view_attendance <用户ID>")
-        return
-    
-    try:
-        target_uid = int(args[1])
-        if target_uid not in ATTENDANCE:
-            bot.reply_to(message, f"用户 {target_uid} 无考勤记录")
-            return
-        
-        response = f"📊 用户 {target_uid} 考勤记录:\n\n"
-        for month, days in ATTENDANCE[target_uid].items():
-            for day, rec in days.items():
-                response += f"📅 {month}-{day[-2:]}:\n"
-                
-                # HR 记录
-                if target_uid in HR_USERS:
-                    slot = 1
-                    while True:
-                        ck_key = "checkin" if slot == 1 else f"checkin_{slot}"
-                        co_key = "checkout" if slot == 1 else f"checkout_{slot}"
-                        ck = rec.get(ck_key)
-                        co = rec.get(co_key)
-                        if not ck and not co:
-                            break
-                        if ck:
-                            response += f"  {ck_key}: {ck.strftime('%H:%M:%S')}\n"
-                        if co:
-                            response += f"  {co_key}: {co.strftime('%H:%M:%S')}\n"
-                        slot += 1
-                
-                # FINDING 记录
-                if target_uid in FINDING_USERS:
-                    if rec.get("morning_checkin"):
-                        response += f"  早班上班: {rec['morning_checkin'].strftime('%H:%M:%S')}\n"
-                    if rec.get("morning_checkout"):
-                        response += f"  早班下班: {rec['morning_checkout'].strftime('%H:%M:%S')}\n"
-                    if rec.get("night_checkin"):
-                        response += f"  晚班上班: {rec['night_checkin'].strftime('%H:%M:%S')}\n"
-                    if rec.get("night_checkout"):
-                        response += f"  晚班下班: {rec['night_checkout'].strftime('%H:%M:%S')}\n"
-                
-                # CHATTING 记录
-                if target_uid not in HR_USERS and target_uid not in FINDING_USERS:
-                    if rec.get("night_checkin"):
-                        response += f"  夜班上班: {rec['night_checkin'].strftime('%H:%M:%S')}\n"
-                    if rec.get("night_checkout"):
-                        response += f"  夜班下班: {rec['night_checkout'].strftime('%H:%M:%S')}\n"
-                
-                response += "\n"
-        
-        bot.reply_to(message, response)
-        
-    except Exception as e:
-        bot.reply_to(message, f"❌ 查看失败: {str(e)}")
-
-# ===== Return (回座) =====
-def back(message):
-    uid = message.from_user.id
-    name = message.from_user.first_name
-    
-    if uid not in user_activity:
-        safe_pm(uid, "❌ 您当前没有进行中的 activity。")
-        return
-
-    act_data = user_activity.pop(uid)
-    start_dt = act_data["start_dt"]
-    end_dt = now()
-    
-    diff = end_dt - start_dt
-    minutes = int(diff.total_seconds() // 60)
-    seconds = int(diff.total_seconds() % 60)
-    duration_str = f"{minutes}:{seconds:02d}"
-    
-    timeout_flag = minutes >= ACTIVITY_TIMES.get(act_data["act"], 0)
-    warning = " ⚠️" if timeout_flag else ""
-    s = user_sessions.get(uid, {})
-
-    msg = (
-        f"👤 {name}\n"
-        f"🍽 {s.get('Eating',0)} / {MAX_TIMES['Eating']}  "
-        f"💧 {s.get('ToiletSmall',0)} / {MAX_TIMES['ToiletSmall']}  "
-        f"🚽 {s.get('ToiletLarge',0)} / {MAX_TIMES['ToiletLarge']}  "
-        f"🚬 Smoking: {s.get('Smoking',0)} / {MAX_TIMES['Smoking']}  "
-        f"📝 {s.get('Other',0)} / {MAX_TIMES['Other']}\n\n"
-        f"↩️ Returned\n"
-        f"{act_data['act']}\n"
-        f"Start: {start_dt.strftime('%H:%M:%S')}\n"
-        f"End: {end_dt.strftime('%H:%M:%S')}\n"
-        f"Duration: {duration_str}{warning}"
-    )
-
-    send_group(msg)
-    safe_pm(uid, f"✅ 已回座，耗时 {duration_str}", reply_markup=main_keyboard())
-
-def check_out(uid, name):
-    if uid not in CHECK_IN_STATUS:
-        safe_pm(uid, "❌ 您尚未上班打卡，无需下班。")
-        return
-
-    checkin_info = CHECK_IN_STATUS.pop(uid)
-    in_time = checkin_info["time"]
-    shift_info = checkin_info["shift"]
-    checkin_logical_date = checkin_info["logical_date"]
-    out_time = now()
-
-    # 根据 checkout 时间重新判定归属日期
-    attribution_date = get_attribution_date(checkin_logical_date, out_time, uid, shift_info)
-
-    # 1. 动态计算班次结束时间（仍用 checkin 的 logical_date）
-    shift_end_dt = datetime.combine(checkin_logical_date, shift_info["end"], tzinfo=LOCAL_TZ)
-    if shift_info.get("cross_day"):
-        shift_end_dt += timedelta(days=1)
-    
-    # 2. 计算时长
-    diff = out_time - in_time
-    hours = int(diff.total_seconds() // 3600)
-    minutes = int((diff.total_seconds() % 3600) // 60)
-    seconds = int(diff.total_seconds() % 60)
-    duration_str = f"{hours} hours {minutes} minutes {seconds} seconds"
-    
-    status_msg = "✅ Checked out on time"
-    
-    # 3. 判定早退 (凌晨 00:00 - 02:00 豁免)
-    is_night_finish = (shift_info.get("cross_day") and out_time.time() < time(2, 0))
-    
-    if not is_night_finish and out_time < shift_end_dt:
-        early_leave = int((shift_end_dt - out_time).total_seconds() // 60)
-        if early_leave > 5: 
-            status_msg = f"⚠️ Early Leave: {early_leave} min"
-            late_group_out_msg = f"👤 <a href=\"tg://user?id={uid}\">{name}</a>💸+{uid} 提前下班 ⚠️ Early Leave: {early_leave} min"
-            send_late_notice(late_group_out_msg, parse_mode="HTML")
-
-    # 4. 写入考勤记录（按 attribution_date 写入）
-    month_key = attribution_date.strftime("%Y-%m")
-    date_key = attribution_date.strftime("%Y-%m-%d")
-    ATTENDANCE[uid].setdefault(month_key, {})
-    ATTENDANCE[uid][month_key].setdefault(date_key, {})
-    day_rec = ATTENDANCE[uid][month_key][date_key]
-    
-    if shift_info["role"] in ("FINDING", "PROMO"):
-        if shift_info["shift"] == "MORNING":
-            day_rec["morning_checkout"] = out_time
-        elif shift_info["shift"] == "NIGHT":
-            day_rec["night_checkout"] = out_time
-    else:
-        # HR: 使用对应的 slot
-        slot = checkin_info.get("_slot", 1)
-        key_checkout = "checkout" if slot == 1 else f"checkout_{slot}"
-        day_rec[key_checkout] = out_time
-    
-    save_attendance()
-    
-    # 5. 获取月度统计
-    month_shifts, total_days = get_attendance_summary(uid)
-    
-    # 6. 发送通知
-    msg = (
-        f"👤 {name}💸+{uid}【Nexbit-Safe】\n"
-        f"✅ Successfully checked out\n"
-        f"📅 Check-in time: {in_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-        f"📅 Check-out time: {out_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-        f"⏰ Working hours: {duration_str}\n"
-        f"{status_msg}\n"
-        f"📊 Attendance statistics:\n"
-        f"🗓️ Worked normally this month: {total_days} days"
-    )
-
-    user_sessions.pop(uid, None) 
-    send_group(msg)
-    safe_pm(uid, f"🏠 下班成功！\n工作时长：{duration_str}", reply_markup=main_keyboard())
-def safe_pm(uid, text, reply_markup=None):
-    try:
-        bot.send_message(uid, text, reply_markup=reply_markup)
-    except Exception as e:
-        print(f"❌ 无法私聊用户 {uid}: {e}")
-
-# ===== Start Activity (开始活动) =====
-def start_activity(uid, name, act):
-    if uid not in REGISTERED_USERS:
-        REGISTERED_USERS.add(uid)
-        save_registered_users()
-
-    user_sessions.setdefault(uid, {"Eating": 0, "ToiletLarge": 0, "ToiletSmall": 0, "Smoking": 0, "Other": 0})
-    user_logs.setdefault(uid, [])
-
-    if uid in user_activity:
-        safe_pm(uid, "❌ Please finish your current activity first.")
-        return
-
-    if uid not in CHECK_IN_STATUS:
-        safe_pm(uid, "❌ Please check in first.")
-        return
-
-    if user_sessions[uid][act] >= MAX_TIMES[act]:
-        safe_pm(uid, f"❌ {ACTIVITY_LABELS[act]} limit reached.")
-        return
-
-    start_dt = now()
-    user_sessions[uid][act] += 1
-
-    user_activity[uid] = {
-        "act": act,
-        "start_dt": start_dt
-    }
-    activity_timeout[uid] = False
-
-    display_name = f"{uid}+{name} 【Nexbit-Safe】"
-    activity_name = ACTIVITY_LABELS[act]
-
-    send_group(
-        f"👤 {display_name}\n"
-        f"📅 Time: {start_dt.strftime('%Y-%m-%d %H:%M:%S')}\n"
-        f"✅ Activity: {activity_name}\n"
-        f"⚠️ This is your {ordinal(user_sessions[uid][act])} {activity_name}, "
-        f"remaining {MAX_TIMES[act]-user_sessions[uid][act]} times this shift\n\n"
-        f"👇 Please click [Return] after finishing the activity"
-    )
-
-    safe_pm(uid, f"✅ {activity_name} started")
-
-    # ===== 独立闭包内部定时器 =====
-    def countdown():
-        if uid not in user_activity or user_activity[uid]["start_dt"] != start_dt:
-            return
-        # 🟢【离座超时】两群同步发送 HTML @通知
-        timeout_msg = f"⏰ <a href=\"tg://user?id={uid}\">{name}</a>💸+{uid} 【Nexbit-Safe】 {activity_name} TIMEOUT ⚠️"
-        send_group(timeout_msg, parse_mode="HTML")
-        send_late_notice(timeout_msg, parse_mode="HTML")
-
-    threading.Timer(ACTIVITY_TIMES[act] * 60, countdown).start()
-
-# ===== Check In (上班) =====
-def check_in(uid, name):
-    now_dt = now()
-
-    if uid in CHECK_IN_STATUS:
-        safe_pm(uid, "❌ You are already checked in.")
-        return
-
-    shift_info = get_shift_standard(now_dt, uid)
-    if not shift_info:
-        safe_pm(uid, "⛔ 当前不在你的上班班次时间内")
-        return
-
-    if shift_info["role"] in ("FINDING", "PROMO", "CUSTOM"):
-        night_start = time(19, 0)
-        if shift_info["role"] == "CUSTOM":
-            night_start = time(20, 30)
-        if time(12, 0) <= now_dt.time() < night_start:
-            shift_info = {
-                "role": shift_info["role"],
-                "shift": "NIGHT",
-                "start": night_start,
-                "end": time(10, 30) if shift_info["role"] == "CUSTOM" else time(2, 0),
-                "cross_day": True
-            }
-
-    logical_date = now_dt.date()
-    if (shift_info["role"] in ("FINDING", "PROMO", "CUSTOM")
-        and shift_info.get("shift") == "NIGHT"
-        and now_dt.time() < time(3, 0)):
-        logical_date -= timedelta(days=1)
-
-    shift_start_dt = datetime.combine(logical_date, shift_info["start"], tzinfo=LOCAL_TZ)
-    
-    late_minutes = 0
-    if now_dt > shift_start_dt:
-        late_minutes = int((now_dt - shift_start_dt).total_seconds() // 60)
-
-    CHECK_IN_STATUS[uid] = {
-        "time": now_dt,
-        "logical_date": logical_date,
-        "shift": shift_info
-    }
-
-    month_key = logical_date.strftime("%Y-%m")
-    date_key = logical_date.strftime("%Y-%m-%d")
-    ATTENDANCE[uid].setdefault(month_key, {})
-    ATTENDANCE[uid][month_key].setdefault(date_key, {})
-    day_rec = ATTENDANCE[uid][month_key][date_key]
-
-    if shift_info["role"] in ("FINDING", "PROMO"):
-        if shift_info["shift"] == "MORNING":
-            day_rec["morning_checkin"] = now_dt
-        elif shift_info["shift"] == "NIGHT":
-            day_rec["night_checkin"] = now_dt
-    else:
-        # HR: 找到下一个可用 slot，避免同一天多次打卡互相覆盖
-        slot = 1
-        while day_rec.get(f"checkin_{slot}" if slot > 1 else "checkin"):
-            slot += 1
-        key_checkin = "checkin" if slot == 1 else f"checkin_{slot}"
-        day_rec[key_checkin] = now_dt
-        CHECK_IN_STATUS[uid]["_slot"] = slot
-
-    day_rec["late_minutes"] = max(day_rec.get("late_minutes", 0), late_minutes)
-
-    msg = f"✅ {name} checked in at {now_dt.strftime('%H:%M:%S')}"
-    if late_minutes > 0:
-        msg += f" ⚠️ Late {late_minutes} min"
-    send_group(msg)
-
-    # 🟢【迟到】异常通知群 @提及
-    if late_minutes > 0:
-        shift_name = f"{shift_info['shift']}".lower() # 获取班次名 (morning / night)
-        late_group_msg = f"👤 <a href=\"tg://user?id={uid}\">{name}</a>💸+{uid}{shift_name} ⚠️ late {late_minutes}min"
-        send_late_notice(late_group_msg, parse_mode="HTML")
-
-    save_attendance()
-
-    bot_checkin_pm = (
-        f"✅ 已上班 {name} checked in at {now_dt.strftime('%H:%M:%S')}\n"
-        f"👔 班次：{shift_info['role']} {shift_info['shift']}\n"
-        f"⏰ 迟到：{late_minutes} 分钟"
-    )
-    safe_pm(uid, bot_checkin_pm, reply_markup=main_keyboard())
-
-# ===== Handler =====
-@bot.message_handler(func=lambda m: True)
-def handler(message):
-    if message.from_user.is_bot:
-        return
-
-    uid = message.from_user.id
-    name = message.from_user.first_name
-    txt = message.text
-
-    if "Eat" in txt:
-        start_activity(uid, name, "Eating")
-    elif "Smoking" in txt:
-        start_activity(uid, name, "Smoking")
-    elif "Pee" in txt:
-        start_activity(uid, name, "ToiletSmall")
-    elif "Toilet" in txt:
-        start_activity(uid, name, "ToiletLarge")
-    elif "Other" in txt:
-        start_activity(uid, name, "Other")
-    elif "Check In" in txt:
-        check_in(uid, name)
-    elif "Check Out" in txt:
-        check_out(uid, name)
-    elif "Return" in txt: 
-        back(message)
-          
-# ===== Run =====
-# ===== Persistent storage & patches =====
-DATA_FILE = "/data/attendance.json"
-REGISTER_FILE = "/data/registered_users.json"
-ADMIN_OVERRIDES = {}
-
-# Patch 1: load_attendance — strip & keep admin_overrides
-_original_load_attendance = load_attendance
-def load_attendance():
-    global ADMIN_OVERRIDES
-    ADMIN_OVERRIDES = {}
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-            overrides_raw = raw.pop("admin_overrides", {})
-            for uid_str, months in overrides_raw.items():
-                ADMIN_OVERRIDES[int(uid_str)] = months
-            with open(DATA_FILE, "w", encoding="utf-8") as f:
-                json.dump(raw, f, ensure_ascii=False, indent=2)
-            if ADMIN_OVERRIDES:
-                print("✅ Admin overrides loaded:", len(ADMIN_OVERRIDES), "users")
-        except Exception as e:
-            print("❌ Failed to extract admin_overrides:", e)
-    _original_load_attendance()
-
-# Patch 2: save_attendance — re-add admin_overrides after write
-_original_save_attendance = save_attendance
-def save_attendance():
-    _original_save_attendance()
-    try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        else:
-            data = {}
-        data["admin_overrides"] = {
-            str(uid): months for uid, months in ADMIN_OVERRIDES.items()
-        }
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print("❌ Failed to save admin_overrides:", e)
-
-# Patch 3: get_attendance_summary — auto-calc only, no admin override
-_original_get_attendance_summary = get_attendance_summary
-def get_attendance_summary(uid):
-    return _original_get_attendance_summary(uid)
-
-# Patch 4: check_missing_checkins — skip admins and users not in group
-_original_check_missing_checkins = check_missing_checkins
-def check_missing_checkins():
-    while True:
-        try:
-            now_dt = now()
-            today = now_dt.date()
-            for uid in list(REGISTERED_USERS):
-                if uid in ADMIN_IDS:
-                    continue
-                try:
-                    member = bot.get_chat_member(GROUP_CHAT_ID, uid)
-                    if member.status in ("left", "kicked"):
-                        continue
-                except Exception:
-                    continue
-
-                month_key = today.strftime("%Y-%m")
-                date_key = today.strftime("%Y-%m-%d")
-                rec = ATTENDANCE.get(uid, {}).get(month_key, {}).get(date_key, {})
-
-                if uid in HR_USERS:
-                    limit_dt = datetime.combine(today, time(9, 4), tzinfo=LOCAL_TZ)
-                    key = (uid, "HR_DAY", today)
-                    if limit_dt <= now_dt < limit_dt + timedelta(seconds=60) and key not in MISSED_CHECK_SENT:
-                        if not rec.get("checkin"):
-                            send_late_notice_by_id(uid, "HR")
-                            MISSED_CHECK_SENT.add(key)
-                    continue
-
-                if uid in FINDING_USERS:
-                    m_limit = datetime.combine(today, time(7, 4), tzinfo=LOCAL_TZ)
-                    key_m = (uid, "FINDING_M", today)
-                    if m_limit <= now_dt < m_limit + timedelta(seconds=60) and key_m not in MISSED_CHECK_SENT:
-                        if not rec.get("morning_checkin"):
-                            send_late_notice_by_id(uid, "FINDING 早班")
-                            MISSED_CHECK_SENT.add(key_m)
-
-                    n_limit = datetime.combine(today, time(19, 4), tzinfo=LOCAL_TZ)
-                    key_n = (uid, "FINDING_N", today)
-                    if n_limit <= now_dt < n_limit + timedelta(seconds=60) and key_n not in MISSED_CHECK_SENT:
-                        if not rec.get("night_checkin"):
-                            send_late_notice_by_id(uid, "FINDING 晚班")
-                            MISSED_CHECK_SENT.add(key_n)
-                    continue
-
-                p_limit = datetime.combine(today, time(20, 34), tzinfo=LOCAL_TZ)
-                key_p = (uid, "PROMO_NIGHT_NEW", today)
-                if p_limit <= now_dt < p_limit + timedelta(seconds=60) and key_p not in MISSED_CHECK_SENT:
-                    if not rec.get("checkin") and not rec.get("night_checkin"):
-                        send_late_notice_by_id(uid, "推广/夜班(20:30)")
-                        MISSED_CHECK_SENT.add(key_p)
-
-        except Exception as e:
-            print("❌ missing checkin loop error:", e)
-
-        threading.Event().wait(30)
-
-# Patch 5: /set_month_shifts admin command
-@bot.message_handler(commands=["set_month_shifts"])
-def set_month_shifts(message):
-    uid = message.from_user.id
-    if uid not in ADMIN_IDS:
-        bot.reply_to(message, "❌ 仅管理员可操作")
-        return
-
-    args = message.text.split()
-    if len(args) < 4:
-        bot.reply_to(
-            message,
-            "用法: /set_month_shifts <用户ID> <年月> <天数>\n"
-            "例: /set_month_shifts 6917597442 2024-06 22"
-        )
-        return
-
-    try:
-        target_uid = int(args[1])
-        month_key = args[2]
-        override_days = int(args[3])
-
-        ADMIN_OVERRIDES.setdefault(target_uid, {})
-        ADMIN_OVERRIDES[target_uid][month_key] = override_days
-
-        save_attendance()
-        bot.reply_to(
-            message,
-            f"✅ 已设置用户 {target_uid} 在 {month_key} 的月度工作天数为 {override_days} 天"
-        )
-    except Exception as e:
-        bot.reply_to(message, f"❌ 设置失败: {str(e)}")
-
-# Patch 6: /batch_set_month_shifts — bulk set work days
-@bot.message_handler(commands=["batch_set_month_shifts"])
-def batch_set_month_shifts(message):
-    uid = message.from_user.id
-    if uid not in ADMIN_IDS:
-        bot.reply_to(message, "❌ 仅管理员可操作")
-        return
-
-    args = message.text.split()
-    if len(args) < 4:
-        bot.reply_to(
-            message,
-            "用法: /batch_set_month_shifts <年月> <天数> <用户ID1> <用户ID2> ...\n"
-            "例: /batch_set_month_shifts 2026-06 5 6438074082 8349071207 8338442147"
-        )
-        return
-
-    try:
-        month_key = args[1]
-        override_days = int(args[2])
-        user_ids = args[3:]
-
-        results = []
-        for uid_str in user_ids:
-            try:
-                target_uid = int(uid_str)
-                ADMIN_OVERRIDES.setdefault(target_uid, {})
-                ADMIN_OVERRIDES[target_uid][month_key] = override_days
-                results.append(f"✅ {target_uid}")
-            except Exception:
-                results.append(f"❌ {uid_str}")
-
-        save_attendance()
-        bot.reply_to(
-            message,
-            f"批量设置完成 ({month_key}, {override_days}天):\n" + "\n".join(results)
-        )
-    except Exception as e:
-        bot.reply_to(message, f"❌ 批量设置失败: {str(e)}")
-
-print("✅ All patches applied, data path: /data/")
-
-if __name__ == "__main__":
-    load_attendance()
-    load_registered_users()
-
-    # Reorder handlers: command handlers before catch-all
-    try:
-        hl = bot.message_handlers
-        catch_idx = None
-        cmd_handlers = []
-        for i, h in enumerate(hl):
-            fn = getattr(h.get('function'), '__name__', '')
-            cmd = h.get('filters', {}).get('commands') if isinstance(h, dict) else None
-            if cmd:
-                cmd_handlers.append((i, h, fn))
-            if fn == 'handler' and not cmd:
-                catch_idx = i
-
-        if catch_idx is not None and cmd_handlers:
-            # Pop all command handlers that are after catch-all, then insert before catch-all
-            moved = []
-            for idx, h, fn in reversed(cmd_handlers):
-                if idx > catch_idx:
-                    moved.append((fn, hl.pop(idx)))
-            moved.reverse()
-            new_catch = next(i for i, h in enumerate(hl)
-                if getattr(h.get('function'), '__name__', '') == 'handler'
-                and not h.get('filters', {}).get('commands'))
-            for fn, h in moved:
-                hl.insert(new_catch, h)
-                new_catch += 1
-            moved_names = [n for n, _ in moved]
-            print(f"✅ Handler order: {moved_names} before catch-all")
-    except Exception as e:
-        print("❌ Handler reorder failed:", e)
-
-    threading.Thread(target=check_missing_checkins, daemon=True).start()
-
-    print("🤖 Bot started (JSON persistence at /data/)")
-
-    bot.infinity_polling(
-        skip_pending=True,
-        timeout=20,
-        long_polling_timeout=20
-    )
-
+import asyncio
+import atexit
+import bisect
+import csv
+import functools
+import heapq
+import hmac
+import html
+import json
+import marshal
+import mmap
+import os
+import queue
+import secrets
+import shutil
+import signal
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time as time_mod
+from datetime import datetime, timedelta, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from zoneinfo import ZoneInfo
+import telebot
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+
+DATA_FILE = "attendance.json"
+REGISTER_FILE = "registered_users.json"
+USER_NAMES_FILE = "user_names.json"
+JOURNAL_FILE = "attendance.journal.jsonl"
+ACTIVITY_TIMERS_FILE = "activity_timers.json"
+RUNTIME_STATE_FILE = "runtime_state.json"
+SQLITE_FILE = "attendance.db"
+MONTHS_DIR = "attendance_months"
+BINARY_SNAPSHOT_FILE = "attendance.snapshot"
+
+ATTENDANCE = defaultdict(lambda: defaultdict(dict))
+REGISTERED_USERS = set()
+ADMIN_OVERRIDES = {}
+
+# 快照是否缩进排版；关闭后文件更小、写得更快
+SNAPSHOT_PRETTY = os.getenv("SNAPSHOT_PRETTY", "1") != "0"
+
+# ===== 指标 (Prometheus 文本格式) =====
+# 计数器 / 直方图始终在内存里累加（每次只是一次加锁）；设置 METRICS_PORT 后通过 GET /metrics 暴露。
+METRICS = []
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _metric_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _metric_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_metric_label_value(v)}"' for k, v in pairs) + "}"
+
+def _metric_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        METRICS.append(self)
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_metric_labels(list(zip(self.labels, key)))} {_metric_value(v)}" for key, v in items]
+
+class MetricCounter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class MetricHistogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=METRICS_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        idx = bisect.bisect_left(self.buckets, value)   # le 包含边界
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, n)) for key, (counts, total, n) in self._values.items())
+        lines = []
+        for key, (counts, total, n) in items:
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_metric_labels(pairs + [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_metric_labels(pairs)} {_metric_value(total)}")
+            lines.append(f"{self.name}_count{_metric_labels(pairs)} {n}")
+        return lines
+
+class MetricGauge(Metric):
+    """抓取时才调用 fn 取值；fn 返回数字，或 {标签值元组: 数字}"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn, labels=()):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"❌ Metric {self.name} failed:", e)
+            return []
+        items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        return [f"{self.name}{_metric_labels(list(zip(self.labels, key)))} {_metric_value(v)}" for key, v in items]
+
+def render_metrics():
+    lines = []
+    for metric in list(METRICS):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+HANDLER_SECONDS = MetricHistogram(
+    "attendance_handler_duration_seconds", "Time spent in an update handler or punch action", ("handler",))
+SAVE_SECONDS = MetricHistogram(
+    "attendance_save_duration_seconds", "Time to persist attendance (flush = incremental, snapshot = full)", ("kind",))
+BYTES_WRITTEN = MetricCounter(
+    "attendance_bytes_written_total", "Bytes written to data files", ("target",))
+API_REQUESTS = MetricCounter(
+    "attendance_bot_api_requests_total", "Bot API calls", ("method", "chat"))
+API_FAILURES = MetricCounter(
+    "attendance_bot_api_failures_total", "Failed Bot API calls", ("method", "chat", "code"))
+API_SECONDS = MetricHistogram(
+    "attendance_bot_api_duration_seconds", "Bot API call latency", ("method",))
+MISSED_TICK_SECONDS = MetricHistogram(
+    "attendance_missed_checkin_tick_seconds", "Missed-checkin loop iteration time")
+
+def observe_handler(name):
+    """把函数耗时记到 attendance_handler_duration_seconds{handler=name}"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time_mod.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                HANDLER_SECONDS.observe(time_mod.perf_counter() - started, name)
+        wrapper.observed_as = name
+        return wrapper
+    return decorate
+
+def _write_target(path):
+    """bytes_written 的 target 标签：所有月份文件算一个，其余用文件名"""
+    if os.path.normpath(os.path.dirname(path) or ".") == os.path.normpath(MONTHS_DIR):
+        return os.path.basename(MONTHS_DIR)
+    return os.path.basename(path)
+
+def _atomic_write(path, write, binary=False):
+    """写临时文件 → fsync → os.replace，崩溃时旧文件保持完整"""
+    directory = os.path.dirname(path) or "."
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        if binary:
+            f = open(tmp_path, "wb")
+        else:
+            f = open(tmp_path, "w", encoding="utf-8")
+        with f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+            size = os.fstat(f.fileno()).st_size
+        os.replace(tmp_path, path)
+        BYTES_WRITTEN.inc(_write_target(path), amount=size)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _atomic_write_json(path, data, pretty=None):
+    if pretty is None:
+        pretty = SNAPSHOT_PRETTY
+    if pretty:
+        _atomic_write(path, lambda f: json.dump(data, f, ensure_ascii=False, indent=2))
+    else:
+        _atomic_write(path, lambda f: json.dump(data, f, ensure_ascii=False, separators=(",", ":")))
+
+# ===== 考勤记录模型 =====
+# 时间统一存 epoch 秒 (int)，只在展示 / 序列化时才转成 datetime / ISO 字符串。
+def _iso_to_epoch(value):
+    return int(datetime.fromisoformat(value).timestamp()) if value else None
+
+def _epoch_to_iso(ts):
+    return datetime.fromtimestamp(ts, LOCAL_TZ).isoformat() if ts is not None else None
+
+def to_epoch(dt):
+    return int(dt.timestamp())
+
+def from_epoch(ts):
+    return datetime.fromtimestamp(ts, LOCAL_TZ)
+
+class ShiftPunch:
+    """一个班次的上下班打卡"""
+    __slots__ = ("checkin", "checkout")
+
+    def __init__(self, checkin=None, checkout=None):
+        self.checkin = checkin
+        self.checkout = checkout
+
+    def __repr__(self):
+        return f"ShiftPunch({self.checkin!r}, {self.checkout!r})"
+
+class DayRecord:
+    """某人某天的考勤：HR 多 slot + 早班 / 晚班固定位置"""
+    __slots__ = ("hr", "morning", "night", "late_minutes", "early_leave_minutes")
+
+    def __init__(self):
+        self.hr = []              # HR slot 1..n
+        self.morning = None       # FINDING 早班
+        self.night = None         # FINDING / PROMO 晚班
+        self.late_minutes = 0
+        self.early_leave_minutes = 0
+
+    def __repr__(self):
+        return (f"DayRecord(hr={self.hr!r}, morning={self.morning!r}, night={self.night!r}, "
+                f"late={self.late_minutes}, early={self.early_leave_minutes})")
+
+    def hr_slot(self, slot):
+        """第 slot 个 HR 班次 (1 开始)，不存在则补齐"""
+        while len(self.hr) < slot:
+            self.hr.append(ShiftPunch())
+        return self.hr[slot - 1]
+
+    def next_hr_slot(self):
+        """下一个还没上班打卡的 HR slot，避免同一天多次打卡互相覆盖"""
+        for i, punch in enumerate(self.hr):
+            if punch.checkin is None:
+                return i + 1
+        return len(self.hr) + 1
+
+    def morning_punch(self):
+        if self.morning is None:
+            self.morning = ShiftPunch()
+        return self.morning
+
+    def night_punch(self):
+        if self.night is None:
+            self.night = ShiftPunch()
+        return self.night
+
+    def has_hr_checkin(self):
+        return bool(self.hr) and self.hr[0].checkin is not None
+
+    def has_morning_checkin(self):
+        return self.morning is not None and self.morning.checkin is not None
+
+    def has_night_checkin(self):
+        return self.night is not None and self.night.checkin is not None
+
+    def shift_count(self):
+        """当天上班打卡的班次数"""
+        count = 0
+        for punch in self.hr:
+            if punch.checkin is None:
+                break
+            count += 1
+        if self.has_morning_checkin():
+            count += 1
+        if self.has_night_checkin():
+            count += 1
+        return count
+
+    @classmethod
+    def from_json(cls, rec):
+        """兼容原有 JSON 格式 (checkin / checkin_2 / morning_checkin ... ISO 字符串)"""
+        day = cls()
+
+        # ===== HR 多 slot 打卡 (checkin/checkout, checkin_2/checkout_2 ...) =====
+        # 中间可以有空 slot（例如第 2 段跨零点下班，只在次日记录里留下 checkout_2）
+        last = 1 if rec.get("checkin") or rec.get("checkout") else 0
+        for key, value in rec.items():
+            prefix, _, slot = key.rpartition("_")
+            if value and prefix in ("checkin", "checkout") and slot.isdigit():
+                last = max(last, int(slot))
+        for slot in range(1, last + 1):
+            suffix = "" if slot == 1 else f"_{slot}"
+            day.hr.append(ShiftPunch(_iso_to_epoch(rec.get(f"checkin{suffix}")),
+                                     _iso_to_epoch(rec.get(f"checkout{suffix}"))))
+
+        # ===== 早班/晚班 =====
+        if rec.get("morning_checkin") or rec.get("morning_checkout"):
+            day.morning = ShiftPunch(_iso_to_epoch(rec.get("morning_checkin")),
+                                     _iso_to_epoch(rec.get("morning_checkout")))
+        if rec.get("night_checkin") or rec.get("night_checkout"):
+            day.night = ShiftPunch(_iso_to_epoch(rec.get("night_checkin")),
+                                   _iso_to_epoch(rec.get("night_checkout")))
+
+        # ===== 迟到 / 早退 =====
+        day.late_minutes = rec.get("late_minutes", 0) or 0
+        day.early_leave_minutes = rec.get("early_leave_minutes", 0) or 0
+        return day
+
+    def copy(self):
+        day = DayRecord()
+        day.hr = [ShiftPunch(p.checkin, p.checkout) for p in self.hr]
+        day.morning = ShiftPunch(self.morning.checkin, self.morning.checkout) if self.morning else None
+        day.night = ShiftPunch(self.night.checkin, self.night.checkout) if self.night else None
+        day.late_minutes = self.late_minutes
+        day.early_leave_minutes = self.early_leave_minutes
+        return day
+
+    def to_json(self):
+        first = self.hr[0] if self.hr else ShiftPunch()
+        morning = self.morning or ShiftPunch()
+        night = self.night or ShiftPunch()
+        day_data = {
+            "checkin": _epoch_to_iso(first.checkin),
+            "checkout": _epoch_to_iso(first.checkout),
+
+            "morning_checkin": _epoch_to_iso(morning.checkin),
+            "morning_checkout": _epoch_to_iso(morning.checkout),
+            "night_checkin": _epoch_to_iso(night.checkin),
+            "night_checkout": _epoch_to_iso(night.checkout),
+
+            "late_minutes": self.late_minutes,
+            "early_leave_minutes": self.early_leave_minutes,
+        }
+        # HR 多 slot 打卡
+        for slot, punch in enumerate(self.hr[1:], start=2):
+            if punch.checkin is not None:
+                day_data[f"checkin_{slot}"] = _epoch_to_iso(punch.checkin)
+            if punch.checkout is not None:
+                day_data[f"checkout_{slot}"] = _epoch_to_iso(punch.checkout)
+        return day_data
+
+EMPTY_DAY = DayRecord()   # 只读占位，不要修改
+
+def _fmt_clock(ts):
+    return from_epoch(ts).strftime('%H:%M:%S')
+
+# ===== 线程安全的状态层 =====
+# 同一个 uid 的状态（上班状态、活动、次数、考勤记录、覆盖天数）只在该 uid 的条带锁内修改，
+# 不同的人互不阻塞。考勤记录写时复制：edit_day 修改副本、完成后整体替换，
+# 序列化只需浅拷贝字典结构，不持锁也不会读到改了一半的记录。
+STATE_LOCK_STRIPES = max(1, int(os.getenv("STATE_LOCK_STRIPES", "64")))
+_uid_locks = [threading.RLock() for _ in range(STATE_LOCK_STRIPES)]
+_registry_lock = threading.Lock()
+_user_versions = defaultdict(int)   # uid -> 考勤修改次数，用于让缓存失效
+_month_versions = defaultdict(int)  # month_key -> 考勤修改次数
+_version_lock = threading.Lock()    # 不同分片锁上的人会同时 +1，计数本身要共用一把锁
+
+def user_lock(uid):
+    return _uid_locks[uid % STATE_LOCK_STRIPES]
+
+def user_version(uid):
+    return _user_versions.get(uid, 0)
+
+def per_user(fn):
+    """第一个参数是 uid 或 message，整个函数在该用户的锁内执行"""
+    @functools.wraps(fn)
+    def wrapper(target, *args, **kwargs):
+        uid = target if isinstance(target, int) else target.from_user.id
+        with user_lock(uid):
+            return fn(target, *args, **kwargs)
+    return wrapper
+
+def snapshot_attendance(month_key=None):
+    """{uid: {month: {date: DayRecord}}} 浅拷贝；记录发布后不再原地修改，可以直接序列化"""
+    snap = {}
+    for uid, months in list(ATTENDANCE.items()):
+        if month_key is None:
+            user_months = {mk: days.copy() for mk, days in list(months.items())}
+        else:
+            days = months.get(month_key)
+            if not days:
+                continue
+            user_months = {month_key: days.copy()}
+        if user_months:
+            snap[uid] = user_months
+    return snap
+
+def snapshot_overrides():
+    return {uid: months.copy() for uid, months in list(ADMIN_OVERRIDES.items())}
+
+def set_admin_override(uid, month_key, days):
+    with user_lock(uid):
+        months = dict(ADMIN_OVERRIDES.get(uid, {}))
+        months[month_key] = days
+        ADMIN_OVERRIDES[uid] = months
+    mark_override_dirty(uid, month_key)
+
+def register_user(uid):
+    """第一次出现的用户加入注册表并安排未打卡检查；返回是否新注册"""
+    with _registry_lock:
+        if uid in REGISTERED_USERS:
+            return False
+        REGISTERED_USERS.add(uid)
+    save_registered_users()
+    schedule_user_deadlines(uid)
+    return True
+
+def registered_users_snapshot():
+    with _registry_lock:
+        return set(REGISTERED_USERS)
+
+# ===== 月度统计计数器 =====
+# 每人每月的 (班次数, 出勤天数, 迟到分钟, 早退分钟)，打卡时增量更新，
+# 加载时整体重建一次；get_attendance_summary 直接读取，不再扫描历史。
+class MonthStats:
+    __slots__ = ("shifts", "days", "late_minutes", "early_leave_minutes")
+
+    def __init__(self):
+        self.shifts = 0
+        self.days = 0
+        self.late_minutes = 0
+        self.early_leave_minutes = 0
+
+    def __repr__(self):
+        return (f"MonthStats(shifts={self.shifts}, days={self.days}, "
+                f"late={self.late_minutes}, early={self.early_leave_minutes})")
+
+MONTH_STATS = {}   # (uid, month_key) -> MonthStats
+# 冷月份加载时 rebuild 和其他线程的打卡会同时改计数器，增删和加减都在这把锁里
+_stats_lock = threading.Lock()
+
+def _day_contribution(rec):
+    shifts = rec.shift_count()
+    return shifts, 1 if shifts else 0, rec.late_minutes, rec.early_leave_minutes
+
+def _apply_contribution(uid, month_key, contribution, sign):
+    shifts, days, late, early = contribution
+    if not (shifts or days or late or early):
+        return
+    with _stats_lock:
+        stats = MONTH_STATS.get((uid, month_key))
+        if stats is None:
+            stats = MONTH_STATS[(uid, month_key)] = MonthStats()
+        stats.shifts += sign * shifts
+        stats.days += sign * days
+        stats.late_minutes += sign * late
+        stats.early_leave_minutes += sign * early
+
+def rebuild_month_stats(month_key=None):
+    """全部（或某个月）重新统计一次，用于加载之后"""
+    with _stats_lock:
+        if month_key is None:
+            MONTH_STATS.clear()
+        else:
+            for key in [k for k in list(MONTH_STATS) if k[1] == month_key]:
+                del MONTH_STATS[key]
+    for uid, months in list(ATTENDANCE.items()):
+        for mk, days in list(months.items()):
+            if month_key is not None and mk != month_key:
+                continue
+            for rec in list(days.values()):
+                _apply_contribution(uid, mk, _day_contribution(rec), 1)
+
+def get_month_stats(uid, month_key):
+    return MONTH_STATS.get((uid, month_key)) or MonthStats()
+
+@contextmanager
+def edit_day(uid, month_key, date_key):
+    """修改某人某天考勤的唯一入口：加载月份 → 修改副本 → 替换 → 更新计数器 → 标记 dirty"""
+    with user_lock(uid):
+        # 先标记再加载：从这里到落盘这个月都不会被 LRU 踢出
+        get_storage().touch_month(month_key)
+        ensure_month_loaded(month_key)
+        days = ATTENDANCE[uid].setdefault(month_key, {})
+        old = days.get(date_key)
+        rec = old.copy() if old is not None else DayRecord()
+        before = _day_contribution(rec)
+        try:
+            yield rec
+        finally:
+            # 正在序列化的快照仍然拿着旧对象
+            days[date_key] = rec
+            with _version_lock:
+                _user_versions[uid] += 1
+                _month_versions[month_key] += 1
+            _apply_contribution(uid, month_key, before, -1)
+            _apply_contribution(uid, month_key, _day_contribution(rec), 1)
+    mark_dirty(uid, month_key, date_key)
+
+def _json_load_attendance():
+    global ATTENDANCE, ADMIN_OVERRIDES
+    ADMIN_OVERRIDES = {}
+    if not os.path.exists(DATA_FILE):
+        print("📂 attendance.json not found, starting fresh")
+        replay_journal()
+        return
+
+    try:
+        with open(DATA_FILE, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+
+        # admin_overrides 与考勤存在同一个快照里
+        overrides_raw = raw.pop("admin_overrides", {})
+        for uid_str, months in overrides_raw.items():
+            ADMIN_OVERRIDES[int(uid_str)] = months
+        if ADMIN_OVERRIDES:
+            print("✅ Admin overrides loaded:", len(ADMIN_OVERRIDES), "users")
+
+        for uid, months in raw.items():
+            uid = int(uid)
+            for month, days in months.items():
+                for day, rec in days.items():
+                    ATTENDANCE[uid][month][day] = DayRecord.from_json(rec)
+
+        print("✅ Attendance loaded from JSON")
+
+    except Exception as e:
+        print("❌ Failed to load attendance.json:", e)
+
+    replay_journal()
+
+def _json_load_registered_users():
+    if not os.path.exists(REGISTER_FILE):
+        print("📂 registered_users.json not found, starting fresh")
+        return set()
+
+    try:
+        with open(REGISTER_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        print("✅ Registered users loaded")
+        return set(map(int, data))
+    except Exception as e:
+        print("❌ Failed to load registered users:", e)
+        return set()
+
+
+def _json_save_registered_users(users):
+    try:
+        _atomic_write_json(REGISTER_FILE, list(users))
+    except Exception as e:
+        print("❌ Failed to save registered users:", e)
+
+def _json_save_attendance(pretty=None):
+    """考勤 + admin_overrides 一次性写入快照（只写一次，不回读）"""
+    data = {}
+
+    for uid, months in snapshot_attendance().items():
+        data[str(uid)] = {}
+        for month, days in months.items():
+            data[str(uid)][month] = {}
+            for day, rec in days.items():
+                data[str(uid)][month][day] = rec.to_json()
+
+    data["admin_overrides"] = {
+        str(uid): months for uid, months in snapshot_overrides().items()
+    }
+
+    try:
+        _atomic_write_json(DATA_FILE, data, pretty=pretty)
+        return True
+    except Exception as e:
+        print("❌ Failed to save attendance.json:", e)
+        return False
+
+# ===== 追加日志 (journal) =====
+# 每次打卡只追加一行紧凑 JSON，不再整文件重写；
+# 启动时在快照之上重放，超过阈值后后台压缩成新快照。
+JOURNAL_ENABLED = os.getenv("ATTENDANCE_JOURNAL", "1") != "0"
+JOURNAL_MAX_BYTES = int(os.getenv("JOURNAL_MAX_BYTES", str(4 * 1024 * 1024)))
+JOURNAL_MAX_ENTRIES = int(os.getenv("JOURNAL_MAX_ENTRIES", "2000"))
+
+_journal_lock = threading.Lock()
+_journal_entries = 0
+_journal_compacting = False
+
+def _journal_rotated_file():
+    return JOURNAL_FILE + ".compacting"
+
+def _journal_append(entries):
+    """一次 write 追加多条日志；追加和退回的整文件保存都失败时返回 False"""
+    global _journal_entries
+    if not entries:
+        return True
+    lines = "".join(
+        json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        for entry in entries
+    )
+    try:
+        with _journal_lock:
+            with open(JOURNAL_FILE, "a", encoding="utf-8") as f:
+                start = f.tell()
+                f.write(lines)
+                size = f.tell()
+            BYTES_WRITTEN.inc("journal", amount=size - start)
+            _journal_entries += len(entries)
+            entries = _journal_entries
+    except Exception as e:
+        # 日志写不进去时退回整文件保存，保证不丢数据
+        print("❌ Failed to append journal:", e)
+        return _json_save_attendance()
+
+    if entries >= JOURNAL_MAX_ENTRIES or size >= JOURNAL_MAX_BYTES:
+        _start_journal_compaction()
+    return True
+
+def _apply_journal_entry(entry):
+    op = entry.get("op")
+    uid = int(entry["uid"])
+    if op == "day":
+        storage = get_storage()
+        storage.ensure_month(entry["month"])
+        storage.touch_month(entry["month"])
+        ATTENDANCE[uid][entry["month"]][entry["day"]] = DayRecord.from_json(entry["rec"])
+    elif op == "override":
+        ADMIN_OVERRIDES.setdefault(uid, {})
+        if entry.get("days") is None:
+            ADMIN_OVERRIDES[uid].pop(entry["month"], None)
+        else:
+            ADMIN_OVERRIDES[uid][entry["month"]] = entry["days"]
+
+def _replay_journal_file(path):
+    count = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 崩溃时最后一行可能只写了一半，直接丢弃
+                print("⚠️ Skipping torn journal line in", path)
+                continue
+            _apply_journal_entry(entry)
+            count += 1
+    return count
+
+def replay_journal():
+    """在已加载的快照之上重放 journal（先重放上次未完成压缩的旧段）"""
+    global _journal_entries
+    total = 0
+    for path in (_journal_rotated_file(), JOURNAL_FILE):
+        if not os.path.exists(path):
+            continue
+        try:
+            total += _replay_journal_file(path)
+        except Exception as e:
+            print(f"❌ Failed to replay journal {path}:", e)
+    _journal_entries = total
+    if total:
+        print(f"✅ Journal replayed: {total} entries")
+    return total
+
+def _rotate_journal():
+    """把当前 journal 移到 .compacting 段；上次压缩失败留下的旧段则合并进去"""
+    global _journal_entries
+    rotated = _journal_rotated_file()
+    if os.path.exists(JOURNAL_FILE):
+        if os.path.exists(rotated):
+            with open(JOURNAL_FILE, "rb") as src, open(rotated, "ab") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(JOURNAL_FILE)
+        else:
+            os.replace(JOURNAL_FILE, rotated)
+    _journal_entries = 0
+
+def compact_journal():
+    """写一份新快照并丢弃已经包含在快照里的 journal 段"""
+    global _journal_compacting
+    try:
+        with _journal_lock:
+            _rotate_journal()
+        # 轮转之后的修改会进入新 journal；日志条目是整天覆盖，重复重放无副作用
+        started = time_mod.perf_counter()
+        ok = get_storage().snapshot()
+        SAVE_SECONDS.observe(time_mod.perf_counter() - started, "snapshot")
+        if ok:
+            rotated = _journal_rotated_file()
+            if os.path.exists(rotated):
+                os.remove(rotated)
+            print("✅ Journal compacted into snapshot")
+        else:
+            print("❌ Journal compaction failed, keeping journal segment")
+    except Exception as e:
+        print("❌ Journal compaction error:", e)
+    finally:
+        _journal_compacting = False
+
+def _start_journal_compaction():
+    global _journal_compacting
+    with _journal_lock:
+        if _journal_compacting:
+            return
+        _journal_compacting = True
+    threading.Thread(target=compact_journal, daemon=True).start()
+
+def _day_entry(uid, month_key, date_key):
+    rec = ATTENDANCE[uid][month_key][date_key]
+    return {
+        "op": "day",
+        "uid": uid,
+        "month": month_key,
+        "day": date_key,
+        "rec": rec.to_json(),
+    }
+
+def encode_each(keys, encode, what):
+    """逐条编码；编码失败的条目打印后丢弃，不拖累同一批里其他人的修改"""
+    encoded = []
+    for key in keys:
+        try:
+            encoded.append(encode(*key))
+        except Exception as e:
+            PERSIST_STATS["dropped"] += 1
+            print(f"❌ Dropped {what} {key} from flush: {e!r}")
+    return encoded
+
+def _override_entry(uid, month_key):
+    return {
+        "op": "override",
+        "uid": uid,
+        "month": month_key,
+        "days": ADMIN_OVERRIDES.get(uid, {}).get(month_key),
+    }
+
+# ===== 存储后端 =====
+# STORAGE_BACKEND=json（默认，快照 + journal）或 sqlite（WAL，按行 upsert）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+
+def _query_days_in_memory(uid, start_date, end_date):
+    """[start_date, end_date] 范围内的 (date_key, rec)，按日期排序；只看范围内的月份"""
+    result = []
+    for month_key, month in list(ATTENDANCE.get(uid, {}).items()):
+        if not start_date[:7] <= month_key <= end_date[:7]:
+            continue
+        for date_key, rec in list(month.items()):
+            if start_date <= date_key <= end_date:
+                result.append((date_key, rec))
+    result.sort(key=lambda item: item[0])
+    return result
+
+class JsonStorage:
+    name = "json"
+
+    def load_attendance(self):
+        _json_load_attendance()
+
+    def save_attendance(self, pretty=None):
+        return _json_save_attendance(pretty)
+
+    def snapshot(self):
+        """journal 压缩时写的快照"""
+        return _json_save_attendance()
+
+    def ensure_month(self, month_key):
+        """整份数据都在内存里，无需加载"""
+
+    def touch_month(self, month_key):
+        pass
+
+    def list_months(self):
+        return sorted({m for months in list(ATTENDANCE.values()) for m in list(months)})
+
+    def write_changes(self, days, overrides):
+        if JOURNAL_ENABLED:
+            entries = encode_each(days, _day_entry, "day")
+            entries += encode_each(overrides, _override_entry, "override")
+            return _journal_append(entries)
+        return _json_save_attendance()
+
+    def query_days(self, uid, start_date, end_date):
+        return _query_days_in_memory(uid, start_date, end_date)
+
+    def load_registered_users(self):
+        return _json_load_registered_users()
+
+    def save_registered_users(self, users):
+        _json_save_registered_users(users)
+
+    def close(self):
+        pass
+
+
+_SHIFT_COLUMNS = (
+    "checkin", "checkout",
+    "morning_checkin", "morning_checkout",
+    "night_checkin", "night_checkout",
+)
+
+class SqliteStorage:
+    """一天一行 (uid, logical_date)，打卡只 upsert 被改动的那一行"""
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS shifts (
+            uid INTEGER NOT NULL,
+            logical_date TEXT NOT NULL,
+            month TEXT NOT NULL,
+            checkin TEXT,
+            checkout TEXT,
+            morning_checkin TEXT,
+            morning_checkout TEXT,
+            night_checkin TEXT,
+            night_checkout TEXT,
+            late_minutes INTEGER NOT NULL DEFAULT 0,
+            early_leave_minutes INTEGER NOT NULL DEFAULT 0,
+            extra_slots TEXT,
+            PRIMARY KEY (uid, logical_date)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_shifts_month ON shifts (month, uid);
+        CREATE TABLE IF NOT EXISTS admin_overrides (
+            uid INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            days INTEGER NOT NULL,
+            PRIMARY KEY (uid, month)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS registered_users (
+            uid INTEGER PRIMARY KEY
+        );
+    """
+
+    UPSERT_SHIFT = """
+        INSERT INTO shifts (uid, logical_date, month, checkin, checkout,
+                            morning_checkin, morning_checkout, night_checkin, night_checkout,
+                            late_minutes, early_leave_minutes, extra_slots)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (uid, logical_date) DO UPDATE SET
+            month = excluded.month,
+            checkin = excluded.checkin,
+            checkout = excluded.checkout,
+            morning_checkin = excluded.morning_checkin,
+            morning_checkout = excluded.morning_checkout,
+            night_checkin = excluded.night_checkin,
+            night_checkout = excluded.night_checkout,
+            late_minutes = excluded.late_minutes,
+            early_leave_minutes = excluded.early_leave_minutes,
+            extra_slots = excluded.extra_slots
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _shift_row(uid, month_key, date_key, rec):
+        day_data = rec.to_json()
+        extra = {k: v for k, v in day_data.items() if k.startswith(("checkin_", "checkout_"))}
+        return (
+            uid, date_key, month_key,
+            *(day_data[col] for col in _SHIFT_COLUMNS),
+            day_data["late_minutes"], day_data["early_leave_minutes"],
+            json.dumps(extra, separators=(",", ":")) if extra else None,
+        )
+
+    @staticmethod
+    def _rec_from_row(row):
+        day_data = dict(zip(_SHIFT_COLUMNS, row[:6]))
+        day_data["late_minutes"] = row[6]
+        day_data["early_leave_minutes"] = row[7]
+        if row[8]:
+            day_data.update(json.loads(row[8]))
+        return DayRecord.from_json(day_data)
+
+    def load_attendance(self):
+        global ADMIN_OVERRIDES
+        ADMIN_OVERRIDES = {}
+        try:
+            with self._lock:
+                db = self._db()
+                rows = db.execute(
+                    "SELECT uid, month, logical_date, " + ", ".join(_SHIFT_COLUMNS)
+                    + ", late_minutes, early_leave_minutes, extra_slots FROM shifts"
+                ).fetchall()
+                overrides = db.execute("SELECT uid, month, days FROM admin_overrides").fetchall()
+            for row in rows:
+                ATTENDANCE[row[0]][row[1]][row[2]] = self._rec_from_row(row[3:])
+            for uid, month, days in overrides:
+                ADMIN_OVERRIDES.setdefault(uid, {})[month] = days
+            print(f"✅ Attendance loaded from SQLite ({len(rows)} days)")
+        except Exception as e:
+            print("❌ Failed to load attendance from SQLite:", e)
+
+    def ensure_month(self, month_key):
+        """启动时已全部载入内存"""
+
+    def touch_month(self, month_key):
+        pass
+
+    def save_attendance(self, pretty=None):
+        """全量写入（迁移用）；平时走 write_changes"""
+        rows = [
+            self._shift_row(uid, month_key, date_key, rec)
+            for uid, months in snapshot_attendance().items()
+            for month_key, days in months.items()
+            for date_key, rec in days.items()
+        ]
+        overrides = [
+            (uid, month, days)
+            for uid, months in snapshot_overrides().items()
+            for month, days in months.items()
+        ]
+        try:
+            with self._lock:
+                db = self._db()
+                with db:
+                    db.execute("DELETE FROM shifts")
+                    db.execute("DELETE FROM admin_overrides")
+                    db.executemany(self.UPSERT_SHIFT, rows)
+                    db.executemany("INSERT INTO admin_overrides (uid, month, days) VALUES (?, ?, ?)", overrides)
+            return True
+        except Exception as e:
+            print("❌ Failed to save attendance to SQLite:", e)
+            return False
+
+    def write_changes(self, days, overrides):
+        rows = encode_each(
+            days,
+            lambda uid, month_key, date_key: self._shift_row(uid, month_key, date_key, ATTENDANCE[uid][month_key][date_key]),
+            "day",
+        )
+        set_overrides = []
+        del_overrides = []
+        for uid, month_key in overrides:
+            value = ADMIN_OVERRIDES.get(uid, {}).get(month_key)
+            if value is None:
+                del_overrides.append((uid, month_key))
+            else:
+                set_overrides.append((uid, month_key, value))
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany(self.UPSERT_SHIFT, rows)
+                db.executemany(
+                    "INSERT INTO admin_overrides (uid, month, days) VALUES (?, ?, ?) "
+                    "ON CONFLICT (uid, month) DO UPDATE SET days = excluded.days",
+                    set_overrides,
+                )
+                db.executemany("DELETE FROM admin_overrides WHERE uid = ? AND month = ?", del_overrides)
+
+    def query_days(self, uid, start_date, end_date):
+        """启动时所有行都已载入内存；库里还没有 PERSIST_INTERVAL 内未 flush 的打卡，所以读内存"""
+        return _query_days_in_memory(uid, start_date, end_date)
+
+    def load_registered_users(self):
+        try:
+            with self._lock:
+                rows = self._db().execute("SELECT uid FROM registered_users").fetchall()
+            print("✅ Registered users loaded")
+            return {row[0] for row in rows}
+        except Exception as e:
+            print("❌ Failed to load registered users:", e)
+            return set()
+
+    def save_registered_users(self, users):
+        try:
+            with self._lock:
+                db = self._db()
+                with db:
+                    db.executemany(
+                        "INSERT OR IGNORE INTO registered_users (uid) VALUES (?)",
+                        [(uid,) for uid in users],
+                    )
+        except Exception as e:
+            print("❌ Failed to save registered users:", e)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# ===== 按月分区存储 (STORAGE_BACKEND=monthly) =====
+# 每个 YYYY-MM 一个文件；启动只加载本月和上月，更早的月份按需加载，
+# 冷月份用 LRU 控制在内存中的数量。
+MAX_COLD_MONTHS = int(os.getenv("MAX_COLD_MONTHS", "3"))
+
+class MonthlyJsonStorage(JsonStorage):
+    name = "monthly"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._loaded = set()               # 已在内存中的月份
+        self._cold = OrderedDict()         # 冷月份 LRU
+        self._unsnapshotted = set()        # 有修改但还没写入月文件的月份
+        self._in_flight = Counter()        # 正在写快照 / 写 journal 的月份
+        self._overrides_dirty = False
+
+    def _month_file(self, month_key):
+        return os.path.join(self.directory, f"{month_key}.json")
+
+    def _overrides_file(self):
+        return os.path.join(self.directory, "admin_overrides.json")
+
+    @staticmethod
+    def _hot_months():
+        today = now().date()
+        prev = today.replace(day=1) - timedelta(days=1)
+        return {today.strftime("%Y-%m"), prev.strftime("%Y-%m")}
+
+    def _split_legacy_snapshot(self):
+        """第一次启用时把单文件快照拆成月文件"""
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.exists(DATA_FILE):
+            return
+        with open(DATA_FILE, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        overrides = raw.pop("admin_overrides", {})
+        by_month = defaultdict(dict)
+        for uid, months in raw.items():
+            for month_key, days in months.items():
+                by_month[month_key][uid] = days
+        for month_key, users in by_month.items():
+            _atomic_write_json(self._month_file(month_key), users, pretty=False)
+        _atomic_write_json(self._overrides_file(), overrides, pretty=False)
+        print(f"✅ Split {DATA_FILE} into {len(by_month)} monthly files")
+
+    def _load_month_file(self, month_key):
+        path = self._month_file(month_key)
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            users = json.load(f)
+        for uid, days in users.items():
+            month = ATTENDANCE[int(uid)][month_key]
+            for date_key, rec in days.items():
+                month[date_key] = DayRecord.from_json(rec)
+        rebuild_month_stats(month_key)
+
+    def load_attendance(self):
+        global ADMIN_OVERRIDES
+        ADMIN_OVERRIDES = {}
+        try:
+            if not os.path.isdir(self.directory):
+                self._split_legacy_snapshot()
+            if os.path.exists(self._overrides_file()):
+                with open(self._overrides_file(), "r", encoding="utf-8") as f:
+                    for uid_str, months in json.load(f).items():
+                        ADMIN_OVERRIDES[int(uid_str)] = months
+            for month_key in sorted(self._hot_months()):
+                self.ensure_month(month_key)
+            print(f"✅ Attendance loaded (months: {', '.join(sorted(self._loaded))})")
+        except Exception as e:
+            print("❌ Failed to load monthly attendance:", e)
+        replay_journal()
+
+    def ensure_month(self, month_key):
+        with self._lock:
+            if month_key in self._loaded:
+                if month_key in self._cold:
+                    self._cold.move_to_end(month_key)
+                return
+            self._load_month_file(month_key)
+            self._loaded.add(month_key)
+            if month_key not in self._hot_months():
+                self._cold[month_key] = True
+                self._evict_cold()
+
+    def _evict_cold(self):
+        hot = self._hot_months()
+        # 跨月后旧的"本月/上月"也变成冷月份
+        for month_key in self._loaded - hot - set(self._cold):
+            self._cold[month_key] = True
+            self._cold.move_to_end(month_key, last=False)
+        # 有未落盘修改（dirty 集合里、等快照、正在写）的月份都不能踢出
+        pinned = self._unsnapshotted | pending_months() | {m for m, n in self._in_flight.items() if n > 0}
+        for month_key in list(self._cold):
+            if len(self._cold) <= MAX_COLD_MONTHS:
+                break
+            if month_key in hot:
+                del self._cold[month_key]
+                continue
+            if month_key in pinned:
+                continue   # 还有没落盘的修改，先不踢出
+            del self._cold[month_key]
+            self._loaded.discard(month_key)
+            for months in list(ATTENDANCE.values()):
+                months.pop(month_key, None)
+
+    def touch_month(self, month_key):
+        with self._lock:
+            self._unsnapshotted.add(month_key)
+
+    def list_months(self):
+        on_disk = set()
+        if os.path.isdir(self.directory):
+            on_disk = {
+                name[:-5] for name in os.listdir(self.directory)
+                if len(name) == 12 and name.endswith(".json") and name[4] == "-"
+            }
+        return sorted(on_disk | self._loaded)
+
+    def _write_month(self, month_key):
+        users = {
+            str(uid): {date_key: rec.to_json() for date_key, rec in months[month_key].items()}
+            for uid, months in snapshot_attendance(month_key).items()
+        }
+        path = self._month_file(month_key)
+        if month_key not in self._loaded and os.path.exists(path):
+            # 没加载进内存的月份：以月文件为底，叠上内存里零散的修改
+            with open(path, "r", encoding="utf-8") as f:
+                on_disk = json.load(f)
+            for uid, days in users.items():
+                on_disk.setdefault(uid, {}).update(days)
+            users = on_disk
+        _atomic_write_json(path, users, pretty=False)
+
+    def _write_overrides(self):
+        _atomic_write_json(
+            self._overrides_file(),
+            {str(uid): months for uid, months in snapshot_overrides().items()},
+            pretty=False,
+        )
+
+    def _write_months(self, month_keys, overrides):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for month_key in sorted(month_keys):
+                self._write_month(month_key)
+            if overrides:
+                self._write_overrides()
+            return True
+        except Exception as e:
+            print("❌ Failed to save monthly attendance:", e)
+            return False
+
+    def snapshot(self):
+        """只重写自上次快照以来有改动的月份"""
+        with self._lock:
+            months, self._unsnapshotted = self._unsnapshotted, set()
+            overrides, self._overrides_dirty = self._overrides_dirty, False
+            self._in_flight.update(months)
+        try:
+            if self._write_months(months, overrides):
+                return True
+            with self._lock:
+                self._unsnapshotted |= months
+                self._overrides_dirty = self._overrides_dirty or overrides
+            return False
+        finally:
+            with self._lock:
+                self._in_flight.subtract(months)
+
+    def save_attendance(self, pretty=None):
+        with self._lock:
+            months = set(self._loaded)
+            self._unsnapshotted.clear()
+            self._overrides_dirty = False
+            self._in_flight.update(months)
+        try:
+            return self._write_months(months, True)
+        finally:
+            with self._lock:
+                self._in_flight.subtract(months)
+
+    def write_changes(self, days, overrides):
+        months = {month_key for _, month_key, _ in days}
+        with self._lock:
+            self._unsnapshotted.update(months)
+            if overrides:
+                self._overrides_dirty = True
+            if JOURNAL_ENABLED:
+                self._in_flight.update(months)
+                # 快照之后才被踢出的月份：重新载入（快照里已经有这次的修改）
+                for month_key in months:
+                    self.ensure_month(month_key)
+        if JOURNAL_ENABLED:
+            try:
+                entries = encode_each(days, _day_entry, "day")
+                entries += encode_each(overrides, _override_entry, "override")
+                return _journal_append(entries)
+            finally:
+                with self._lock:
+                    self._in_flight.subtract(months)
+        return self.snapshot()
+
+    def query_days(self, uid, start_date, end_date):
+        result = []
+        for month_key in self.list_months():
+            if not start_date[:7] <= month_key <= end_date[:7]:
+                continue
+            # 逐月加载并立即取出，避免 LRU 在遍历过程中踢掉前面的月份
+            self.ensure_month(month_key)
+            for date_key, rec in sorted(ATTENDANCE.get(uid, {}).get(month_key, {}).items()):
+                if start_date <= date_key <= end_date:
+                    result.append((date_key, rec))
+        return result
+
+
+# ===== 二进制快照 (STORAGE_BACKEND=binary) =====
+# 单个文件：定长文件头 + 月份索引 + 每月一个 marshal 块（时间都是 epoch int）。
+# 启动时 mmap 文件、只读索引并解码本月和上月，更早的月份第一次用到时才解码；
+# 重写快照时没改动的月份直接拷贝原始字节。文件头带格式版本，旧版本读入后
+# 下一次快照自动按新版本重写。
+SNAPSHOT_MAGIC = b"ATTSNAP\0"
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct("<8sHIQI")   # magic, version, 月份数, overrides 偏移, overrides 长度
+_SNAPSHOT_ENTRY = struct.Struct("<7sQI")      # YYYY-MM, 偏移, 长度
+
+def _encode_punch(punch):
+    return None if punch is None else (punch.checkin, punch.checkout)
+
+def _decode_punch(value):
+    return None if value is None else ShiftPunch(value[0], value[1])
+
+def _encode_day_v1(rec):
+    return (
+        tuple((p.checkin, p.checkout) for p in rec.hr),
+        _encode_punch(rec.morning), _encode_punch(rec.night),
+        rec.late_minutes, rec.early_leave_minutes,
+    )
+
+def _decode_day_v1(value):
+    rec = DayRecord()
+    rec.hr = [ShiftPunch(ci, co) for ci, co in value[0]]
+    rec.morning = _decode_punch(value[1])
+    rec.night = _decode_punch(value[2])
+    rec.late_minutes = value[3]
+    rec.early_leave_minutes = value[4]
+    return rec
+
+# 格式版本 -> 单日记录解码函数；改格式时加一个新版本，旧文件照样能读
+SNAPSHOT_DAY_DECODERS = {1: _decode_day_v1}
+_encode_day = _encode_day_v1
+
+def encode_month_blob(users):
+    """{uid: {date_key: DayRecord}} → bytes"""
+    return marshal.dumps({
+        uid: {date_key: _encode_day(rec) for date_key, rec in days.items()}
+        for uid, days in users.items()
+    })
+
+def write_binary_snapshot(path, month_blobs, overrides):
+    """month_blobs: {month_key: bytes}；overrides: {uid: {month_key: days}}"""
+    months = sorted(month_blobs)
+    overrides_blob = marshal.dumps({int(uid): dict(m) for uid, m in overrides.items()})
+    offset = _SNAPSHOT_HEADER.size + _SNAPSHOT_ENTRY.size * len(months)
+    entries = []
+    for month_key in months:
+        entries.append(_SNAPSHOT_ENTRY.pack(month_key.encode("ascii"), offset, len(month_blobs[month_key])))
+        offset += len(month_blobs[month_key])
+
+    def write(f):
+        f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(months), offset, len(overrides_blob)))
+        for entry in entries:
+            f.write(entry)
+        for month_key in months:
+            f.write(month_blobs[month_key])
+        f.write(overrides_blob)
+
+    _atomic_write(path, write, binary=True)
+
+class BinarySnapshot:
+    """只读打开一个二进制快照；月份块按需解码"""
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path} is empty")
+        magic, self.version, count, ov_offset, ov_length = _SNAPSHOT_HEADER.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an attendance snapshot")
+        if self.version not in SNAPSHOT_DAY_DECODERS:
+            self.close()
+            raise ValueError(f"{path}: unsupported snapshot version {self.version}")
+        self._overrides_span = (ov_offset, ov_length)
+        self.index = {}
+        for i in range(count):
+            key, offset, length = _SNAPSHOT_ENTRY.unpack_from(self._mm, _SNAPSHOT_HEADER.size + i * _SNAPSHOT_ENTRY.size)
+            self.index[key.decode("ascii")] = (offset, length)
+
+    def month_keys(self):
+        return sorted(self.index)
+
+    def raw_month(self, month_key):
+        offset, length = self.index[month_key]
+        return self._mm[offset:offset + length]
+
+    def decode_month(self, month_key):
+        """{uid: {date_key: DayRecord}}"""
+        if month_key not in self.index:
+            return {}
+        decode = SNAPSHOT_DAY_DECODERS[self.version]
+        return {
+            uid: {date_key: decode(value) for date_key, value in days.items()}
+            for uid, days in marshal.loads(self.raw_month(month_key)).items()
+        }
+
+    def overrides(self):
+        offset, length = self._overrides_span
+        return marshal.loads(self._mm[offset:offset + length])
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+def json_to_binary(json_path=None, binary_path=None):
+    """把 JSON 快照（含 admin_overrides）转成二进制快照"""
+    json_path = json_path or DATA_FILE
+    binary_path = binary_path or BINARY_SNAPSHOT_FILE
+    with open(json_path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    overrides = raw.pop("admin_overrides", {})
+    by_month = defaultdict(dict)
+    for uid, months in raw.items():
+        for month_key, days in months.items():
+            by_month[month_key][int(uid)] = {d: DayRecord.from_json(rec) for d, rec in days.items()}
+    write_binary_snapshot(
+        binary_path,
+        {month_key: encode_month_blob(users) for month_key, users in by_month.items()},
+        {int(uid): months for uid, months in overrides.items()},
+    )
+    print(f"✅ Converted {json_path} → {binary_path} ({len(by_month)} months)")
+
+def binary_to_json(binary_path=None, json_path=None):
+    """把二进制快照转回原来的 JSON 格式"""
+    binary_path = binary_path or BINARY_SNAPSHOT_FILE
+    json_path = json_path or DATA_FILE
+    snap = BinarySnapshot(binary_path)
+    try:
+        data = {}
+        for month_key in snap.month_keys():
+            for uid, days in snap.decode_month(month_key).items():
+                data.setdefault(str(uid), {})[month_key] = {d: rec.to_json() for d, rec in days.items()}
+        data["admin_overrides"] = {str(uid): months for uid, months in snap.overrides().items()}
+    finally:
+        snap.close()
+    _atomic_write_json(json_path, data)
+    print(f"✅ Converted {binary_path} → {json_path}")
+
+class BinarySnapshotStorage(MonthlyJsonStorage):
+    """复用按月分区的懒加载 / LRU，只是所有月份放在一个 mmap 的二进制文件里"""
+    name = "binary"
+
+    def __init__(self, path):
+        super().__init__(os.path.dirname(path) or ".")
+        self.path = path
+        self._snap = None
+        # 重写快照串行执行；self._lock 只在取数据和换文件时持有，打卡不用等编码和 fsync
+        self._write_lock = threading.Lock()
+
+    def _open_snapshot(self):
+        if self._snap is not None:
+            self._snap.close()
+            self._snap = None
+        if os.path.exists(self.path):
+            self._snap = BinarySnapshot(self.path)
+
+    def _load_month_file(self, month_key):
+        if self._snap is None:
+            return
+        for uid, days in self._snap.decode_month(month_key).items():
+            ATTENDANCE[uid].setdefault(month_key, {}).update(days)
+        rebuild_month_stats(month_key)
+
+    def load_attendance(self):
+        global ADMIN_OVERRIDES
+        ADMIN_OVERRIDES = {}
+        started = time_mod.perf_counter()
+        try:
+            if not os.path.exists(self.path) and os.path.exists(DATA_FILE):
+                # 第一次启用：从 JSON 快照转换
+                json_to_binary(DATA_FILE, self.path)
+            with self._lock:
+                self._open_snapshot()
+                if self._snap is not None:
+                    ADMIN_OVERRIDES.update(self._snap.overrides())
+                    if self._snap.version != SNAPSHOT_VERSION:
+                        # 旧格式：下一次快照由 _write_months 把没改动的月份解码后按新版本重写
+                        print(f"⚠️ Snapshot version {self._snap.version}, will migrate to {SNAPSHOT_VERSION}")
+            for month_key in sorted(self._hot_months()):
+                self.ensure_month(month_key)
+            elapsed_ms = (time_mod.perf_counter() - started) * 1000
+            print(f"✅ Attendance snapshot mapped in {elapsed_ms:.1f} ms (months: {', '.join(sorted(self._loaded))})")
+        except Exception as e:
+            print("❌ Failed to load binary snapshot:", e)
+        replay_journal()
+
+    def list_months(self):
+        on_disk = set(self._snap.month_keys()) if self._snap is not None else set()
+        return sorted(on_disk | self._loaded)
+
+    def _write_months(self, month_keys, overrides):
+        """改动过的月份重新编码，其余月份拷贝原始字节，整份文件原子替换"""
+        try:
+            with self._write_lock:
+                with self._lock:
+                    # 旧文件在换掉之前不会被关闭（只有这里换），拿到引用后就可以放开锁
+                    old = self._snap
+                    unloaded = {month_key for month_key in month_keys if month_key not in self._loaded}
+                    # 记录发布后不再原地修改，浅拷贝就是一致的快照
+                    current = {
+                        month_key: {uid: months[month_key] for uid, months in snapshot_attendance(month_key).items()}
+                        for month_key in month_keys
+                    }
+                    overrides_snapshot = snapshot_overrides()
+
+                blobs = {}
+                if old is not None:
+                    for month_key in old.month_keys():
+                        if month_key in month_keys:
+                            continue
+                        if old.version == SNAPSHOT_VERSION:
+                            blobs[month_key] = old.raw_month(month_key)
+                        else:
+                            blobs[month_key] = encode_month_blob(old.decode_month(month_key))
+                for month_key, users in current.items():
+                    if month_key in unloaded and old is not None and month_key in old.index:
+                        # 没加载进内存的月份：以快照里的为底，叠上内存里零散的修改
+                        merged = old.decode_month(month_key)
+                        for uid, days in users.items():
+                            merged.setdefault(uid, {}).update(days)
+                        users = merged
+                    if users or (old is not None and month_key in old.index):
+                        blobs[month_key] = encode_month_blob(users)
+                write_binary_snapshot(self.path, blobs, overrides_snapshot)
+                new = BinarySnapshot(self.path)
+
+                with self._lock:
+                    old, self._snap = self._snap, new
+                    if old is not None:
+                        old.close()
+            return True
+        except Exception as e:
+            print("❌ Failed to save binary snapshot:", e)
+            return False
+
+    def close(self):
+        with self._write_lock, self._lock:
+            if self._snap is not None:
+                self._snap.close()
+                self._snap = None
+
+def ensure_month_loaded(month_key):
+    """读写某个月份前调用；分区存储下会按需加载冷月份"""
+    get_storage().ensure_month(month_key)
+
+def make_storage(backend=None):
+    backend = (backend or STORAGE_BACKEND).lower()
+    if backend == "sqlite":
+        return SqliteStorage(SQLITE_FILE)
+    if backend == "monthly":
+        return MonthlyJsonStorage(MONTHS_DIR)
+    if backend == "binary":
+        return BinarySnapshotStorage(BINARY_SNAPSHOT_FILE)
+    if backend != "json":
+        print(f"⚠️ Unknown STORAGE_BACKEND {backend!r}, using json")
+    return JsonStorage()
+
+STORAGE = None
+
+def get_storage():
+    global STORAGE
+    if STORAGE is None:
+        STORAGE = make_storage()
+    return STORAGE
+
+def load_attendance():
+    get_storage().load_attendance()
+    rebuild_month_stats()
+
+def save_attendance(pretty=None):
+    started = time_mod.perf_counter()
+    try:
+        return get_storage().save_attendance(pretty)
+    finally:
+        SAVE_SECONDS.observe(time_mod.perf_counter() - started, "snapshot")
+
+def load_registered_users():
+    global REGISTERED_USERS
+    REGISTERED_USERS = get_storage().load_registered_users()
+
+def save_registered_users():
+    get_storage().save_registered_users(registered_users_snapshot())
+
+def migrate_json_to_sqlite():
+    """一次性把 /data 下的 JSON 快照 + journal + 注册用户导入 SQLite"""
+    ATTENDANCE.clear()
+    _json_load_attendance()
+    users = _json_load_registered_users()
+    target = SqliteStorage(SQLITE_FILE)
+    if not target.save_attendance():
+        return False
+    target.save_registered_users(users)
+    target.close()
+    days = sum(len(d) for months in ATTENDANCE.values() for d in months.values())
+    print(f"✅ Migrated {len(ATTENDANCE)} users / {days} days / {len(users)} registered users to {SQLITE_FILE}")
+    return True
+
+# ===== 后台持久化线程 =====
+# handler 只标记 dirty，由后台线程合并后每 PERSIST_INTERVAL 秒最多落盘一次；
+# 退出 / SIGTERM 时一定会再 flush 一次。
+PERSIST_INTERVAL = float(os.getenv("PERSIST_INTERVAL", "2"))
+
+_dirty_lock = threading.Lock()
+_dirty_days = set()        # (uid, month_key, date_key)
+_dirty_overrides = set()   # (uid, month_key)
+_dirty_marks = 0
+_dirty_event = threading.Event()
+_persist_stop = threading.Event()
+_persist_thread = None
+_flush_lock = threading.Lock()
+_last_flush = 0.0
+
+PERSIST_STATS = {
+    "marks": 0,           # handler 标记次数
+    "flushes": 0,         # 实际落盘次数
+    "coalesced": 0,       # 被合并掉的写入次数
+    "last_flush_ms": 0.0,
+    "max_flush_ms": 0.0,
+    "total_flush_ms": 0.0,
+    "dropped": 0,         # 编码失败被丢弃的条目
+}
+
+def mark_dirty(uid, month_key, date_key):
+    """某人某天的考勤被修改后调用"""
+    global _dirty_marks
+    with _dirty_lock:
+        _dirty_days.add((uid, month_key, date_key))
+        _dirty_marks += 1
+    _after_mark()
+
+def pending_months():
+    """还在 dirty 集合里、没交给存储层的月份（LRU 不能踢出）"""
+    with _dirty_lock:
+        return {month_key for _, month_key, _ in _dirty_days}
+
+def mark_override_dirty(uid, month_key):
+    """管理员修改月度天数后调用"""
+    global _dirty_marks
+    with _dirty_lock:
+        _dirty_overrides.add((uid, month_key))
+        _dirty_marks += 1
+    _after_mark()
+
+def _after_mark():
+    if _persist_thread is None:
+        # 没有后台线程（脚本 / 测试）时同步落盘
+        flush_dirty()
+    else:
+        _dirty_event.set()
+
+def flush_dirty():
+    """把所有 dirty 记录一次性写出，返回本次处理的标记数"""
+    global _dirty_days, _dirty_overrides, _dirty_marks, _last_flush
+    with _flush_lock:
+        with _dirty_lock:
+            days, _dirty_days = _dirty_days, set()
+            overrides, _dirty_overrides = _dirty_overrides, set()
+            marks, _dirty_marks = _dirty_marks, 0
+        save_user_names()
+        save_runtime_state()
+        if not marks:
+            return 0
+
+        started = time_mod.perf_counter()
+        try:
+            ok = get_storage().write_changes(days, overrides) is not False
+        except Exception:
+            _restore_dirty(days, overrides, marks)
+            raise
+        if not ok:
+            # 失败原因存储层已经打印过
+            _restore_dirty(days, overrides, marks)
+            return 0
+        elapsed_ms = (time_mod.perf_counter() - started) * 1000
+        _last_flush = time_mod.monotonic()
+        SAVE_SECONDS.observe(elapsed_ms / 1000, "flush")
+
+        PERSIST_STATS["marks"] += marks
+        PERSIST_STATS["flushes"] += 1
+        PERSIST_STATS["coalesced"] += marks - 1
+        PERSIST_STATS["last_flush_ms"] = elapsed_ms
+        PERSIST_STATS["max_flush_ms"] = max(PERSIST_STATS["max_flush_ms"], elapsed_ms)
+        PERSIST_STATS["total_flush_ms"] += elapsed_ms
+        return marks
+
+def _restore_dirty(days, overrides, marks):
+    """写入失败：把这一批放回 dirty 集合，隔一个 PERSIST_INTERVAL 再试"""
+    global _dirty_days, _dirty_overrides, _dirty_marks, _last_flush
+    with _dirty_lock:
+        _dirty_days |= days
+        _dirty_overrides |= overrides
+        _dirty_marks += marks
+    _last_flush = time_mod.monotonic()
+    _dirty_event.set()
+
+def _persistence_worker():
+    while True:
+        _dirty_event.wait()
+        # 攒够一个间隔内的所有修改再写
+        wait = PERSIST_INTERVAL - (time_mod.monotonic() - _last_flush)
+        if wait > 0:
+            _persist_stop.wait(wait)
+        _dirty_event.clear()
+        try:
+            flush_dirty()
+        except Exception as e:
+            print("❌ Persistence flush failed:", e)
+        if _persist_stop.is_set():
+            return
+
+def start_persistence_worker():
+    global _persist_thread
+    if _persist_thread is not None:
+        return
+    _persist_stop.clear()
+    _persist_thread = threading.Thread(target=_persistence_worker, daemon=True)
+    _persist_thread.start()
+
+def stop_persistence_worker():
+    """停止后台线程并把剩余 dirty 记录写完"""
+    global _persist_thread
+    if _persist_thread is not None:
+        _persist_stop.set()
+        _dirty_event.set()
+        _persist_thread.join(timeout=10)
+        _persist_thread = None
+    flush_dirty()
+    if STORAGE is not None:
+        STORAGE.close()
+
+def persist_stats_text():
+    st = PERSIST_STATS
+    avg = st["total_flush_ms"] / st["flushes"] if st["flushes"] else 0.0
+    with _dirty_lock:
+        pending = _dirty_marks
+    return (
+        "💾 Persistence\n"
+        f"  marks: {st['marks']}  flushes: {st['flushes']}  coalesced: {st['coalesced']}\n"
+        f"  pending: {pending}  interval: {PERSIST_INTERVAL}s  dropped: {st['dropped']}\n"
+        f"  flush ms: last {st['last_flush_ms']:.1f} / avg {avg:.1f} / max {st['max_flush_ms']:.1f}"
+    )
+
+# ===== Timezone =====
+LOCAL_TZ = ZoneInfo("Asia/Yangon")  # 缅甸
+
+def now():
+    return datetime.now(LOCAL_TZ)
+
+# ===== Load env =====
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+GROUP_CHAT_ID = int(os.getenv("GROUP_CHAT_ID")) if os.getenv("GROUP_CHAT_ID") else None
+admin_ids_str = os.getenv("ADMIN_IDS", "6062973135,8530505686")
+ADMIN_IDS = set(int(x.strip()) for x in admin_ids_str.split(",") if x.strip())
+LATE_BOT_TOKEN = os.getenv("LATE_BOT_TOKEN")
+LATE_GROUP_ID = int(os.getenv("LATE_GROUP_ID")) if os.getenv("LATE_GROUP_ID") else None
+
+late_bot = None
+if LATE_BOT_TOKEN and LATE_GROUP_ID:
+    late_bot = telebot.TeleBot(LATE_BOT_TOKEN)
+
+if not BOT_TOKEN:
+    raise Exception("❌ BOT_TOKEN is not set")
+
+# 处理 update 的分片线程数；同一个人固定在一个分片上，不同的人并行
+UPDATE_WORKERS = max(1, int(os.getenv("UPDATE_WORKERS", "4")))
+
+bot = telebot.TeleBot(BOT_TOKEN)
+
+# ===== Config =====
+# chat_member 默认不推送，需要显式订阅
+ALLOWED_UPDATES = ["message", "chat_member", "callback_query"]
+
+# sync: TeleBot + 线程（默认）；async: AsyncTeleBot + aiohttp 事件循环
+BOT_RUNTIME = os.getenv("BOT_RUNTIME", "sync").strip().lower()
+
+# 设置 WEBHOOK_URL 后改用 webhook 接收 update（不再长轮询）
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()
+# Telegram 回传的 X-Telegram-Bot-Api-Secret-Token；未设置时每次启动随机生成
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip() or (secrets.token_urlsafe(32) if WEBHOOK_URL else "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or os.getenv("PORT") or "8080")
+
+# 改用本地 Bot API 服务器（或压测用的假服务器），格式同 telebot: http://127.0.0.1:8081/bot{0}/{1}
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").strip()
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL
+# 把收到的原始 update 追加到这个 JSONL 文件，供 benchmarks/replay.py 回放；默认不录制
+RECORD_UPDATES_FILE = os.getenv("RECORD_UPDATES_FILE", "").strip()
+# 设置后在这个端口提供 GET /metrics（Prometheus）；和 webhook 端口相同时由 webhook 服务器顺带提供
+METRICS_PORT = int(os.getenv("METRICS_PORT") or "0")
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "0.0.0.0")
+
+ACTIVITY_TIMES = {
+    "Eating": 30,
+    "ToiletLarge": 15,
+    "ToiletSmall": 10,
+    "Smoking": 10,
+    "Other": 15,
+}
+
+MAX_TIMES = {
+    "Eating": 3,
+    "ToiletLarge": 1,
+    "ToiletSmall": 4,
+    "Smoking": 4,
+    "Other": 2,
+}
+
+ACTIVITY_LABELS = {
+    "Eating": "Eat",
+    "ToiletLarge": "Toilet",
+    "ToiletSmall": "Pee",
+    "Smoking": "Smoking",
+    "Other": "Other",
+}
+
+def ordinal(n):
+    if 10 <= n % 100 <= 20:
+        return f"{n}th"
+    return f"{n}{ {1:'st', 2:'nd', 3:'rd'}.get(n % 10, 'th') }"
+
+# ===== 用户配置 =====
+HR_USERS = {6917597442,6972481220,5439661091,8784682846}
+FINDING_USERS = {6438074082,8260711537,6343462420}
+CUSTOM_NIGHT_USERS = {6863315227,2018656742,6635424294,8057771099}
+
+# ===== Memory =====
+user_activity = {}
+user_sessions = {}
+CHECK_IN_STATUS = {}
+user_logs = {}
+activity_timeout = {}
+
+# ===== Keyboard =====
+def main_keyboard(uid=None):
+    kb = ReplyKeyboardMarkup(resize_keyboard=True)
+    kb.row("🏢 Check In", "🏠 Check Out")
+    kb.row("🍽 Eat", "🚬 Smoking")
+    kb.row("💧 Pee", "🚽 Toilet")
+    kb.row("📝 Other", "↩ Return")
+    if uid is not None and uid in ADMIN_IDS:
+        kb.row("/set_month_shifts", "/batch_set_month_shifts")
+    return kb
+
+# ===== Stats =====
+def stats_text(uid):
+    user_sessions.setdefault(uid, {"Eating": 0, "ToiletLarge": 0, "ToiletSmall": 0, "Smoking": 0, "Other": 0})
+    s = user_sessions[uid]
+    return (
+        f"👤 User ID: {uid}\n\n"
+        f"🍽 Eat: {s['Eating']} / {MAX_TIMES['Eating']} TIME\n"
+        f"💧 Pee: {s['ToiletSmall']} / {MAX_TIMES['ToiletSmall']} TIME\n"
+        f"🚽 Toilet: {s['ToiletLarge']} / {MAX_TIMES['ToiletLarge']} TIME\n"
+        f"🚬 Smoking: {s['Smoking']} / {MAX_TIMES['Smoking']} TIME\n"
+        f"📝 Other: {s['Other']} / {MAX_TIMES['Other']} TIME"
+    )
+
+def get_attendance_summary(uid):
+    # 只看当月计数器，实现每月1号自动清零
+    current_month = now().strftime("%Y-%m")
+    ensure_month_loaded(current_month)
+    stats = get_month_stats(uid, current_month)
+    return stats.shifts, stats.days
+
+def get_shift_standard(dt, uid):
+    t = dt.time()
+    if uid in HR_USERS:
+        return {"role": "HR", "shift": "DAY", "start": time(9, 0), "end": time(19, 0)}
+    if uid in FINDING_USERS:
+        if time(7, 0) <= t <= time(12, 0):
+            return {"role": "FINDING", "shift": "MORNING", "start": time(7, 0), "end": time(12, 0)}
+        if t >= time(19, 0) or t < time(2, 0):
+            return {"role": "FINDING", "shift": "NIGHT", "start": time(19, 0), "end": time(2, 0), "cross_day": True}
+        return {"role": "FINDING", "shift": "MORNING", "start": time(7, 0), "end": time(12, 0)}
+    return {"role": "PROMO", "shift": "NIGHT", "start": time(20, 30), "end": time(9, 30), "cross_day": True}
+
+def get_attribution_date(checkin_logical_date, checkout_dt, uid, shift_info):
+    """根据 checkout 时间决定这个班次最终归属哪一天（缅甸时间）"""
+    checkout_date = checkout_dt.date()
+    checkout_time = checkout_dt.time()
+
+    # 同一天 checkout → 直接归 checkin 那天
+    if checkout_date == checkin_logical_date:
+        return checkin_logical_date
+
+    # 跨天了 → 按截止时间判定
+    if uid in HR_USERS:
+        # HR: checkout 超过凌晨 0:00 → 归 checkout 当天
+        return checkout_date
+
+    elif uid in FINDING_USERS:
+        if shift_info.get("shift") == "NIGHT":
+            # 晚班: checkout 在凌晨 2:00 内 → 归 checkin 那天（前一天）
+            if checkout_time < time(2, 0):
+                return checkin_logical_date
+            return checkout_date
+        else:
+            # 早班: checkout 在下午 5:00 内 → 归 checkin 那天
+            if checkout_time < time(17, 0):
+                return checkin_logical_date
+            return checkout_date
+
+    else:
+        # CHATTING/PROMO: checkout 在中午 12:00 前 → 归 checkin 那天（前一天）
+        if checkout_time < time(12, 0):
+            return checkin_logical_date
+        return checkout_date
+
+# ===== 唤醒信号 =====
+class Wakeup:
+    """线程和 asyncio 任务都能等待的唤醒信号（替代 threading.Event）"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._aevent = None
+        self._loop = None
+
+    def set(self):
+        self._event.set()
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._aevent.set)
+
+    def clear(self):
+        self._event.clear()
+        if self._aevent is not None:
+            self._aevent.clear()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    async def wait_async(self, timeout=None):
+        if self._loop is None:
+            self._aevent = asyncio.Event()
+            if self._event.is_set():
+                self._aevent.set()
+            self._loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(self._aevent.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+# ===== 发送队列 =====
+# handler 只把消息放进队列立即返回；后台线程按优先级发送，
+# 每个 chat 和整个 bot 各有令牌桶限速，429 时按 retry_after 退避重试。
+PRIORITY_ALERT = 0      # 迟到 / 早退 / 超时 / 未打卡
+PRIORITY_NORMAL = 1     # 上下班播报、私聊回复
+PRIORITY_ROUTINE = 2    # 活动开始 / 回座播报
+PRIORITY_NAMES = ("alert", "normal", "routine")
+
+OUTBOUND_GLOBAL_PER_SEC = float(os.getenv("OUTBOUND_GLOBAL_PER_SEC", "25"))
+OUTBOUND_GROUP_PER_MIN = float(os.getenv("OUTBOUND_GROUP_PER_MIN", "20"))
+OUTBOUND_PRIVATE_PER_SEC = float(os.getenv("OUTBOUND_PRIVATE_PER_SEC", "1"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time_mod.monotonic()
+        self.blocked_until = 0.0   # 429 retry_after
+
+    def wait_time(self, now_mono):
+        """还要等多久才有一个令牌（0 表示现在就可以发）"""
+        if now_mono < self.blocked_until:
+            return self.blocked_until - now_mono
+        self.tokens = min(self.capacity, self.tokens + (now_mono - self.updated) * self.rate)
+        self.updated = now_mono
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class OutboundMessage:
+    __slots__ = ("client", "chat_id", "text", "kwargs", "priority", "enqueued", "attempts", "label")
+
+    def __init__(self, client, chat_id, text, kwargs, priority, label):
+        self.client = client
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.enqueued = time_mod.monotonic()
+        self.attempts = 0
+        self.label = label
+
+class OutboundDispatcher:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._lanes = [deque() for _ in PRIORITY_NAMES]
+        self._chat_buckets = {}
+        self._global_buckets = {}
+        self._thread = None
+        self._stopping = False
+        self._inflight = 0
+        self._async_loop = None      # asyncio 模式下的事件循环和唤醒事件
+        self._async_wakeup = None
+        self.stats = {
+            "enqueued": 0, "sent": 0, "failed": 0, "retried": 0, "rate_limited": 0,
+            "max_queue_wait_ms": 0.0, "total_queue_wait_ms": 0.0,
+        }
+
+    # ----- 入队 -----
+    def enqueue(self, client, chat_id, text, priority=PRIORITY_NORMAL, label="message", **kwargs):
+        msg = OutboundMessage(client, chat_id, text, kwargs, priority, label)
+        if not self._running():
+            # 没有后台线程（脚本 / 测试）时直接发送
+            self._deliver(msg)
+            return
+        with self._cond:
+            self._lanes[priority].append(msg)
+            self.stats["enqueued"] += 1
+            self._cond.notify()
+        loop = self._async_loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._async_wakeup.set)
+
+    def _running(self):
+        return self._thread is not None or self._async_loop is not None
+
+    def depth(self):
+        with self._cond:
+            return [len(lane) for lane in self._lanes]
+
+    # ----- 限速 -----
+    def _buckets_for(self, msg):
+        key = (id(msg.client), msg.chat_id)
+        bucket = self._chat_buckets.get(key)
+        if bucket is None:
+            if isinstance(msg.chat_id, int) and msg.chat_id < 0:
+                bucket = TokenBucket(OUTBOUND_GROUP_PER_MIN / 60.0, 3)
+            else:
+                bucket = TokenBucket(OUTBOUND_PRIVATE_PER_SEC, 3)
+            self._chat_buckets[key] = bucket
+        glob = self._global_buckets.get(id(msg.client))
+        if glob is None:
+            glob = self._global_buckets[id(msg.client)] = TokenBucket(OUTBOUND_GLOBAL_PER_SEC, OUTBOUND_GLOBAL_PER_SEC)
+        return bucket, glob
+
+    def next_message(self):
+        """按优先级找第一条可以发送的消息；返回 (msg, None) 或 (None, 需要等待的秒数)"""
+        now_mono = time_mod.monotonic()
+        min_wait = None
+        for lane in self._lanes:
+            blocked_chats = set()
+            for i, msg in enumerate(lane):
+                key = (id(msg.client), msg.chat_id)
+                if key in blocked_chats:
+                    continue
+                bucket, glob = self._buckets_for(msg)
+                wait = max(bucket.wait_time(now_mono), glob.wait_time(now_mono))
+                if wait <= 0:
+                    bucket.take()
+                    glob.take()
+                    del lane[i]
+                    self._inflight += 1
+                    return msg, None
+                # 同一个 chat 的后续消息保持顺序，一起跳过
+                blocked_chats.add(key)
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+        return None, min_wait
+
+    # ----- 发送 -----
+    def _deliver(self, msg):
+        """发送一次，返回需要重试前等待的秒数；None 表示结束（成功或放弃）"""
+        msg.attempts += 1
+        try:
+            msg.client.send_message(msg.chat_id, msg.text, **msg.kwargs)
+        except Exception as e:
+            return self._send_failed(msg, e)
+        self._record_sent(msg)
+        return None
+
+    async def _deliver_async(self, msg, aclient):
+        msg.attempts += 1
+        try:
+            await aclient.send_message(msg.chat_id, msg.text, **msg.kwargs)
+        except Exception as e:
+            return self._send_failed(msg, e)
+        self._record_sent(msg)
+        return None
+
+    def _record_sent(self, msg):
+        waited = (time_mod.monotonic() - msg.enqueued) * 1000
+        self.stats["sent"] += 1
+        self.stats["total_queue_wait_ms"] += waited
+        self.stats["max_queue_wait_ms"] = max(self.stats["max_queue_wait_ms"], waited)
+
+    def _send_failed(self, msg, e):
+        # 同步和 asyncio 两个 ApiTelegramException 类都带 error_code / result_json
+        code = getattr(e, "error_code", None)
+        if not isinstance(code, int):
+            # 网络错误等，稍后重试
+            return self._retry_or_drop(msg, 1.0, e)
+        if code == 429 or code >= 500:
+            retry_after = 1.0
+            if code == 429:
+                self.stats["rate_limited"] += 1
+                retry_after = float((e.result_json or {}).get("parameters", {}).get("retry_after", 1))
+            return self._retry_or_drop(msg, retry_after, e)
+        self._drop(msg, e)
+        return None
+
+    def _retry_or_drop(self, msg, retry_after, error):
+        if msg.attempts > OUTBOUND_MAX_RETRIES or not self._running():
+            self._drop(msg, error)
+            return None
+        self.stats["retried"] += 1
+        return retry_after
+
+    def _drop(self, msg, error):
+        self.stats["failed"] += 1
+        print(f"❌ {msg.label} failed ({msg.chat_id}):", error)
+
+    def _requeue(self, msg, retry_after):
+        with self._cond:
+            bucket, _ = self._buckets_for(msg)
+            bucket.blocked_until = max(bucket.blocked_until, time_mod.monotonic() + retry_after)
+            # 放回队首，保持同一 chat 的顺序
+            self._lanes[msg.priority].appendleft(msg)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    msg, wait = self.next_message()
+                    if msg is not None:
+                        break
+                    if self._stopping:
+                        return
+                    self._cond.wait(wait)
+            retry_after = self._deliver(msg)
+            with self._cond:
+                self._inflight -= 1
+                self._cond.notify_all()
+            if retry_after is not None:
+                self._requeue(msg, retry_after)
+
+    async def run_async(self, clients):
+        """asyncio 模式的发送循环；clients: id(同步 TeleBot) -> 对应的 AsyncTeleBot"""
+        self._stopping = False
+        self._async_wakeup = asyncio.Event()
+        self._async_loop = asyncio.get_running_loop()
+        try:
+            while True:
+                # 先 clear 再取消息，避免丢掉期间入队的唤醒
+                self._async_wakeup.clear()
+                with self._cond:
+                    msg, wait = self.next_message()
+                if msg is None:
+                    if self._stopping:
+                        return
+                    try:
+                        await asyncio.wait_for(self._async_wakeup.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                retry_after = await self._deliver_async(msg, clients[id(msg.client)])
+                with self._cond:
+                    self._inflight -= 1
+                    self._cond.notify_all()
+                if retry_after is not None:
+                    self._requeue(msg, retry_after)
+        finally:
+            self._async_loop = None
+            self._async_wakeup = None
+
+    async def stop_async(self, timeout=5.0):
+        """run_async 版的 stop：尽量发完剩余消息再让循环退出"""
+        if self._async_loop is None:
+            return
+        deadline = time_mod.monotonic() + timeout
+        while time_mod.monotonic() < deadline:
+            with self._cond:
+                if not any(self._lanes) and not self._inflight:
+                    break
+            await asyncio.sleep(0.1)
+        self._stopping = True
+        self._async_wakeup.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """尽量发完剩余消息再退出"""
+        if self._thread is None:
+            return
+        deadline = time_mod.monotonic() + timeout
+        with self._cond:
+            while (any(self._lanes) or self._inflight) and time_mod.monotonic() < deadline:
+                self._cond.wait(0.1)
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def stats_text(self):
+        st = self.stats
+        depth = self.depth()
+        avg = st["total_queue_wait_ms"] / st["sent"] if st["sent"] else 0.0
+        lanes = "  ".join(f"{name}: {n}" for name, n in zip(PRIORITY_NAMES, depth))
+        return (
+            "📤 Outbound queue\n"
+            f"  depth: {lanes}\n"
+            f"  sent: {st['sent']}  failed: {st['failed']}  retried: {st['retried']}  429: {st['rate_limited']}\n"
+            f"  queue wait ms: avg {avg:.1f} / max {st['max_queue_wait_ms']:.1f}"
+        )
+
+OUTBOUND = OutboundDispatcher()
+
+# ===== Send functions =====
+def send_group(msg, parse_mode=None, priority=PRIORITY_NORMAL):
+    if not GROUP_CHAT_ID:
+        return
+    OUTBOUND.enqueue(bot, GROUP_CHAT_ID, msg, priority=priority, label="send_group", parse_mode=parse_mode)
+
+def send_late_notice(msg, parse_mode=None, priority=PRIORITY_ALERT):
+    if late_bot and LATE_GROUP_ID:
+        OUTBOUND.enqueue(late_bot, LATE_GROUP_ID, msg, priority=priority, label="send_late_notice", parse_mode=parse_mode)
+
+# ===== 未打卡提醒 =====
+# 每天（缅甸时间 0 点）预先算好所有人的截止时间放进最小堆 (deadline, uid, shift)，
+# 线程直接睡到下一个截止时间，把同一时刻到期的一批人一次处理完。
+MISSED_CHECK_SENT = set()
+# 启动 / 重建时，已经过了多久的截止时间仍然补发
+MISSED_CHECK_GRACE = int(os.getenv("MISSED_CHECK_GRACE", "600"))
+# 同一截止时间的所有未打卡人员合并成一条消息（每个群一条，超长自动拆分）
+MISSED_CHECK_DIGEST = os.getenv("MISSED_CHECK_DIGEST", "1") != "0"
+
+# shift_key -> (截止时间, 通知里的班次名)
+MISSED_CHECK_DEADLINES = {
+    "HR_DAY": (time(9, 4), "HR"),
+    "FINDING_M": (time(7, 4), "FINDING 早班"),
+    "FINDING_N": (time(19, 4), "FINDING 晚班"),
+    "PROMO_NIGHT_NEW": (time(20, 34), "推广/夜班(20:30)"),
+}
+
+_deadline_lock = threading.Lock()
+_deadline_heap = []        # (deadline_ts, uid, shift_key)
+_deadline_day = None
+_deadline_wakeup = Wakeup()
+
+MISSED_CHECK_STATS = {"cohorts": 0, "checked": 0, "notices": 0, "last_tick_ms": 0.0}
+
+def _shift_keys_for(uid):
+    if uid in HR_USERS:
+        return ("HR_DAY",)
+    if uid in FINDING_USERS:
+        return ("FINDING_M", "FINDING_N")
+    return ("PROMO_NIGHT_NEW",)
+
+def _missed_checkin(shift_key, rec):
+    if shift_key == "HR_DAY":
+        return not rec.has_hr_checkin()
+    if shift_key == "FINDING_M":
+        return not rec.has_morning_checkin()
+    if shift_key == "FINDING_N":
+        return not rec.has_night_checkin()
+    return not rec.has_hr_checkin() and not rec.has_night_checkin()
+
+def _push_user_deadlines(uid, day, now_ts):
+    if uid in ADMIN_IDS:
+        return
+    for shift_key in _shift_keys_for(uid):
+        deadline = datetime.combine(day, MISSED_CHECK_DEADLINES[shift_key][0], tzinfo=LOCAL_TZ).timestamp()
+        if deadline + MISSED_CHECK_GRACE >= now_ts:
+            heapq.heappush(_deadline_heap, (deadline, uid, shift_key))
+
+def _build_deadline_heap(day, now_ts):
+    global _deadline_day
+    _deadline_heap.clear()
+    for uid in list(REGISTERED_USERS):
+        _push_user_deadlines(uid, day, now_ts)
+    _deadline_day = day
+    print(f"⏰ Missed-checkin deadlines for {day}: {len(_deadline_heap)}")
+
+def schedule_user_deadlines(uid):
+    """新注册的用户加入今天剩下的截止时间"""
+    with _deadline_lock:
+        if _deadline_day is None:
+            return
+        _push_user_deadlines(uid, _deadline_day, time_mod.time())
+    _deadline_wakeup.set()
+
+# ===== 群成员缓存 =====
+# 优先用 chat_member / 入群退群消息实时更新；过期条目在截止时间到达时才懒加载刷新。
+# 注意：机器人需要是群管理员才能收到 chat_member 更新。
+MEMBERSHIP_TTL = int(os.getenv("MEMBERSHIP_TTL", str(6 * 3600)))
+
+_member_lock = threading.Lock()
+_member_cache = {}   # uid -> (is_member, monotonic 时间)
+MEMBERSHIP_STATS = {"hits": 0, "misses": 0, "api_calls": 0, "api_errors": 0, "updates": 0}
+
+def _member_status_ok(status):
+    return status not in ("left", "kicked")
+
+def set_group_membership(uid, is_member):
+    with _member_lock:
+        _member_cache[uid] = (is_member, time_mod.monotonic())
+        MEMBERSHIP_STATS["updates"] += 1
+
+def _is_group_member(uid):
+    with _member_lock:
+        cached = _member_cache.get(uid)
+        if cached is not None and time_mod.monotonic() - cached[1] < MEMBERSHIP_TTL:
+            MEMBERSHIP_STATS["hits"] += 1
+            return cached[0]
+        MEMBERSHIP_STATS["misses"] += 1
+    try:
+        MEMBERSHIP_STATS["api_calls"] += 1
+        member = bot.get_chat_member(GROUP_CHAT_ID, uid)
+    except Exception:
+        # 查询失败不缓存，按原逻辑跳过
+        MEMBERSHIP_STATS["api_errors"] += 1
+        return False
+    is_member = _member_status_ok(member.status)
+    with _member_lock:
+        _member_cache[uid] = (is_member, time_mod.monotonic())
+    return is_member
+
+def membership_stats_text():
+    st = MEMBERSHIP_STATS
+    with _member_lock:
+        size = len(_member_cache)
+    return (
+        "👥 Membership cache\n"
+        f"  entries: {size}  ttl: {MEMBERSHIP_TTL}s\n"
+        f"  hits: {st['hits']}  misses: {st['misses']}  updates: {st['updates']}\n"
+        f"  api calls: {st['api_calls']}  errors: {st['api_errors']}  saved: {st['hits']}"
+    )
+
+def _process_deadline_cohort(day, shift_key, uids):
+    """同一截止时间到期的一批人"""
+    date_key = day.strftime("%Y-%m-%d")
+    month_key = day.strftime("%Y-%m")
+    ensure_month_loaded(month_key)
+    role_name = MISSED_CHECK_DEADLINES[shift_key][1]
+    missing = []
+    for uid in uids:
+        key = (uid, shift_key, day)
+        if key in MISSED_CHECK_SENT:
+            continue
+        rec = ATTENDANCE.get(uid, {}).get(month_key, {}).get(date_key) or EMPTY_DAY
+        if not _missed_checkin(shift_key, rec):
+            continue
+        # 管理员 / 已退群的人不提醒
+        if not _is_group_member(uid):
+            continue
+        if not MISSED_CHECK_DIGEST:
+            send_late_notice_by_id(uid, role_name)
+        missing.append(uid)
+        MISSED_CHECK_SENT.add(key)
+        MISSED_CHECK_STATS["notices"] += 1
+    if missing:
+        mark_runtime_dirty()
+    if MISSED_CHECK_DIGEST and missing:
+        send_missed_checkin_digest(missing, role_name)
+    MISSED_CHECK_STATS["cohorts"] += 1
+    MISSED_CHECK_STATS["checked"] += len(uids)
+
+def missed_checkin_tick(now_dt=None):
+    """处理所有已到期的截止时间，返回距离下一个事件的秒数"""
+    now_dt = now_dt or now()
+    now_ts = now_dt.timestamp()
+    today = now_dt.date()
+    started = time_mod.perf_counter()
+
+    with _deadline_lock:
+        if _deadline_day != today:
+            # 缅甸时间跨天：重建当天的堆
+            _build_deadline_heap(today, now_ts)
+        cohorts = defaultdict(list)
+        while _deadline_heap and _deadline_heap[0][0] <= now_ts:
+            deadline, uid, shift_key = heapq.heappop(_deadline_heap)
+            cohorts[(deadline, shift_key)].append(uid)
+        next_ts = _deadline_heap[0][0] if _deadline_heap else None
+
+    for (deadline, shift_key), uids in sorted(cohorts.items()):
+        _process_deadline_cohort(today, shift_key, uids)
+
+    elapsed = time_mod.perf_counter() - started
+    MISSED_TICK_SECONDS.observe(elapsed)
+    if cohorts:
+        MISSED_CHECK_STATS["last_tick_ms"] = elapsed * 1000
+
+    midnight = datetime.combine(today + timedelta(days=1), time(0, 0), tzinfo=LOCAL_TZ).timestamp()
+    wake_ts = min(next_ts, midnight) if next_ts is not None else midnight
+    return max(0.0, wake_ts - now_ts)
+
+def check_missing_checkins():
+    while True:
+        try:
+            wait = missed_checkin_tick()
+        except Exception as e:
+            print("❌ missing checkin loop error:", e)
+            wait = 30
+        # 最多睡一小时，防止系统时间跳变
+        _deadline_wakeup.wait(min(wait, 3600))
+        _deadline_wakeup.clear()
+
+def missed_check_stats_text():
+    st = MISSED_CHECK_STATS
+    with _deadline_lock:
+        pending = len(_deadline_heap)
+        next_ts = _deadline_heap[0][0] if _deadline_heap else None
+    next_str = from_epoch(next_ts).strftime("%H:%M:%S") if next_ts else "-"
+    return (
+        "⏰ Missed-checkin scheduler\n"
+        f"  pending: {pending}  next: {next_str}\n"
+        f"  cohorts: {st['cohorts']}  checked: {st['checked']}  notices: {st['notices']}\n"
+        f"  last cohort ms: {st['last_tick_ms']:.1f}"
+    )
+
+def send_late_notice_by_id(uid, role_name):
+    try:
+        name = _display_name(uid)
+        # 🟢【未打卡】两群同步发送 HTML @通知
+        notice = f"👤 <a href=\"tg://user?id={uid}\">{name}</a>💸+{uid} {role_name} 未打卡 ⚠️"
+        send_late_notice(notice, parse_mode="HTML")
+        send_group(notice, parse_mode="HTML", priority=PRIORITY_ALERT)
+    except Exception as e:
+        print(f"Notice error for {uid}: {e}")
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+def chunk_lines(header, lines, limit=TELEGRAM_MESSAGE_LIMIT):
+    """按行拼接，每条消息不超过 limit 个字符，每条都带 header"""
+    chunks = []
+    current = header
+    for line in lines:
+        if len(current) + 1 + len(line) > limit and current != header:
+            chunks.append(current)
+            current = header
+        current += "\n" + line
+    if current != header:
+        chunks.append(current)
+    return chunks
+
+def send_missed_checkin_digest(uids, role_name):
+    """一个截止时间一条汇总：@ 所有未打卡的人，两群各发一次"""
+    header = f"⚠️ {role_name} 未打卡 ({len(uids)})"
+    lines = [
+        f"👤 <a href=\"tg://user?id={uid}\">{html.escape(_display_name(uid))}</a>💸+{uid}"
+        for uid in uids
+    ]
+    for chunk in chunk_lines(header, lines):
+        send_late_notice(chunk, parse_mode="HTML")
+        send_group(chunk, parse_mode="HTML", priority=PRIORITY_ALERT)
+
+# ===== 显示名缓存 =====
+# uid → first_name，从收到的消息里被动更新，和 registered_users.json 放在一起；
+# 提醒时直接用缓存，只有缺失 / 过期的才调用 get_chat。
+NAME_CACHE_TTL = int(os.getenv("NAME_CACHE_TTL", str(30 * 86400)))
+
+_names_lock = threading.Lock()
+USER_NAMES = {}     # uid -> {"name": str, "ts": epoch}
+_names_dirty = False
+NAME_CACHE_STATS = {"hits": 0, "misses": 0, "stale": 0, "api_calls": 0}
+
+def remember_name(uid, name):
+    """收到用户消息时调用；名字没变且未过期就不写盘"""
+    global _names_dirty
+    if not name:
+        return
+    now_ts = time_mod.time()
+    with _names_lock:
+        entry = USER_NAMES.get(uid)
+        if entry and entry["name"] == name and now_ts - entry["ts"] < NAME_CACHE_TTL / 2:
+            return
+        USER_NAMES[uid] = {"name": name, "ts": now_ts}
+        _names_dirty = True
+    _after_mark()
+
+def _fetch_name(uid):
+    NAME_CACHE_STATS["api_calls"] += 1
+    name = bot.get_chat(uid).first_name or "User"
+    remember_name(uid, name)
+    return name
+
+def _display_name(uid):
+    with _names_lock:
+        entry = USER_NAMES.get(uid)
+    if entry and time_mod.time() - entry["ts"] < NAME_CACHE_TTL:
+        NAME_CACHE_STATS["hits"] += 1
+        return entry["name"]
+    if entry:
+        NAME_CACHE_STATS["stale"] += 1
+    else:
+        NAME_CACHE_STATS["misses"] += 1
+    try:
+        return _fetch_name(uid)
+    except Exception as e:
+        print(f"Notice error for {uid}: {e}")
+        # 刷新失败时旧名字也比 "User" 好
+        return entry["name"] if entry else "User"
+
+def cached_name(uid, default=""):
+    """只读缓存，不调用 Bot API（批量导出用）"""
+    with _names_lock:
+        entry = USER_NAMES.get(uid)
+    return entry["name"] if entry else default
+
+def load_user_names():
+    if not os.path.exists(USER_NAMES_FILE):
+        return
+    try:
+        with open(USER_NAMES_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with _names_lock:
+            for uid_str, entry in data.items():
+                USER_NAMES[int(uid_str)] = entry
+        print(f"✅ User names loaded: {len(data)}")
+    except Exception as e:
+        print("❌ Failed to load user names:", e)
+
+def save_user_names():
+    global _names_dirty
+    with _names_lock:
+        if not _names_dirty:
+            return
+        data = {str(uid): entry for uid, entry in USER_NAMES.items()}
+        _names_dirty = False
+    try:
+        _atomic_write_json(USER_NAMES_FILE, data, pretty=False)
+    except Exception as e:
+        print("❌ Failed to save user names:", e)
+
+def warm_name_cache(uids, pause=0.05):
+    """批量刷新缺失 / 过期的名字（新机器部署后用），返回 (刷新数, 失败数)"""
+    refreshed = failed = 0
+    now_ts = time_mod.time()
+    for uid in uids:
+        with _names_lock:
+            entry = USER_NAMES.get(uid)
+        if entry and now_ts - entry["ts"] < NAME_CACHE_TTL:
+            continue
+        try:
+            _fetch_name(uid)
+            refreshed += 1
+        except Exception:
+            failed += 1
+        time_mod.sleep(pause)
+    save_user_names()
+    return refreshed, failed
+
+def name_cache_stats_text():
+    st = NAME_CACHE_STATS
+    with _names_lock:
+        size = len(USER_NAMES)
+    return (
+        "🏷 Name cache\n"
+        f"  entries: {size}  hits: {st['hits']}  misses: {st['misses']}  stale: {st['stale']}  api calls: {st['api_calls']}"
+    )
+
+# ===== Commands =====
+@bot.message_handler(commands=["start"])
+def start(message):
+    if message.from_user.is_bot:
+        return
+    uid = message.from_user.id
+    remember_name(uid, message.from_user.first_name)
+
+    register_user(uid)
+
+    if uid in CHECK_IN_STATUS:
+        status_line = f"🟢 已上班：{CHECK_IN_STATUS[uid]['time'].strftime('%H:%M:%S')}"
+    else:
+        status_line = "🔴 未上班"
+
+    panel_msg = (
+        f"✅ 已注册\n"
+        f"{status_line}\n\n"
+        f"{stats_text(uid)}"
+    )
+    bot.send_message(message.chat.id, panel_msg, reply_markup=main_keyboard(uid))
+
+@bot.message_handler(commands=["attendance"])
+def attendance_report(message):
+    bot.reply_to(message, "📊 考勤统计功能已关闭")
+
+# ===== 管理员命令：修改员工考勤 =====
+@bot.message_handler(commands=["modify_attendance"])
+def modify_attendance(message):
+    uid = message.from_user.id
+    if uid not in ADMIN_IDS:
+        bot.reply_to(message, "❌ 仅管理员可操作")
+        return
+    
+    args = message.text.split()
+    if len(args) < 5:
+        bot.reply_to(message, "用法: /modify_attendance <用户ID> <年月日> <checkin/checkout> <时间>\n例: /modify_attendance 6917597442 2024-06-02 checkin 09:00:00")
+        return
+    
+    try:
+        target_uid = int(args[1])
+        date_str = args[2]
+        action = args[3]
+        time_str = args[4]
+        
+        # 解析日期时间
+        dt_str = f"{date_str} {time_str}"
+        new_dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S").replace(tzinfo=LOCAL_TZ)
+        
+        # 确定月份和日期
+        month_key = new_dt.strftime("%Y-%m")
+        date_key = new_dt.strftime("%Y-%m-%d")
+        
+        # 修改记录（同时更新月度计数器并标记 dirty）
+        new_ts = to_epoch(new_dt)
+        with edit_day(target_uid, month_key, date_key) as day_rec:
+            # 根据用户类型确定要修改的字段
+            if target_uid in HR_USERS:
+                # HR: 修改或添加 checkin 记录
+                if action == "checkin":
+                    # 找到下一个可用 slot
+                    day_rec.hr_slot(day_rec.next_hr_slot()).checkin = new_ts
+                elif action == "checkout":
+                    # 找到对应的 checkin slot（最后一个已上班的 slot）
+                    slot = max(day_rec.next_hr_slot() - 1, 1)
+                    day_rec.hr_slot(slot).checkout = new_ts
+            elif target_uid in FINDING_USERS:
+                # FINDING: 根据时间判断早班/晚班
+                t = new_dt.time()
+                if time(7, 0) <= t <= time(12, 0):
+                    # 早班
+                    if action == "checkin":
+                        day_rec.morning_punch().checkin = new_ts
+                    elif action == "checkout":
+                        day_rec.morning_punch().checkout = new_ts
+                else:
+                    # 晚班
+                    if action == "checkin":
+                        day_rec.night_punch().checkin = new_ts
+                    elif action == "checkout":
+                        day_rec.night_punch().checkout = new_ts
+            else:
+                # CHATTING/PROMO: 夜班
+                if action == "checkin":
+                    day_rec.night_punch().checkin = new_ts
+                elif action == "checkout":
+                    day_rec.night_punch().checkout = new_ts
+        
+        bot.reply_to(message, f"✅ 已修改 {target_uid} 的考勤记录\n日期: {date_str}\n操作: {action}\n时间: {time_str}")
+        
+    except Exception as e:
+        bot.reply_to(message, f"❌ 修改失败: {str(e)}")
+
+# ===== 管理员命令：查看员工考勤 =====
+# /view_attendance <用户ID> [起始] [结束]：按 (uid, 日期) 范围查询，只渲染请求的区间，
+# 分页显示并带 ◀ / ▶ 按钮。渲染好的页面缓存到该用户下一次考勤修改为止。
+VIEW_PAGE_DAYS = int(os.getenv("VIEW_PAGE_DAYS", "10"))
+VIEW_CACHE_MAX = int(os.getenv("VIEW_CACHE_MAX", "64"))
+_view_cache = OrderedDict()   # (uid, start, end) -> (user_version, pages)
+_view_cache_lock = threading.Lock()
+
+def _range_bound(value, upper):
+    """YYYY-MM 或 YYYY-MM-DD → 日期字符串；YYYY-MM 取月初 / 月末"""
+    if len(value) == 7:
+        first = datetime.strptime(value, "%Y-%m").date()
+        if not upper:
+            return first.strftime("%Y-%m-%d")
+        last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        return last.strftime("%Y-%m-%d")
+    datetime.strptime(value, "%Y-%m-%d")
+    return value
+
+def parse_view_range(args):
+    """无参数：本月；一个月份：该月；一个日期：该日至今；两个参数：起止"""
+    today = now().date()
+    if not args:
+        month = today.strftime("%Y-%m")
+        return _range_bound(month, False), _range_bound(month, True)
+    if len(args) == 1:
+        if len(args[0]) == 7:
+            return _range_bound(args[0], False), _range_bound(args[0], True)
+        return _range_bound(args[0], False), today.strftime("%Y-%m-%d")
+    start, end = _range_bound(args[0], False), _range_bound(args[1], True)
+    if start > end:
+        raise ValueError(f"起始 {args[0]} 晚于结束 {args[1]}")
+    return start, end
+
+def _day_block(target_uid, date_key, rec):
+    block = f"📅 {date_key}:\n"
+
+    # HR 记录
+    if target_uid in HR_USERS:
+        for slot, punch in enumerate(rec.hr, start=1):
+            suffix = "" if slot == 1 else f"_{slot}"
+            if punch.checkin is not None:
+                block += f"  checkin{suffix}: {_fmt_clock(punch.checkin)}\n"
+            if punch.checkout is not None:
+                block += f"  checkout{suffix}: {_fmt_clock(punch.checkout)}\n"
+
+    # FINDING 记录
+    if target_uid in FINDING_USERS:
+        if rec.morning is not None:
+            if rec.morning.checkin is not None:
+                block += f"  早班上班: {_fmt_clock(rec.morning.checkin)}\n"
+            if rec.morning.checkout is not None:
+                block += f"  早班下班: {_fmt_clock(rec.morning.checkout)}\n"
+        if rec.night is not None:
+            if rec.night.checkin is not None:
+                block += f"  晚班上班: {_fmt_clock(rec.night.checkin)}\n"
+            if rec.night.checkout is not None:
+                block += f"  晚班下班: {_fmt_clock(rec.night.checkout)}\n"
+
+    # CHATTING 记录
+    if target_uid not in HR_USERS and target_uid not in FINDING_USERS and rec.night is not None:
+        if rec.night.checkin is not None:
+            block += f"  夜班上班: {_fmt_clock(rec.night.checkin)}\n"
+        if rec.night.checkout is not None:
+            block += f"  夜班下班: {_fmt_clock(rec.night.checkout)}\n"
+
+    return block + "\n"
+
+def _render_view_pages(target_uid, start, end):
+    pages = []
+    current = ""
+    count = 0
+    # 留出页眉的位置
+    limit = TELEGRAM_MESSAGE_LIMIT - 200
+    for date_key, rec in get_storage().query_days(target_uid, start, end):
+        block = _day_block(target_uid, date_key, rec)
+        if current and (count >= VIEW_PAGE_DAYS or len(current) + len(block) > limit):
+            pages.append(current)
+            current, count = "", 0
+        current += block
+        count += 1
+    if current:
+        pages.append(current)
+    return pages
+
+def view_pages(target_uid, start, end):
+    key = (target_uid, start, end)
+    version = user_version(target_uid)
+    with _view_cache_lock:
+        cached = _view_cache.get(key)
+        if cached is not None and cached[0] == version:
+            _view_cache.move_to_end(key)
+            return cached[1]
+    pages = _render_view_pages(target_uid, start, end)
+    with _view_cache_lock:
+        _view_cache[key] = (version, pages)
+        _view_cache.move_to_end(key)
+        while len(_view_cache) > VIEW_CACHE_MAX:
+            _view_cache.popitem(last=False)
+    return pages
+
+def _view_page_message(target_uid, start, end, page):
+    """返回 (文本, 按钮)；页码越界时取最近的一页"""
+    pages = view_pages(target_uid, start, end)
+    if not pages:
+        return f"用户 {target_uid} 在 {start} ~ {end} 无考勤记录", None
+    page = min(max(page, 0), len(pages) - 1)
+    text = f"📊 用户 {target_uid} 考勤记录 {start} ~ {end}（{page + 1}/{len(pages)}）\n\n" + pages[page]
+    if len(pages) == 1:
+        return text, None
+    markup = InlineKeyboardMarkup()
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀ Prev", callback_data=f"va:{target_uid}:{start}:{end}:{page - 1}"))
+    if page < len(pages) - 1:
+        buttons.append(InlineKeyboardButton("Next ▶", callback_data=f"va:{target_uid}:{start}:{end}:{page + 1}"))
+    markup.row(*buttons)
+    return text, markup
+
+@bot.message_handler(commands=["view_attendance"])
+def view_attendance(message):
+    uid = message.from_user.id
+    if uid not in ADMIN_IDS:
+        bot.reply_to(message, "❌ 仅管理员可操作")
+        return
+    
+    args = message.text.split()
+    if len(args) < 2:
+        bot.reply_to(
+            message,
+            "用法: /view_attendance <用户ID> [起始] [结束]\n"
+            "例: /view_attendance 6917597442 2024-06\n"
+            "    /view_attendance 6917597442 2024-05-15 2024-06-15"
+        )
+        return
+    
+    try:
+        target_uid = int(args[1])
+        start, end = parse_view_range(args[2:4])
+        text, markup = _view_page_message(target_uid, start, end, 0)
+        bot.reply_to(message, text, reply_markup=markup)
+        
+    except Exception as e:
+        bot.reply_to(message, f"❌ 查看失败: {str(e)}")
+
+@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("va:"))
+def view_attendance_page(call):
+    if call.from_user.id not in ADMIN_IDS:
+        bot.answer_callback_query(call.id, "❌ 仅管理员可操作")
+        return
+    try:
+        _, target_uid, start, end, page = call.data.split(":")
+        text, markup = _view_page_message(int(target_uid), start, end, int(page))
+        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ 翻页失败: {str(e)}")
+
+# ===== 管理员命令：导出月度考勤 =====
+# /export_attendance <YYYY-MM> [role] [csv|xlsx]：生成器逐行产出每个班次，
+# 直接写进临时文件再用 send_document 上传；在后台线程执行，内存占用与人数无关。
+EXPORT_COLUMNS = (
+    "uid", "name", "role", "attribution_date", "shift",
+    "checkin", "checkout", "hours", "late_minutes", "early_leave_minutes",
+    "admin_override_days",
+)
+
+def user_role(uid):
+    if uid in HR_USERS:
+        return "HR"
+    if uid in FINDING_USERS:
+        return "FINDING"
+    return "PROMO"
+
+def _fmt_datetime(ts):
+    return from_epoch(ts).strftime("%Y-%m-%d %H:%M:%S") if ts is not None else ""
+
+def _day_shifts(rec):
+    for slot, punch in enumerate(rec.hr, start=1):
+        yield f"HR_{slot}", punch
+    if rec.morning is not None:
+        yield "MORNING", rec.morning
+    if rec.night is not None:
+        yield "NIGHT", rec.night
+
+def export_rows(month_key, role=None):
+    """表头 + 每个班次一行；迟到 / 早退是按天统计的，只写在当天第一行"""
+    yield EXPORT_COLUMNS
+    start, end = _range_bound(month_key, False), _range_bound(month_key, True)
+    storage = get_storage()
+    uids = set(registered_users_snapshot()) | set(list(ATTENDANCE)) | set(list(ADMIN_OVERRIDES))
+    for uid in sorted(uids):
+        user_role_name = user_role(uid)
+        if role and user_role_name != role:
+            continue
+        override = ADMIN_OVERRIDES.get(uid, {}).get(month_key)
+        name = cached_name(uid)
+        for date_key, rec in storage.query_days(uid, start, end):
+            first = True
+            for shift, punch in _day_shifts(rec):
+                if punch.checkin is None and punch.checkout is None:
+                    continue
+                hours = ""
+                if punch.checkin is not None and punch.checkout is not None:
+                    hours = round((punch.checkout - punch.checkin) / 3600, 2)
+                yield (
+                    uid, name, user_role_name, date_key, shift,
+                    _fmt_datetime(punch.checkin), _fmt_datetime(punch.checkout), hours,
+                    rec.late_minutes if first else "", rec.early_leave_minutes if first else "",
+                    "" if override is None else override,
+                )
+                first = False
+
+def write_export(rows, fmt="csv"):
+    """把行写进临时文件，返回 (路径, 行数)；调用方负责删除"""
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    count = -1   # 不算表头
+    try:
+        if fmt == "xlsx":
+            os.close(fd)
+            from openpyxl import Workbook   # 可选依赖
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet("attendance")
+            for row in rows:
+                ws.append(list(row))
+                count += 1
+            wb.save(path)
+        else:
+            # utf-8-sig：Excel 直接打开不乱码
+            with os.fdopen(fd, "w", encoding="utf-8-sig", newline="") as f:
+                writer = csv.writer(f)
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, count
+
+@bot.message_handler(commands=["export_attendance"])
+def export_attendance(message):
+    uid = message.from_user.id
+    if uid not in ADMIN_IDS:
+        bot.reply_to(message, "❌ 仅管理员可操作")
+        return
+
+    args = message.text.split()
+    if len(args) < 2:
+        bot.reply_to(
+            message,
+            "用法: /export_attendance <年月> [HR|FINDING|PROMO] [csv|xlsx]\n"
+            "例: /export_attendance 2024-06 HR"
+        )
+        return
+
+    month_key = args[1]
+    role = None
+    fmt = "csv"
+    try:
+        if len(month_key) != 7:
+            raise ValueError(f"年月格式应为 YYYY-MM: {month_key}")
+        datetime.strptime(month_key, "%Y-%m")
+        for arg in args[2:]:
+            if arg.lower() in ("csv", "xlsx"):
+                fmt = arg.lower()
+            elif arg.upper() in ("HR", "FINDING", "PROMO"):
+                role = arg.upper()
+            else:
+                raise ValueError(f"未知参数 {arg}")
+    except ValueError as e:
+        bot.reply_to(message, f"❌ 导出失败: {str(e)}")
+        return
+
+    def run():
+        path = None
+        try:
+            path, count = write_export(export_rows(month_key, role), fmt)
+            filename = f"attendance_{month_key}{'_' + role if role else ''}.{fmt}"
+            with open(path, "rb") as f:
+                bot.send_document(
+                    message.chat.id, f,
+                    caption=f"📄 {month_key} 考勤导出：{count} 行",
+                    visible_file_name=filename,
+                )
+        except ImportError:
+            bot.reply_to(message, "❌ 导出 xlsx 需要安装 openpyxl，可以改用 csv")
+        except Exception as e:
+            bot.reply_to(message, f"❌ 导出失败: {str(e)}")
+        finally:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    bot.reply_to(message, f"⏳ 正在导出 {month_key} 考勤…")
+    threading.Thread(target=run, daemon=True).start()
+
+# ===== 管理员命令：月度报表 (NumPy) =====
+# 把一个月的打卡整理成列式数组（每个班次一行），所有人的工时 / 迟到 / 早退
+# 和 admin_overrides 调整一次向量化算完；numpy 是可选依赖，只有这个命令用到。
+# 没有排班表（不知道谁哪天休息），所以不算缺勤。
+SHIFT_KIND_HR, SHIFT_KIND_MORNING, SHIFT_KIND_NIGHT = 0, 1, 2
+MONTH_REPORT_INLINE_MAX = int(os.getenv("MONTH_REPORT_INLINE_MAX", "40"))
+MONTH_REPORT_COLUMNS = (
+    "uid", "name", "role", "worked_days", "override_days", "paid_days",
+    "shifts", "hours", "late_minutes", "early_leave_minutes",
+)
+
+MONTH_COLUMNS_CACHE_MAX = 3
+_month_columns_cache = OrderedDict()   # month_key -> (month_version, columns)
+_month_columns_lock = threading.Lock()
+
+def month_columns(month_key):
+    """按月缓存列式数组，直到这个月有新的修改"""
+    version = _month_versions.get(month_key, 0)
+    with _month_columns_lock:
+        cached = _month_columns_cache.get(month_key)
+        if cached is not None and cached[0] == version:
+            _month_columns_cache.move_to_end(month_key)
+            return cached[1]
+    cols = _build_month_columns(month_key)
+    with _month_columns_lock:
+        _month_columns_cache[month_key] = (version, cols)
+        _month_columns_cache.move_to_end(month_key)
+        while len(_month_columns_cache) > MONTH_COLUMNS_CACHE_MAX:
+            _month_columns_cache.popitem(last=False)
+    return cols
+
+def _build_month_columns(month_key):
+    """{uid, kind, day, checkin, checkout, late, early} 列；缺失的时间为 -1，迟到 / 早退记在当天第一个班次"""
+    import numpy as np
+    uids, kinds, days, checkins, checkouts, lates, earlies = [], [], [], [], [], [], []
+    ensure_month_loaded(month_key)
+    for uid, months in snapshot_attendance(month_key).items():
+        for date_key, rec in months[month_key].items():
+            day = int(date_key[8:10])
+            shifts = [(SHIFT_KIND_HR, punch) for punch in rec.hr]
+            if rec.morning is not None:
+                shifts.append((SHIFT_KIND_MORNING, rec.morning))
+            if rec.night is not None:
+                shifts.append((SHIFT_KIND_NIGHT, rec.night))
+            first = True
+            for kind, punch in shifts:
+                uids.append(uid)
+                kinds.append(kind)
+                days.append(day)
+                checkins.append(-1 if punch.checkin is None else punch.checkin)
+                checkouts.append(-1 if punch.checkout is None else punch.checkout)
+                lates.append(rec.late_minutes if first else 0)
+                earlies.append(rec.early_leave_minutes if first else 0)
+                first = False
+    return {
+        "uid": np.array(uids, dtype=np.int64),
+        "kind": np.array(kinds, dtype=np.int8),
+        "day": np.array(days, dtype=np.int16),
+        "checkin": np.array(checkins, dtype=np.int64),
+        "checkout": np.array(checkouts, dtype=np.int64),
+        "late": np.array(lates, dtype=np.int64),
+        "early": np.array(earlies, dtype=np.int64),
+    }
+
+def report_staff(cols, role=None):
+    """报表里的人：注册用户 + 本月有打卡的人；没打过卡的管理员不算员工"""
+    punched = set(cols["uid"].tolist())
+    staff = {u for u in registered_users_snapshot() if u not in ADMIN_IDS} | punched
+    if role:
+        staff = {u for u in staff if user_role(u) == role}
+    return staff
+
+def compute_month_report(month_key, cols, staff):
+    """staff: 升序 uid 数组；返回每人一项的结果列"""
+    import numpy as np
+    n = len(staff)
+    keep = np.isin(cols["uid"], staff)
+    uid_idx = np.searchsorted(staff, cols["uid"][keep])
+    checkin = cols["checkin"][keep]
+    checkout = cols["checkout"][keep]
+    day = cols["day"][keep].astype(np.int64)
+
+    has_in = checkin >= 0
+    closed = has_in & (checkout >= 0)
+    seconds = np.where(closed, checkout - checkin, 0)
+    hours = np.bincount(uid_idx, weights=seconds, minlength=n) / 3600.0
+    shifts = np.bincount(uid_idx, weights=has_in, minlength=n).astype(np.int64)
+    late = np.bincount(uid_idx, weights=cols["late"][keep], minlength=n).astype(np.int64)
+    early = np.bincount(uid_idx, weights=cols["early"][keep], minlength=n).astype(np.int64)
+    # 出勤天数：(人, 日) 去重
+    worked_keys = np.unique(uid_idx[has_in] * 32 + day[has_in])
+    worked = np.bincount(worked_keys // 32, minlength=n).astype(np.int64)
+
+    override = np.full(n, -1, dtype=np.int64)
+    for uid, months in snapshot_overrides().items():
+        days = months.get(month_key)
+        if days is None:
+            continue
+        pos = np.searchsorted(staff, uid)
+        if pos < n and staff[pos] == uid:
+            override[pos] = days
+    paid = np.where(override >= 0, override, worked)
+    return {
+        "uid": staff, "worked": worked, "override": override, "paid": paid,
+        "shifts": shifts, "hours": hours, "late": late, "early": early,
+    }
+
+def month_report_rows(report):
+    yield MONTH_REPORT_COLUMNS
+    for i, uid in enumerate(report["uid"].tolist()):
+        override = int(report["override"][i])
+        yield (
+            uid, cached_name(uid), user_role(uid), int(report["worked"][i]),
+            "" if override < 0 else override, int(report["paid"][i]), int(report["shifts"][i]),
+            round(float(report["hours"][i]), 2), int(report["late"][i]), int(report["early"][i]),
+        )
+
+@bot.message_handler(commands=["month_report"])
+def month_report(message):
+    uid = message.from_user.id
+    if uid not in ADMIN_IDS:
+        bot.reply_to(message, "❌ 仅管理员可操作")
+        return
+
+    args = message.text.split()
+    month_key = now().strftime("%Y-%m")
+    role = None
+    try:
+        for arg in args[1:]:
+            if arg.upper() in ("HR", "FINDING", "PROMO"):
+                role = arg.upper()
+            elif len(arg) == 7:
+                datetime.strptime(arg, "%Y-%m")
+                month_key = arg
+            else:
+                raise ValueError(f"未知参数 {arg}（用法: /month_report [年月] [HR|FINDING|PROMO]）")
+        import numpy as np
+    except ImportError:
+        bot.reply_to(message, "❌ 月度报表需要安装 numpy")
+        return
+    except ValueError as e:
+        bot.reply_to(message, f"❌ 报表失败: {str(e)}")
+        return
+
+    try:
+        started = time_mod.perf_counter()
+        cols = month_columns(month_key)
+        loaded = time_mod.perf_counter()
+        staff = np.array(sorted(report_staff(cols, role)), dtype=np.int64)
+        report = compute_month_report(month_key, cols, staff)
+        finished = time_mod.perf_counter()
+
+        header = (
+            f"📈 {month_key} 月度报表{' · ' + role if role else ''}\n"
+            f"👥 {len(staff)} 人  🧾 {int(report['shifts'].sum())} 个班次\n"
+            f"⏱ 工时 {report['hours'].sum():.1f} h  迟到 {int(report['late'].sum())} 分钟  "
+            f"早退 {int(report['early'].sum())} 分钟\n"
+            f"⚙️ 加载 {(loaded - started) * 1000:.1f} ms / 计算 {(finished - loaded) * 1000:.1f} ms"
+        )
+        if len(staff) > MONTH_REPORT_INLINE_MAX:
+            # 人多时明细作为 CSV 附件
+            path, count = write_export(month_report_rows(report))
+            try:
+                with open(path, "rb") as f:
+                    bot.send_document(message.chat.id, f, caption=header,
+                                      visible_file_name=f"month_report_{month_key}.csv")
+            finally:
+                os.remove(path)
+            return
+
+        lines = []
+        for row in list(month_report_rows(report))[1:]:
+            (u, name, r, worked, override, paid, shifts, hours, late, early) = row
+            days_text = f"{paid}" if override == "" else f"{paid}（覆盖，实际 {worked}）"
+            lines.append(
+                f"👤 {name or u} ({r})\n"
+                f"   出勤 {days_text} 天  班次 {shifts}  工时 {hours} h  "
+                f"迟到 {late}′  早退 {early}′"
+            )
+        for chunk in chunk_lines(header + "\n", lines) or [header]:
+            bot.reply_to(message, chunk)
+    except Exception as e:
+        bot.reply_to(message, f"❌ 报表失败: {str(e)}")
+
+# ===== Return (回座) =====
+@observe_handler("back")
+@per_user
+def back(message):
+    uid = message.from_user.id
+    name = message.from_user.first_name
+    
+    if uid not in user_activity:
+        safe_pm(uid, "❌ 您当前没有进行中的 activity。")
+        return
+
+    act_data = user_activity.pop(uid)
+    cancel_activity_timeout(uid)
+    mark_runtime_dirty()
+    start_dt = act_data["start_dt"]
+    end_dt = now()
+    
+    diff = end_dt - start_dt
+    minutes = int(diff.total_seconds() // 60)
+    seconds = int(diff.total_seconds() % 60)
+    duration_str = f"{minutes}:{seconds:02d}"
+    
+    timeout_flag = minutes >= ACTIVITY_TIMES.get(act_data["act"], 0)
+    warning = " ⚠️" if timeout_flag else ""
+    s = user_sessions.get(uid, {})
+
+    msg = (
+        f"👤 {name}\n"
+        f"🍽 {s.get('Eating',0)} / {MAX_TIMES['Eating']}  "
+        f"💧 {s.get('ToiletSmall',0)} / {MAX_TIMES['ToiletSmall']}  "
+        f"🚽 {s.get('ToiletLarge',0)} / {MAX_TIMES['ToiletLarge']}  "
+        f"🚬 Smoking: {s.get('Smoking',0)} / {MAX_TIMES['Smoking']}  "
+        f"📝 {s.get('Other',0)} / {MAX_TIMES['Other']}\n\n"
+        f"↩️ Returned\n"
+        f"{act_data['act']}\n"
+        f"Start: {start_dt.strftime('%H:%M:%S')}\n"
+        f"End: {end_dt.strftime('%H:%M:%S')}\n"
+        f"Duration: {duration_str}{warning}"
+    )
+
+    send_group(msg, priority=PRIORITY_ROUTINE)
+    safe_pm(uid, f"✅ 已回座，耗时 {duration_str}", reply_markup=main_keyboard())
+
+@observe_handler("check_out")
+@per_user
+def check_out(uid, name):
+    if uid not in CHECK_IN_STATUS:
+        safe_pm(uid, "❌ 您尚未上班打卡，无需下班。")
+        return
+
+    checkin_info = CHECK_IN_STATUS.pop(uid)
+    in_time = checkin_info["time"]
+    shift_info = checkin_info["shift"]
+    checkin_logical_date = checkin_info["logical_date"]
+    out_time = now()
+
+    # 根据 checkout 时间重新判定归属日期
+    attribution_date = get_attribution_date(checkin_logical_date, out_time, uid, shift_info)
+
+    # 1. 动态计算班次结束时间（仍用 checkin 的 logical_date）
+    shift_end_dt = datetime.combine(checkin_logical_date, shift_info["end"], tzinfo=LOCAL_TZ)
+    if shift_info.get("cross_day"):
+        shift_end_dt += timedelta(days=1)
+    
+    # 2. 计算时长
+    diff = out_time - in_time
+    hours = int(diff.total_seconds() // 3600)
+    minutes = int((diff.total_seconds() % 3600) // 60)
+    seconds = int(diff.total_seconds() % 60)
+    duration_str = f"{hours} hours {minutes} minutes {seconds} seconds"
+    
+    status_msg = "✅ Checked out on time"
+    
+    # 3. 判定早退 (凌晨 00:00 - 02:00 豁免)
+    is_night_finish = (shift_info.get("cross_day") and out_time.time() < time(2, 0))
+    early_leave_minutes = 0
+    
+    if not is_night_finish and out_time < shift_end_dt:
+        early_leave = int((shift_end_dt - out_time).total_seconds() // 60)
+        if early_leave > 5: 
+            early_leave_minutes = early_leave
+            status_msg = f"⚠️ Early Leave: {early_leave} min"
+            late_group_out_msg = f"👤 <a href=\"tg://user?id={uid}\">{name}</a>💸+{uid} 提前下班 ⚠️ Early Leave: {early_leave} min"
+            send_late_notice(late_group_out_msg, parse_mode="HTML")
+
+    # 4. 写入考勤记录（按 attribution_date 写入）
+    month_key = attribution_date.strftime("%Y-%m")
+    date_key = attribution_date.strftime("%Y-%m-%d")
+    out_ts = to_epoch(out_time)
+    with edit_day(uid, month_key, date_key) as day_rec:
+        if shift_info["role"] in ("FINDING", "PROMO"):
+            if shift_info["shift"] == "MORNING":
+                day_rec.morning_punch().checkout = out_ts
+            elif shift_info["shift"] == "NIGHT":
+                day_rec.night_punch().checkout = out_ts
+        else:
+            # HR: 使用对应的 slot
+            day_rec.hr_slot(checkin_info.get("_slot", 1)).checkout = out_ts
+        day_rec.early_leave_minutes = max(day_rec.early_leave_minutes, early_leave_minutes)
+    
+    # 5. 获取月度统计
+    month_shifts, total_days = get_attendance_summary(uid)
+    
+    # 6. 发送通知
+    msg = (
+        f"👤 {name}💸+{uid}【Nexbit-Safe】\n"
+        f"✅ Successfully checked out\n"
+        f"📅 Check-in time: {in_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        f"📅 Check-out time: {out_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        f"⏰ Working hours: {duration_str}\n"
+        f"{status_msg}\n"
+        f"📊 Attendance statistics:\n"
+        f"🗓️ Worked normally this month: {total_days} days"
+    )
+
+    user_sessions.pop(uid, None) 
+    mark_runtime_dirty()
+    send_group(msg)
+    safe_pm(uid, f"🏠 下班成功！\n工作时长：{duration_str}", reply_markup=main_keyboard())
+def safe_pm(uid, text, reply_markup=None, priority=PRIORITY_NORMAL):
+    OUTBOUND.enqueue(bot, uid, text, priority=priority, label="safe_pm", reply_markup=reply_markup)
+
+# ===== 活动超时：单线程定时堆 =====
+# 所有 Eat / Smoking / Pee / Toilet / Other 的超时都放进一个最小堆，由一个线程处理；
+# ↩ Return 时取消；未到期的超时随运行时状态快照 (runtime_state.json) 保存，重启后恢复。
+_timer_lock = threading.Lock()
+_timer_heap = []          # (due_ts, uid, start_ts)，取消的条目惰性丢弃
+_activity_timers = {}     # uid -> {"due", "start", "act", "name"}
+_timer_wakeup = Wakeup()
+
+def schedule_activity_timeout(uid, name, act, start_ts, due_ts):
+    with _timer_lock:
+        _activity_timers[uid] = {"due": due_ts, "start": start_ts, "act": act, "name": name}
+        heapq.heappush(_timer_heap, (due_ts, uid, start_ts))
+    mark_runtime_dirty()
+    _timer_wakeup.set()
+
+def cancel_activity_timeout(uid):
+    with _timer_lock:
+        cancelled = _activity_timers.pop(uid, None) is not None
+    if cancelled:
+        mark_runtime_dirty()
+    _timer_wakeup.set()
+
+def _restore_activity_timer(uid, entry):
+    """重启后恢复一个未到期的超时（调用方持有 _timer_lock）"""
+    _activity_timers[uid] = entry
+    heapq.heappush(_timer_heap, (entry["due"], uid, entry["start"]))
+
+def _fire_activity_timeout(uid, entry):
+    # 🟢【离座超时】两群同步发送 HTML @通知
+    activity_name = ACTIVITY_LABELS.get(entry["act"], entry["act"])
+    timeout_msg = f"⏰ <a href=\"tg://user?id={uid}\">{entry['name']}</a>💸+{uid} 【Nexbit-Safe】 {activity_name} TIMEOUT ⚠️"
+    send_group(timeout_msg, parse_mode="HTML", priority=PRIORITY_ALERT)
+    send_late_notice(timeout_msg, parse_mode="HTML")
+
+def load_activity_timers():
+    """旧版本单独保存的 activity_timers.json：导入一次后删除
+
+    超时现在只保存在 runtime_state.json 里；两边都有同一个人时以 runtime_state.json 为准。
+    """
+    if not os.path.exists(ACTIVITY_TIMERS_FILE):
+        return
+    try:
+        with open(ACTIVITY_TIMERS_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        imported = 0
+        with _timer_lock:
+            for uid_str, entry in data.items():
+                uid = int(uid_str)
+                if uid not in _activity_timers:
+                    _restore_activity_timer(uid, entry)
+                    imported += 1
+        if imported:
+            mark_runtime_dirty()
+        os.remove(ACTIVITY_TIMERS_FILE)
+        print(f"✅ Imported {imported} activity timers from legacy {ACTIVITY_TIMERS_FILE}")
+    except Exception as e:
+        print("❌ Failed to load activity timers:", e)
+
+def activity_timer_tick(now_ts=None):
+    """触发所有到期的超时，返回距离下一个到期的秒数（没有则 None）"""
+    now_ts = now_ts if now_ts is not None else time_mod.time()
+    due = []
+    with _timer_lock:
+        while _timer_heap and _timer_heap[0][0] <= now_ts:
+            due_ts, uid, start_ts = heapq.heappop(_timer_heap)
+            entry = _activity_timers.get(uid)
+            # 已取消 / 已开始新的活动 → 丢弃
+            if entry is None or entry["start"] != start_ts:
+                continue
+            del _activity_timers[uid]
+            due.append((uid, entry))
+        next_ts = _timer_heap[0][0] if _timer_heap else None
+
+    for uid, entry in due:
+        try:
+            _fire_activity_timeout(uid, entry)
+        except Exception as e:
+            print(f"❌ Activity timeout error for {uid}: {e}")
+    if due:
+        mark_runtime_dirty()
+    return None if next_ts is None else max(0.0, next_ts - now_ts)
+
+def activity_timer_loop():
+    while True:
+        wait = activity_timer_tick()
+        _timer_wakeup.wait(wait)
+        _timer_wakeup.clear()
+
+def activity_timer_count():
+    with _timer_lock:
+        return len(_activity_timers)
+
+# ===== 运行时状态快照 (warm restart) =====
+# 上班状态、进行中的活动（含未到期的超时）、本班次活动次数、已发送的未打卡提醒只在内存里，
+# 重启后会出现"尚未上班打卡无法下班"和重复提醒。这些状态变化时标记 dirty，
+# 由持久化线程随考勤一起写进单独的小文件，启动时先恢复。
+RUNTIME_STATE_VERSION = 1
+_runtime_dirty = False
+_runtime_lock = threading.Lock()
+
+def mark_runtime_dirty():
+    global _runtime_dirty
+    with _runtime_lock:
+        _runtime_dirty = True
+    _after_mark()
+
+def _encode_shift(shift):
+    return {k: v.strftime("%H:%M") if isinstance(v, time) else v for k, v in shift.items()}
+
+def _decode_shift(shift):
+    return {k: time.fromisoformat(v) if k in ("start", "end") else v for k, v in shift.items()}
+
+def runtime_state_snapshot():
+    # 每个值都先拷贝一份，避免序列化时被 handler 修改
+    check_in = {}
+    for uid, info in list(CHECK_IN_STATUS.items()):
+        info = dict(info)
+        entry = {
+            "time": to_epoch(info["time"]),
+            "logical_date": info["logical_date"].isoformat(),
+            "shift": _encode_shift(info["shift"]),
+        }
+        if "_slot" in info:
+            entry["slot"] = info["_slot"]
+        check_in[str(uid)] = entry
+    activity = {}
+    for uid, act in list(user_activity.items()):
+        activity[str(uid)] = {"act": act["act"], "start": to_epoch(act["start_dt"])}
+    with _timer_lock:
+        timers = {uid: dict(entry) for uid, entry in _activity_timers.items()}
+    for uid, entry in timers.items():
+        # 超时已触发的活动没有 timer；恢复时只重建还没到期的
+        if str(uid) in activity:
+            activity[str(uid)]["timer"] = {"due": entry["due"], "start": entry["start"], "name": entry["name"]}
+    # 昨天之前的提醒记录已经用不到了
+    oldest = now().date() - timedelta(days=1)
+    return {
+        "version": RUNTIME_STATE_VERSION,
+        "saved_at": int(time_mod.time()),
+        "check_in": check_in,
+        "activity": activity,
+        "sessions": {str(uid): dict(counts) for uid, counts in list(user_sessions.items())},
+        "missed_sent": [
+            [uid, shift_key, day.isoformat()]
+            for uid, shift_key, day in list(MISSED_CHECK_SENT)
+            if day >= oldest
+        ],
+    }
+
+def save_runtime_state():
+    global _runtime_dirty
+    with _runtime_lock:
+        if not _runtime_dirty:
+            return
+        _runtime_dirty = False
+    try:
+        _atomic_write_json(RUNTIME_STATE_FILE, runtime_state_snapshot(), pretty=False)
+    except Exception as e:
+        with _runtime_lock:
+            _runtime_dirty = True
+        print("❌ Failed to save runtime state:", e)
+
+def load_runtime_state():
+    if not os.path.exists(RUNTIME_STATE_FILE):
+        return
+    started = time_mod.perf_counter()
+    try:
+        with open(RUNTIME_STATE_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != RUNTIME_STATE_VERSION:
+            print(f"⚠️ Runtime state version {data.get('version')} not supported, ignoring")
+            return
+        for uid_str, entry in data.get("check_in", {}).items():
+            info = {
+                "time": from_epoch(entry["time"]),
+                "logical_date": datetime.fromisoformat(entry["logical_date"]).date(),
+                "shift": _decode_shift(entry["shift"]),
+            }
+            if "slot" in entry:
+                info["_slot"] = entry["slot"]
+            CHECK_IN_STATUS[int(uid_str)] = info
+        for uid_str, entry in data.get("activity", {}).items():
+            user_activity[int(uid_str)] = {"act": entry["act"], "start_dt": from_epoch(entry["start"])}
+            timer = entry.get("timer")
+            if timer:
+                with _timer_lock:
+                    _restore_activity_timer(int(uid_str), dict(timer, act=entry["act"]))
+        for uid_str, counts in data.get("sessions", {}).items():
+            user_sessions[int(uid_str)] = counts
+        for uid, shift_key, day in data.get("missed_sent", []):
+            MISSED_CHECK_SENT.add((uid, shift_key, datetime.fromisoformat(day).date()))
+        elapsed_ms = (time_mod.perf_counter() - started) * 1000
+        print(
+            f"✅ Runtime state restored in {elapsed_ms:.1f} ms: {len(CHECK_IN_STATUS)} checked in, "
+            f"{len(user_activity)} on break, {len(MISSED_CHECK_SENT)} alerts sent"
+        )
+    except Exception as e:
+        print("❌ Failed to load runtime state:", e)
+
+# ===== Start Activity (开始活动) =====
+@observe_handler("start_activity")
+@per_user
+def start_activity(uid, name, act):
+    register_user(uid)
+
+    user_sessions.setdefault(uid, {"Eating": 0, "ToiletLarge": 0, "ToiletSmall": 0, "Smoking": 0, "Other": 0})
+    user_logs.setdefault(uid, [])
+
+    if uid in user_activity:
+        safe_pm(uid, "❌ Please finish your current activity first.")
+        return
+
+    if uid not in CHECK_IN_STATUS:
+        safe_pm(uid, "❌ Please check in first.")
+        return
+
+    if user_sessions[uid][act] >= MAX_TIMES[act]:
+        safe_pm(uid, f"❌ {ACTIVITY_LABELS[act]} limit reached.")
+        return
+
+    start_dt = now()
+    user_sessions[uid][act] += 1
+
+    user_activity[uid] = {
+        "act": act,
+        "start_dt": start_dt
+    }
+    activity_timeout[uid] = False
+    mark_runtime_dirty()
+
+    display_name = f"{uid}+{name} 【Nexbit-Safe】"
+    activity_name = ACTIVITY_LABELS[act]
+
+    send_group(
+        f"👤 {display_name}\n"
+        f"📅 Time: {start_dt.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        f"✅ Activity: {activity_name}\n"
+        f"⚠️ This is your {ordinal(user_sessions[uid][act])} {activity_name}, "
+        f"remaining {MAX_TIMES[act]-user_sessions[uid][act]} times this shift\n\n"
+        f"👇 Please click [Return] after finishing the activity",
+        priority=PRIORITY_ROUTINE
+    )
+
+    safe_pm(uid, f"✅ {activity_name} started")
+
+    # ===== 超时提醒交给定时堆，↩ Return 时取消 =====
+    start_ts = start_dt.timestamp()
+    schedule_activity_timeout(uid, name, act, start_ts, start_ts + ACTIVITY_TIMES[act] * 60)
+
+# ===== Check In (上班) =====
+@observe_handler("check_in")
+@per_user
+def check_in(uid, name):
+    now_dt = now()
+
+    if uid in CHECK_IN_STATUS:
+        safe_pm(uid, "❌ You are already checked in.")
+        return
+
+    shift_info = get_shift_standard(now_dt, uid)
+    if not shift_info:
+        safe_pm(uid, "⛔ 当前不在你的上班班次时间内")
+        return
+
+    if shift_info["role"] in ("FINDING", "PROMO", "CUSTOM"):
+        night_start = time(19, 0)
+        if shift_info["role"] == "CUSTOM":
+            night_start = time(20, 30)
+        if time(12, 0) <= now_dt.time() < night_start:
+            shift_info = {
+                "role": shift_info["role"],
+                "shift": "NIGHT",
+                "start": night_start,
+                "end": time(10, 30) if shift_info["role"] == "CUSTOM" else time(2, 0),
+                "cross_day": True
+            }
+
+    logical_date = now_dt.date()
+    if (shift_info["role"] in ("FINDING", "PROMO", "CUSTOM")
+        and shift_info.get("shift") == "NIGHT"
+        and now_dt.time() < time(3, 0)):
+        logical_date -= timedelta(days=1)
+
+    shift_start_dt = datetime.combine(logical_date, shift_info["start"], tzinfo=LOCAL_TZ)
+    
+    late_minutes = 0
+    if now_dt > shift_start_dt:
+        late_minutes = int((now_dt - shift_start_dt).total_seconds() // 60)
+
+    CHECK_IN_STATUS[uid] = {
+        "time": now_dt,
+        "logical_date": logical_date,
+        "shift": shift_info
+    }
+
+    month_key = logical_date.strftime("%Y-%m")
+    date_key = logical_date.strftime("%Y-%m-%d")
+    now_ts = to_epoch(now_dt)
+    with edit_day(uid, month_key, date_key) as day_rec:
+        if shift_info["role"] in ("FINDING", "PROMO"):
+            if shift_info["shift"] == "MORNING":
+                day_rec.morning_punch().checkin = now_ts
+            elif shift_info["shift"] == "NIGHT":
+                day_rec.night_punch().checkin = now_ts
+        else:
+            # HR: 找到下一个可用 slot，避免同一天多次打卡互相覆盖
+            slot = day_rec.next_hr_slot()
+            day_rec.hr_slot(slot).checkin = now_ts
+            CHECK_IN_STATUS[uid]["_slot"] = slot
+
+        day_rec.late_minutes = max(day_rec.late_minutes, late_minutes)
+    mark_runtime_dirty()
+
+    msg = f"✅ {name} checked in at {now_dt.strftime('%H:%M:%S')}"
+    if late_minutes > 0:
+        msg += f" ⚠️ Late {late_minutes} min"
+    send_group(msg)
+
+    # 🟢【迟到】异常通知群 @提及
+    if late_minutes > 0:
+        shift_name = f"{shift_info['shift']}".lower() # 获取班次名 (morning / night)
+        late_group_msg = f"👤 <a href=\"tg://user?id={uid}\">{name}</a>💸+{uid}{shift_name} ⚠️ late {late_minutes}min"
+        send_late_notice(late_group_msg, parse_mode="HTML")
+
+    bot_checkin_pm = (
+        f"✅ 已上班 {name} checked in at {now_dt.strftime('%H:%M:%S')}\n"
+        f"👔 班次：{shift_info['role']} {shift_info['shift']}\n"
+        f"⏰ 迟到：{late_minutes} 分钟"
+    )
+    safe_pm(uid, bot_checkin_pm, reply_markup=main_keyboard())
+
+# ===== 群成员变动 → 成员缓存 =====
+@bot.chat_member_handler()
+def on_chat_member(update):
+    if update.chat.id != GROUP_CHAT_ID:
+        return
+    member = update.new_chat_member
+    set_group_membership(member.user.id, _member_status_ok(member.status))
+
+@bot.message_handler(content_types=["new_chat_members", "left_chat_member"])
+def on_member_service_message(message):
+    if message.chat.id != GROUP_CHAT_ID:
+        return
+    for user in message.new_chat_members or []:
+        set_group_membership(user.id, True)
+    if message.left_chat_member:
+        set_group_membership(message.left_chat_member.id, False)
+
+# ===== Handler =====
+@bot.message_handler(func=lambda m: True)
+def handler(message):
+    if message.from_user.is_bot:
+        return
+
+    uid = message.from_user.id
+    name = message.from_user.first_name
+    txt = message.text
+    remember_name(uid, name)
+
+    if "Eat" in txt:
+        start_activity(uid, name, "Eating")
+    elif "Smoking" in txt:
+        start_activity(uid, name, "Smoking")
+    elif "Pee" in txt:
+        start_activity(uid, name, "ToiletSmall")
+    elif "Toilet" in txt:
+        start_activity(uid, name, "ToiletLarge")
+    elif "Other" in txt:
+        start_activity(uid, name, "Other")
+    elif "Check In" in txt:
+        check_in(uid, name)
+    elif "Check Out" in txt:
+        check_out(uid, name)
+    elif "Return" in txt: 
+        back(message)
+
+# ===== Async 运行模式 (BOT_RUNTIME=async) =====
+# AsyncTeleBot 通过 aiohttp 收发消息。上班 / 下班 / 活动 / 回座会拿用户锁、注册用户时同步写盘、
+# 冷月份还要读盘，所以不能在事件循环里跑：交给和同步模式相同的按用户分片线程 (UPDATES)，
+# 同一个人的操作保持顺序；其余命令（会同步调用 Bot API 或读盘）放到默认线程池。
+# 未打卡提醒、活动超时和发送队列都是同一个事件循环里的任务，不再各占一个线程。
+async def handler_async(message):
+    UPDATES.exec_task(handler, message)
+
+def _in_executor(fn):
+    async def run(*args):
+        await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+    run.__name__ = fn.__name__
+    return run
+
+def mirror_handlers(abot):
+    """按同样的顺序和过滤条件，把同步 bot 上的所有 handler 注册到 AsyncTeleBot"""
+    for h in bot.message_handlers:
+        fn = h["function"]
+        callback = handler_async if getattr(fn, "__wrapped__", fn) is handler else _in_executor(fn)
+        abot.register_message_handler(callback, **h["filters"])
+    for h in bot.chat_member_handlers:
+        abot.register_chat_member_handler(_in_executor(h["function"]), **h["filters"])
+    for h in bot.callback_query_handlers:
+        abot.register_callback_query_handler(_in_executor(h["function"]), **h["filters"])
+    return abot
+
+async def activity_timer_task():
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            # tick 会拿定时器锁并标记运行时状态，放到线程池避免阻塞事件循环
+            wait = await loop.run_in_executor(None, activity_timer_tick)
+        except Exception as e:
+            print("❌ activity timer task error:", e)
+            wait = 5
+        await _timer_wakeup.wait_async(wait)
+        _timer_wakeup.clear()
+
+async def missed_checkin_task():
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            # 成员检查 / 取名字可能同步调用 Bot API
+            wait = await loop.run_in_executor(None, missed_checkin_tick)
+        except Exception as e:
+            print("❌ missing checkin task error:", e)
+            wait = 30
+        await _deadline_wakeup.wait_async(min(wait, 3600))
+        _deadline_wakeup.clear()
+
+async def run_async_bot():
+    try:
+        from telebot.async_telebot import AsyncTeleBot
+    except ImportError as e:
+        raise SystemExit(f"❌ BOT_RUNTIME=async requires aiohttp ({e})")
+    if TELEGRAM_API_URL:
+        from telebot import asyncio_helper
+        asyncio_helper.API_URL = TELEGRAM_API_URL
+    abot = mirror_handlers(AsyncTeleBot(BOT_TOKEN))
+    if RECORD_UPDATES_FILE:
+        abot.get_updates = _recording_get_updates_async(abot)
+    clients = {id(bot): abot}
+    if late_bot:
+        clients[id(late_bot)] = AsyncTeleBot(LATE_BOT_TOKEN)
+
+    UPDATES.start()
+    tasks = [
+        asyncio.create_task(OUTBOUND.run_async(clients)),
+        asyncio.create_task(activity_timer_task()),
+        asyncio.create_task(missed_checkin_task()),
+    ]
+    loop = asyncio.get_running_loop()
+    server = None
+    if WEBHOOK_URL:
+        server = make_webhook_server(
+            lambda updates: asyncio.run_coroutine_threadsafe(abot.process_new_updates(updates), loop)
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        await abot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+                               allowed_updates=ALLOWED_UPDATES, drop_pending_updates=True)
+        print(f"🌐 Webhook listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}")
+        polling = loop.create_future()
+    else:
+        await abot.remove_webhook()
+        polling = asyncio.ensure_future(abot.infinity_polling(
+            skip_pending=True,
+            timeout=20,
+            allowed_updates=ALLOWED_UPDATES
+        ))
+    loop.add_signal_handler(signal.SIGTERM, polling.cancel)
+    try:
+        await polling
+    except asyncio.CancelledError:
+        print("🛑 SIGTERM received, stopping async runtime")
+    finally:
+        if server is not None:
+            server.shutdown()
+        # 先跑完已排队的打卡，它们的回复还要经过发送队列
+        await loop.run_in_executor(None, UPDATES.stop)
+        await OUTBOUND.stop_async()
+        for task in tasks[1:]:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await abot.close_session()
+
+# ===== Update 录制 (RECORD_UPDATES_FILE) =====
+# 每行 {"t": 收到时间, "update": 原始 update JSON}；长轮询（sync / async）和 webhook 都会录制。
+# 文件里有用户 ID、名字和消息原文，只在排查 / 压测时临时开启。
+_record_lock = threading.Lock()
+RECORD_STATS = {"recorded": 0, "errors": 0}
+
+def record_updates(items):
+    if not RECORD_UPDATES_FILE or not items:
+        return
+    received = time_mod.time()
+    lines = "".join(json.dumps({"t": received, "update": item}, ensure_ascii=False) + "\n" for item in items)
+    try:
+        with _record_lock:
+            with open(RECORD_UPDATES_FILE, "a", encoding="utf-8") as f:
+                f.write(lines)
+        RECORD_STATS["recorded"] += len(items)
+    except Exception as e:
+        RECORD_STATS["errors"] += 1
+        print("❌ Failed to record updates:", e)
+
+def _recording_get_updates(offset=None, limit=None, timeout=20, allowed_updates=None, long_polling_timeout=20):
+    """替换 TeleBot.get_updates：先录制原始 JSON 再解析"""
+    raw = telebot.apihelper.get_updates(BOT_TOKEN, offset=offset, limit=limit, timeout=timeout,
+                                        allowed_updates=allowed_updates, long_polling_timeout=long_polling_timeout)
+    if offset != -1:   # skip_pending 丢弃的那一批不录
+        record_updates(raw)
+    return [telebot.types.Update.de_json(item) for item in raw]
+
+def _recording_get_updates_async(abot):
+    from telebot import asyncio_helper
+
+    async def get_updates(offset=None, limit=None, timeout=20, allowed_updates=None, request_timeout=None):
+        raw = await asyncio_helper.get_updates(abot.token, offset, limit, timeout, allowed_updates, request_timeout)
+        if offset != -1:
+            record_updates(raw)
+        return [telebot.types.Update.de_json(item) for item in raw]
+    return get_updates
+
+if RECORD_UPDATES_FILE:
+    bot.get_updates = _recording_get_updates
+
+# ===== Webhook 接收 (WEBHOOK_URL) =====
+# 内置 HTTP 服务器接收 Telegram 推送的 update：校验 secret token 后交给工作线程池
+# （同步模式是 TeleBot 的线程池，async 模式是事件循环），立即返回 200。
+# GET /healthz 返回运行状态；本地可以直接把录制的 update JSON POST 到 localhost 测试。
+WEBHOOK_MAX_BODY = 1 << 20
+WEBHOOK_STATS = {"received": 0, "rejected": 0, "invalid": 0}
+_process_started = time_mod.time()
+
+def health_status():
+    return {
+        "status": "ok",
+        "uptime_s": int(time_mod.time() - _process_started),
+        "runtime": BOT_RUNTIME,
+        "storage": get_storage().name,
+        "checked_in": len(CHECK_IN_STATUS),
+        "outbound_depth": OUTBOUND.depth(),
+        "update_shard_depth": UPDATES.depth(),
+        "webhook": dict(WEBHOOK_STATS),
+    }
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    server_version = "AttendanceBot/1.0"
+
+    def _reply(self, code, body=b"", content_type="text/plain"):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/healthz":
+            self._reply(200, json.dumps(health_status()).encode("utf-8"), "application/json")
+        elif path == "/metrics" and self.server.metrics:
+            self._reply(200, render_metrics().encode("utf-8"), METRICS_CONTENT_TYPE)
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        if urlparse(self.path).path != self.server.webhook_path:
+            self._reply(404)
+            return
+        secret = self.server.secret
+        given = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if secret and not hmac.compare_digest(given.encode("utf-8"), secret.encode("utf-8")):
+            WEBHOOK_STATS["rejected"] += 1
+            self._reply(403)
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            if not 0 < length <= WEBHOOK_MAX_BODY:
+                raise ValueError(f"bad body length {length}")
+            payload = json.loads(self.rfile.read(length))
+            # 录制的数据可以是一批 update 的数组
+            items = payload if isinstance(payload, list) else [payload]
+            updates = [telebot.types.Update.de_json(item) for item in items]
+        except Exception as e:
+            WEBHOOK_STATS["invalid"] += 1
+            self._reply(400, str(e).encode("utf-8"))
+            return
+        WEBHOOK_STATS["received"] += len(updates)
+        record_updates(items)
+        self.server.dispatch(updates)
+        self._reply(200)
+
+    def log_message(self, format, *args):
+        # 不逐条打印访问日志
+        pass
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Telegram 最多同时开 40 个连接（max_connections）；默认 backlog 5 在高峰时会丢连接、1 秒后才重连
+    request_queue_size = 64
+
+def make_webhook_server(dispatch=None, host=None, port=None, secret=None):
+    """创建 webhook HTTP 服务器（不启动）；dispatch 接收 Update 列表，默认交给 TeleBot 线程池"""
+    server = WebhookServer(
+        (WEBHOOK_LISTEN if host is None else host, WEBHOOK_PORT if port is None else port),
+        WebhookHandler,
+    )
+    server.dispatch = dispatch or bot.process_new_updates
+    server.webhook_path = urlparse(WEBHOOK_URL).path or "/"
+    server.secret = WEBHOOK_SECRET if secret is None else secret
+    server.metrics = bool(METRICS_PORT) and METRICS_PORT == server.server_address[1]
+    return server
+
+def make_metrics_server(host=None, port=None):
+    """只提供 GET /metrics 和 /healthz（长轮询模式，或 METRICS_PORT 不是 webhook 端口时）"""
+    server = WebhookServer(
+        (METRICS_LISTEN if host is None else host, METRICS_PORT if port is None else port),
+        WebhookHandler,
+    )
+    server.dispatch = None
+    server.webhook_path = None   # 不接收 update
+    server.secret = ""
+    server.metrics = True
+    return server
+
+def webhook_stats_text():
+    st = WEBHOOK_STATS
+    if not WEBHOOK_URL:
+        return "🌐 Webhook: off (long polling)"
+    return f"🌐 Webhook\n  received: {st['received']}  rejected: {st['rejected']}  invalid: {st['invalid']}"
+
+# ===== 运行指标 (METRICS_PORT) =====
+# 实时状态在抓取时读取；Bot API 调用在 telebot 的请求函数外包一层统计。
+MetricGauge("attendance_open_activities", "Users currently away on an activity", lambda: len(user_activity))
+MetricGauge("attendance_checked_in", "Users currently checked in", lambda: len(CHECK_IN_STATUS))
+MetricGauge("attendance_threads", "Live threads", threading.active_count)
+MetricGauge("attendance_outbound_queue_depth", "Messages waiting in the outbound queue",
+            lambda: {(name,): n for name, n in zip(PRIORITY_NAMES, OUTBOUND.depth())}, ("priority",))
+MetricGauge("attendance_update_queue_depth", "Updates waiting in the per-user shards", lambda: sum(UPDATES.depth()))
+MetricGauge("attendance_activity_timers", "Pending activity timeouts", lambda: activity_timer_count())
+MetricGauge("attendance_persist_pending_marks", "Dirty marks not yet flushed", lambda: _dirty_marks)
+
+_api_metrics_installed = False
+
+def _chat_label(chat_id):
+    """只分 group / late_group / private，避免每个用户一条时间序列"""
+    try:
+        chat_id = int(chat_id)
+    except (TypeError, ValueError):
+        return "none"
+    if chat_id == GROUP_CHAT_ID:
+        return "group"
+    if chat_id == LATE_GROUP_ID:
+        return "late_group"
+    return "private" if chat_id > 0 else "other_group"
+
+def _observe_api_call(method_name, chat, started, error=None):
+    API_REQUESTS.inc(method_name, chat)
+    API_SECONDS.observe(time_mod.perf_counter() - started, method_name)
+    if error is not None:
+        code = getattr(error, "error_code", None)
+        API_FAILURES.inc(method_name, chat, str(code) if isinstance(code, int) else type(error).__name__)
+
+def install_api_metrics():
+    """统计所有 Bot API 调用（同步 apihelper 和 async 的 asyncio_helper 都包一层）"""
+    global _api_metrics_installed
+    if _api_metrics_installed:
+        return
+    _api_metrics_installed = True
+    make_request = telebot.apihelper._make_request
+
+    def metered_make_request(token, method_name, method="get", params=None, files=None):
+        chat = _chat_label(params.get("chat_id") if params else None)
+        started = time_mod.perf_counter()
+        try:
+            result = make_request(token, method_name, method, params, files)
+        except Exception as e:
+            _observe_api_call(method_name, chat, started, e)
+            raise
+        _observe_api_call(method_name, chat, started)
+        return result
+    telebot.apihelper._make_request = metered_make_request
+
+    try:
+        from telebot import asyncio_helper
+    except ImportError:
+        return   # 没装 aiohttp，只有同步模式
+    process_request = asyncio_helper._process_request
+
+    async def metered_process_request(token, url, method="get", params=None, files=None, **kwargs):
+        chat = _chat_label(params.get("chat_id") if params else None)
+        started = time_mod.perf_counter()
+        try:
+            result = await process_request(token, url, method, params, files, **kwargs)
+        except Exception as e:
+            _observe_api_call(url, chat, started, e)
+            raise
+        _observe_api_call(url, chat, started)
+        return result
+    asyncio_helper._process_request = metered_process_request
+
+def start_metrics():
+    """METRICS_PORT 设置时开始统计 Bot API 调用并提供 /metrics"""
+    if not METRICS_PORT:
+        return None
+    install_api_metrics()
+    print(f"📈 Metrics at :{METRICS_PORT}/metrics")
+    if WEBHOOK_URL and METRICS_PORT == WEBHOOK_PORT:
+        return None   # webhook 服务器顺带提供
+    server = make_metrics_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ===== 按用户分片的 update 分发 =====
+# TeleBot 默认把 update 丢进共享线程池，同一个人连点 "Check In" 和 "Eat" 可能被两个线程乱序处理。
+# 这里按 from_user.id 把任务固定到一个分片（一个线程 + 一个 FIFO 队列）：
+# 同一个人的操作严格按到达顺序执行，不同的人分散到各个分片并行。
+class UpdateShards:
+    def __init__(self, count):
+        self.count = count
+        self._queues = [queue.Queue() for _ in range(count)]
+        self._threads = []
+        self.stats = [
+            {"processed": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+            for _ in range(count)
+        ]
+
+    @staticmethod
+    def shard_key(args):
+        """message / callback_query / chat_member 都带 from_user；其他按 chat 分片"""
+        obj = args[0] if args else None
+        user = getattr(obj, "from_user", None)
+        if user is not None:
+            return user.id
+        chat = getattr(obj, "chat", None)
+        return chat.id if chat is not None else 0
+
+    def exec_task(self, task, *args, **kwargs):
+        """替换 TeleBot._exec_task；没有启动分片线程（脚本 / 测试）时直接执行"""
+        if not self._threads:
+            task(*args, **kwargs)
+            return
+        shard = self.shard_key(args) % self.count
+        self._queues[shard].put((time_mod.monotonic(), task, args, kwargs))
+
+    def _worker(self, shard):
+        tasks = self._queues[shard]
+        st = self.stats[shard]
+        while True:
+            item = tasks.get()
+            if item is None:
+                return
+            enqueued, task, args, kwargs = item
+            try:
+                task(*args, **kwargs)
+            except Exception as e:
+                st["errors"] += 1
+                print(f"❌ Update shard {shard} handler error:", e)
+            # 排队 + 处理的总耗时
+            elapsed = (time_mod.monotonic() - enqueued) * 1000
+            st["processed"] += 1
+            st["total_ms"] += elapsed
+            st["max_ms"] = max(st["max_ms"], elapsed)
+
+    def start(self):
+        if self._threads:
+            return
+        for shard in range(self.count):
+            t = threading.Thread(target=self._worker, args=(shard,), name=f"update-shard-{shard}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=5.0):
+        """处理完已排队的 update 再退出"""
+        threads, self._threads = self._threads, []
+        for tasks in self._queues:
+            tasks.put(None)
+        deadline = time_mod.monotonic() + timeout
+        for t in threads:
+            t.join(max(0.0, deadline - time_mod.monotonic()))
+
+    def depth(self):
+        return [tasks.qsize() for tasks in self._queues]
+
+    def stats_text(self):
+        lines = ["🧵 Update shards"]
+        for shard, (depth, st) in enumerate(zip(self.depth(), self.stats)):
+            avg = st["total_ms"] / st["processed"] if st["processed"] else 0.0
+            lines.append(
+                f"  #{shard}: depth {depth}  processed {st['processed']}  errors {st['errors']}  "
+                f"latency ms avg {avg:.1f} / max {st['max_ms']:.1f}"
+            )
+        return "\n".join(lines)
+
+UPDATES = UpdateShards(UPDATE_WORKERS)
+bot._exec_task = UPDATES.exec_task
+
+# ===== Run =====
+# ===== Persistent storage & patches =====
+DATA_FILE = "/data/attendance.json"
+REGISTER_FILE = "/data/registered_users.json"
+USER_NAMES_FILE = "/data/user_names.json"
+JOURNAL_FILE = "/data/attendance.journal.jsonl"
+ACTIVITY_TIMERS_FILE = "/data/activity_timers.json"
+RUNTIME_STATE_FILE = "/data/runtime_state.json"
+SQLITE_FILE = "/data/attendance.db"
+MONTHS_DIR = "/data/attendance_months"
+BINARY_SNAPSHOT_FILE = "/data/attendance.snapshot"
+
+# Patch 3: get_attendance_summary — auto-calc only, no admin override
+_original_get_attendance_summary = get_attendance_summary
+def get_attendance_summary(uid):
+    return _original_get_attendance_summary(uid)
+
+# Patch 5: /set_month_shifts admin command
+@bot.message_handler(commands=["set_month_shifts"])
+def set_month_shifts(message):
+    uid = message.from_user.id
+    if uid not in ADMIN_IDS:
+        bot.reply_to(message, "❌ 仅管理员可操作")
+        return
+
+    args = message.text.split()
+    if len(args) < 4:
+        bot.reply_to(
+            message,
+            "用法: /set_month_shifts <用户ID> <年月> <天数>\n"
+            "例: /set_month_shifts 6917597442 2024-06 22"
+        )
+        return
+
+    try:
+        target_uid = int(args[1])
+        month_key = args[2]
+        override_days = int(args[3])
+
+        set_admin_override(target_uid, month_key, override_days)
+        bot.reply_to(
+            message,
+            f"✅ 已设置用户 {target_uid} 在 {month_key} 的月度工作天数为 {override_days} 天"
+        )
+    except Exception as e:
+        bot.reply_to(message, f"❌ 设置失败: {str(e)}")
+
+# Patch 6: /batch_set_month_shifts — bulk set work days
+@bot.message_handler(commands=["batch_set_month_shifts"])
+def batch_set_month_shifts(message):
+    uid = message.from_user.id
+    if uid not in ADMIN_IDS:
+        bot.reply_to(message, "❌ 仅管理员可操作")
+        return
+
+    args = message.text.split()
+    if len(args) < 4:
+        bot.reply_to(
+            message,
+            "用法: /batch_set_month_shifts <年月> <天数> <用户ID1> <用户ID2> ...\n"
+            "例: /batch_set_month_shifts 2026-06 5 6438074082 8349071207 8338442147"
+        )
+        return
+
+    try:
+        month_key = args[1]
+        override_days = int(args[2])
+        user_ids = args[3:]
+
+        results = []
+        for uid_str in user_ids:
+            try:
+                target_uid = int(uid_str)
+                set_admin_override(target_uid, month_key, override_days)
+                results.append(f"✅ {target_uid}")
+            except Exception:
+                results.append(f"❌ {uid_str}")
+
+        bot.reply_to(
+            message,
+            f"批量设置完成 ({month_key}, {override_days}天):\n" + "\n".join(results)
+        )
+    except Exception as e:
+        bot.reply_to(message, f"❌ 批量设置失败: {str(e)}")
+
+# /perf_stats — 管理员查看运行指标
+@bot.message_handler(commands=["perf_stats"])
+def perf_stats(message):
+    uid = message.from_user.id
+    if uid not in ADMIN_IDS:
+        bot.reply_to(message, "❌ 仅管理员可操作")
+        return
+    bot.reply_to(message, "\n\n".join([
+        persist_stats_text(),
+        missed_check_stats_text(),
+        membership_stats_text(),
+        f"⏳ Pending activity timeouts: {activity_timer_count()}",
+        OUTBOUND.stats_text(),
+        name_cache_stats_text(),
+        webhook_stats_text(),
+        UPDATES.stats_text(),
+    ]))
+
+# /warm_names — 批量预热显示名缓存（后台执行）
+@bot.message_handler(commands=["warm_names"])
+def warm_names(message):
+    uid = message.from_user.id
+    if uid not in ADMIN_IDS:
+        bot.reply_to(message, "❌ 仅管理员可操作")
+        return
+
+    def run():
+        refreshed, failed = warm_name_cache(sorted(REGISTERED_USERS))
+        bot.reply_to(message, f"✅ 名字缓存预热完成：刷新 {refreshed} 人，失败 {failed} 人")
+
+    bot.reply_to(message, f"⏳ 正在预热 {len(REGISTERED_USERS)} 个用户的名字缓存…")
+    threading.Thread(target=run, daemon=True).start()
+
+def instrument_handlers():
+    """所有已注册的 handler 包一层计时（标签是函数名）"""
+    for handlers in (bot.message_handlers, bot.chat_member_handlers, bot.callback_query_handlers):
+        for h in handlers:
+            fn = h["function"]
+            if getattr(fn, "observed_as", None) is None:
+                h["function"] = observe_handler(fn.__name__)(fn)
+
+instrument_handlers()
+
+def reorder_handlers():
+    """Reorder handlers: command handlers before catch-all"""
+    try:
+        hl = bot.message_handlers
+        catch_idx = None
+        cmd_handlers = []
+        for i, h in enumerate(hl):
+            fn = getattr(h.get('function'), '__name__', '')
+            cmd = h.get('filters', {}).get('commands') if isinstance(h, dict) else None
+            if cmd:
+                cmd_handlers.append((i, h, fn))
+            if fn == 'handler' and not cmd:
+                catch_idx = i
+
+        if catch_idx is not None and cmd_handlers:
+            # Pop all command handlers that are after catch-all, then insert before catch-all
+            moved = []
+            for idx, h, fn in reversed(cmd_handlers):
+                if idx > catch_idx:
+                    moved.append((fn, hl.pop(idx)))
+            moved.reverse()
+            new_catch = next(i for i, h in enumerate(hl)
+                if getattr(h.get('function'), '__name__', '') == 'handler'
+                and not h.get('filters', {}).get('commands'))
+            for fn, h in moved:
+                hl.insert(new_catch, h)
+                new_catch += 1
+            moved_names = [n for n, _ in moved]
+            print(f"✅ Handler order: {moved_names} before catch-all")
+    except Exception as e:
+        print("❌ Handler reorder failed:", e)
+
+def _handle_sigterm(signum, frame):
+    print("🛑 SIGTERM received, flushing attendance")
+    # SystemExit 会触发 atexit 里的最终 flush
+    raise SystemExit(0)
+
+print("✅ All patches applied, data path: /data/")
+
+if __name__ == "__main__":
+    if "--migrate-sqlite" in sys.argv[1:]:
+        # 一次性迁移: python bot.py --migrate-sqlite，之后设置 STORAGE_BACKEND=sqlite
+        sys.exit(0 if migrate_json_to_sqlite() else 1)
+    if "--snapshot-to-binary" in sys.argv[1:]:
+        # JSON ⇄ 二进制快照互转；之后设置 STORAGE_BACKEND=binary（或改回 json）
+        json_to_binary()
+        sys.exit(0)
+    if "--snapshot-to-json" in sys.argv[1:]:
+        binary_to_json()
+        sys.exit(0)
+
+    load_attendance()
+    load_registered_users()
+    load_user_names()
+    load_runtime_state()
+
+    reorder_handlers()
+    if RECORD_UPDATES_FILE:
+        print(f"🎙 Recording updates to {RECORD_UPDATES_FILE}")
+
+    start_persistence_worker()
+    atexit.register(stop_persistence_worker)
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    load_activity_timers()
+    start_metrics()
+
+    if BOT_RUNTIME == "async":
+        print(f"🤖 Bot started (async runtime, {get_storage().name} persistence at /data/)")
+        asyncio.run(run_async_bot())
+        sys.exit(0)
+
+    OUTBOUND.start()
+    atexit.register(OUTBOUND.stop)
+    UPDATES.start()
+    atexit.register(UPDATES.stop)
+    threading.Thread(target=activity_timer_loop, daemon=True).start()
+    threading.Thread(target=check_missing_checkins, daemon=True).start()
+
+    print(f"🤖 Bot started ({get_storage().name} persistence at /data/)")
+
+    if WEBHOOK_URL:
+        server = make_webhook_server()
+        bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+                        allowed_updates=ALLOWED_UPDATES, drop_pending_updates=True)
+        print(f"🌐 Webhook listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        sys.exit(0)
+
+    # 之前用过 webhook 的话，长轮询前要先删除
+    bot.remove_webhook()
+    bot.infinity_polling(
+        skip_pending=True,
+        timeout=20,
+        long_polling_timeout=20,
+        allowed_updates=ALLOWED_UPDATES
+    )
+
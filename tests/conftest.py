@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import workload  # noqa: E402  导入时补齐 BOT_TOKEN 等环境变量
+
+
+@pytest.fixture
+def bot(tmp_path):
+    """数据文件放到 tmp_path，Telegram 调用换成 stub，内存状态清空"""
+    bot = workload.bot
+    workload.sandbox(str(tmp_path))
+    workload.install_stub()
+    bot.ATTENDANCE.clear()
+    bot.MONTH_STATS.clear()
+    bot.ADMIN_OVERRIDES.clear()
+    bot._dirty_days.clear()
+    bot._dirty_overrides.clear()
+    bot._dirty_marks = 0
+    return bot
@@ -0,0 +1,95 @@
+from datetime import datetime
+
+
+def _day(bot, checkin):
+    rec = bot.DayRecord()
+    rec.hr_slot(1).checkin = checkin
+    rec.hr_slot(1).checkout = checkin + 8 * 3600
+    rec.late_minutes = 3
+    return rec
+
+
+def _write_old_snapshot(bot, monkeypatch, path, months):
+    """写一个"旧版本"快照：版本号 0，单日格式和 v1 相同"""
+    monkeypatch.setitem(bot.SNAPSHOT_DAY_DECODERS, 0, bot._decode_day_v1)
+    monkeypatch.setattr(bot, "SNAPSHOT_VERSION", 0)
+    bot.write_binary_snapshot(path, {mk: bot.encode_month_blob(users) for mk, users in months.items()}, {})
+    monkeypatch.setattr(bot, "SNAPSHOT_VERSION", 1)
+
+
+def _open_storage(bot, monkeypatch):
+    monkeypatch.setattr(bot, "now", lambda: datetime(2026, 10, 17, 12, 0, tzinfo=bot.LOCAL_TZ))
+    storage = bot.BinarySnapshotStorage(bot.BINARY_SNAPSHOT_FILE)
+    monkeypatch.setattr(bot, "STORAGE", storage)
+    storage.load_attendance()
+    return storage
+
+
+def test_old_version_cold_month_survives_snapshot(bot, monkeypatch):
+    cold = {1: {"2026-03-02": _day(bot, 1772413200)}}
+    hot = {1: {"2026-10-16": _day(bot, 1792112400)}}
+    _write_old_snapshot(bot, monkeypatch, bot.BINARY_SNAPSHOT_FILE, {"2026-03": cold, "2026-10": hot})
+
+    storage = _open_storage(bot, monkeypatch)
+    assert "2026-03" not in storage._loaded
+    assert storage.snapshot()
+    storage.close()
+
+    snap = bot.BinarySnapshot(bot.BINARY_SNAPSHOT_FILE)
+    try:
+        assert snap.version == 1
+        assert snap.decode_month("2026-03")[1]["2026-03-02"].hr[0].checkin == 1772413200
+        assert snap.decode_month("2026-10")[1]["2026-10-16"].late_minutes == 3
+    finally:
+        snap.close()
+
+
+def test_unloaded_dirty_month_is_merged_not_blanked(bot, monkeypatch):
+    cold = {1: {"2026-03-02": _day(bot, 1772413200)}, 2: {"2026-03-03": _day(bot, 1772499600)}}
+    _write_old_snapshot(bot, monkeypatch, bot.BINARY_SNAPSHOT_FILE, {"2026-03": cold})
+
+    storage = _open_storage(bot, monkeypatch)
+    assert storage._write_months({"2026-03"}, False)
+    storage.close()
+
+    snap = bot.BinarySnapshot(bot.BINARY_SNAPSHOT_FILE)
+    try:
+        assert sorted(snap.decode_month("2026-03")) == [1, 2]
+    finally:
+        snap.close()
+
+
+def test_snapshot_write_does_not_block_month_loads(bot, monkeypatch):
+    import threading
+
+    _write_old_snapshot(bot, monkeypatch, bot.BINARY_SNAPSHOT_FILE, {
+        "2026-03": {1: {"2026-03-02": _day(bot, 1772413200)}},
+        "2026-10": {1: {"2026-10-16": _day(bot, 1792112400)}},
+    })
+    storage = _open_storage(bot, monkeypatch)
+
+    writing, release = threading.Event(), threading.Event()
+    real_write = bot.write_binary_snapshot
+
+    def slow_write(*args):
+        writing.set()
+        release.wait(5)
+        real_write(*args)
+    monkeypatch.setattr(bot, "write_binary_snapshot", slow_write)
+
+    result = []
+    writer = threading.Thread(target=lambda: result.append(storage.snapshot()))
+    writer.start()
+    try:
+        assert writing.wait(5)
+        # 快照正在写盘时，打卡路径上的 ensure_month 不应该等它
+        loader = threading.Thread(target=storage.ensure_month, args=("2026-03",))
+        loader.start()
+        loader.join(1)
+        assert not loader.is_alive()
+        assert bot.ATTENDANCE[1]["2026-03"]["2026-03-02"].hr[0].checkin == 1772413200
+    finally:
+        release.set()
+        writer.join(5)
+    assert result == [True]
+    storage.close()
@@ -0,0 +1,27 @@
+def test_round_trip_keeps_later_slot_after_empty_first_slot(bot):
+    # 第 2 段 HR 班跨零点下班：次日记录只有 checkout_2
+    rec = bot.DayRecord()
+    rec.hr_slot(2).checkout = 1760745600
+    data = rec.to_json()
+    assert data["checkout_2"]
+
+    loaded = bot.DayRecord.from_json(data)
+    assert [(p.checkin, p.checkout) for p in loaded.hr] == [(None, None), (None, 1760745600)]
+    assert loaded.to_json() == data
+
+
+def test_round_trip_multiple_slots(bot):
+    rec = bot.DayRecord()
+    rec.hr_slot(1).checkin = 1760680800
+    rec.hr_slot(1).checkout = 1760716800
+    rec.hr_slot(3).checkin = 1760720400
+    rec.late_minutes = 7
+
+    loaded = bot.DayRecord.from_json(rec.to_json())
+    assert [(p.checkin, p.checkout) for p in loaded.hr] == [
+        (1760680800, 1760716800), (None, None), (1760720400, None)]
+    assert loaded.late_minutes == 7
+
+
+def test_empty_record_has_no_slots(bot):
+    assert bot.DayRecord.from_json(bot.DayRecord().to_json()).hr == []
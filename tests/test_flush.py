@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def json_storage(bot, monkeypatch):
+    monkeypatch.setattr(bot, "JOURNAL_ENABLED", True)
+    monkeypatch.setattr(bot, "_persist_thread", object())   # 只标记 dirty，测试里显式 flush
+    monkeypatch.setattr(bot, "STORAGE", bot.make_storage("json"))
+    return bot.STORAGE
+
+
+def test_bad_entry_is_dropped_and_rest_of_batch_is_journaled(bot, json_storage):
+    with bot.edit_day(1, "2026-10", "2026-10-17") as rec:
+        rec.late_minutes = 4
+    # 内存里已经没有的一天：编码会 KeyError
+    bot.mark_dirty(2, "2026-10", "2026-10-17")
+
+    dropped = bot.PERSIST_STATS["dropped"]
+    assert bot.flush_dirty() == 2
+    assert bot.PERSIST_STATS["dropped"] == dropped + 1
+    assert not bot._dirty_days
+
+    with open(bot.JOURNAL_FILE, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert [(e["uid"], e["day"]) for e in entries] == [(1, "2026-10-17")]
+
+
+def test_failed_write_keeps_batch_dirty(bot, json_storage, monkeypatch):
+    with bot.edit_day(1, "2026-10", "2026-10-17") as rec:
+        rec.late_minutes = 4
+
+    def no_space(days, overrides):
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(json_storage, "write_changes", no_space)
+    with pytest.raises(OSError):
+        bot.flush_dirty()
+    assert bot._dirty_days == {(1, "2026-10", "2026-10-17")}
+
+    monkeypatch.delattr(json_storage, "write_changes")
+    assert bot.flush_dirty() == 1
+    assert not bot._dirty_days
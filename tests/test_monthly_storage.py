@@ -0,0 +1,83 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+
+def _day(bot, checkin):
+    rec = bot.DayRecord()
+    rec.hr_slot(1).checkin = checkin
+    return rec
+
+
+def _seed(bot, backend):
+    """2026-01 / 2026-03 两个冷月份，各两个人"""
+    months = {
+        mk: {1: {f"{mk}-05": _day(bot, 1767600000)}, 2: {f"{mk}-06": _day(bot, 1767686400)}}
+        for mk in ("2026-01", "2026-03")
+    }
+    if backend == "binary":
+        bot.write_binary_snapshot(
+            bot.BINARY_SNAPSHOT_FILE, {mk: bot.encode_month_blob(users) for mk, users in months.items()}, {})
+        return
+    os.makedirs(bot.MONTHS_DIR)
+    for mk, users in months.items():
+        with open(os.path.join(bot.MONTHS_DIR, f"{mk}.json"), "w", encoding="utf-8") as f:
+            json.dump({str(uid): {d: rec.to_json() for d, rec in days.items()} for uid, days in users.items()}, f)
+
+
+def _on_disk(bot, backend, month_key):
+    """{uid: {date_key: DayRecord}}"""
+    if backend == "binary":
+        snap = bot.BinarySnapshot(bot.BINARY_SNAPSHOT_FILE)
+        try:
+            return snap.decode_month(month_key)
+        finally:
+            snap.close()
+    with open(os.path.join(bot.MONTHS_DIR, f"{month_key}.json"), encoding="utf-8") as f:
+        return {int(uid): {d: bot.DayRecord.from_json(rec) for d, rec in days.items()} for uid, days in json.load(f).items()}
+
+
+@pytest.fixture
+def storage_for(bot, monkeypatch):
+    def make(backend, journal):
+        monkeypatch.setattr(bot, "now", lambda: datetime(2026, 10, 17, 12, 0, tzinfo=bot.LOCAL_TZ))
+        monkeypatch.setattr(bot, "JOURNAL_ENABLED", journal)
+        monkeypatch.setattr(bot, "MAX_COLD_MONTHS", 1)
+        # 假装后台线程在跑：handler 只标记 dirty，由测试显式 flush_dirty()
+        monkeypatch.setattr(bot, "_persist_thread", object())
+        _seed(bot, backend)
+        storage = bot.make_storage(backend)
+        monkeypatch.setattr(bot, "STORAGE", storage)
+        bot.load_attendance()
+        return storage
+    return make
+
+
+@pytest.mark.parametrize("backend", ["monthly", "binary"])
+@pytest.mark.parametrize("journal", [False, True])
+def test_edited_cold_month_is_not_evicted_before_flush(bot, storage_for, backend, journal):
+    storage = storage_for(backend, journal)
+    with bot.edit_day(1, "2026-01", "2026-01-05") as rec:
+        rec.late_minutes = 9
+    # 另一个冷月份被读进来，LRU 只能留 1 个冷月份
+    storage.query_days(2, "2026-03-01", "2026-03-31")
+
+    assert bot.flush_dirty() == 1
+    assert storage.snapshot()
+    storage.close()
+
+    month = _on_disk(bot, backend, "2026-01")
+    assert month[1]["2026-01-05"].late_minutes == 9
+    assert "2026-01-06" in month[2]
+
+
+@pytest.mark.parametrize("backend", ["monthly", "binary"])
+def test_writing_unloaded_month_merges_with_disk(bot, storage_for, backend):
+    storage = storage_for(backend, False)
+    assert "2026-01" not in storage._loaded
+    assert storage._write_months({"2026-01"}, False)
+    storage.close()
+
+    assert sorted(_on_disk(bot, backend, "2026-01")) == [1, 2]
@@ -0,0 +1,18 @@
+def test_view_pages_include_unflushed_punch(bot, monkeypatch):
+    storage = bot.make_storage("sqlite")
+    monkeypatch.setattr(bot, "STORAGE", storage)
+    monkeypatch.setattr(bot, "_persist_thread", object())   # 不自动 flush，模拟 PERSIST_INTERVAL 内
+    monkeypatch.setattr(bot, "HR_USERS", {1})
+    bot.load_attendance()
+    try:
+        with bot.edit_day(1, "2026-10", "2026-10-17") as rec:
+            rec.hr_slot(1).checkin = 1792209600
+
+        assert [d for d, _ in storage.query_days(1, "2026-10-01", "2026-10-31")] == ["2026-10-17"]
+        pages = bot.view_pages(1, "2026-10-01", "2026-10-31")
+        assert "2026-10-17" in "".join(pages)
+        # flush 之后缓存的页面仍然正确
+        bot.flush_dirty()
+        assert bot.view_pages(1, "2026-10-01", "2026-10-31") == pages
+    finally:
+        storage.close()